@@ -0,0 +1,132 @@
+"""
+Cost-based admission control for heavy requests
+
+Every request is given an estimated cost from its carrier pixel count and
+payload size before any pixels are decoded. A request is admitted only
+while the cost of all requests in flight stays within the CPU and memory
+budgets of the process; otherwise it is refused with an estimate of when
+enough work will have finished.
+"""
+from collections import namedtuple
+import threading
+import time
+
+# Rough peak memory while embedding or extracting: the decoded carrier,
+# the tile being modified and the encoder's buffers per pixel, and the
+# audio, its compressed copy and the container per payload byte
+MEMORY_PER_PIXEL = 6
+MEMORY_PER_PAYLOAD_BYTE = 3
+
+# CPU cost is counted in pixels; compressing a payload byte costs about
+# as much as inflating and deflating one pixel
+CPU_PER_PAYLOAD_BYTE = 1
+
+Cost = namedtuple('Cost', 'cpu memory')
+
+
+def estimate_cost(pixels, payload_bytes):
+    """
+    Estimate the cost of processing a carrier and payload.
+
+    Args:
+        pixels: Carrier pixels (from image headers only)
+        payload_bytes: Size of the uploaded payload or request body
+
+    Returns:
+        Cost(cpu, memory), with cpu in pixel units and memory in bytes
+    """
+    return Cost(pixels + payload_bytes * CPU_PER_PAYLOAD_BYTE,
+                pixels * MEMORY_PER_PIXEL + payload_bytes * MEMORY_PER_PAYLOAD_BYTE)
+
+
+class Overloaded(Exception):
+    """Raised when a request does not fit the budgets; retry_after is in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Server is busy, try again in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """Admitted work; release() returns its cost to the budgets (only the first call counts)."""
+
+    def __init__(self, controller, cost):
+        self.cost = cost
+        self.started = time.perf_counter()
+        self._controller = controller
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self)
+
+
+class AdmissionController:
+    """
+    Admits requests while their summed cost fits a CPU and a memory budget.
+
+    A request costing more than a whole budget is still admitted when
+    nothing else is in flight, so it can run (alone) rather than never.
+
+    Args:
+        cpu_budget: Pixel units of work in flight at once
+        memory_budget: Bytes of estimated peak memory in flight at once
+        max_retry_after: Upper bound of the Retry-After estimate, in seconds
+    """
+
+    def __init__(self, cpu_budget, memory_budget, max_retry_after=60):
+        self.cpu_budget = cpu_budget
+        self.memory_budget = memory_budget
+        self.max_retry_after = max_retry_after
+        self.admitted = 0
+        self.rejected = 0
+        self._cpu = 0
+        self._memory = 0
+        self._in_flight = 0
+        # Moving average of seconds per unit of CPU cost, for Retry-After
+        self._seconds_per_unit = 1e-7
+        self._lock = threading.Lock()
+
+    def admit(self, cost):
+        """
+        Reserve cost from the budgets.
+
+        Returns:
+            A Ticket to release once the work is done
+
+        Raises:
+            Overloaded: If the work in flight leaves no room for cost
+        """
+        with self._lock:
+            cpu_over = self._cpu + cost.cpu - self.cpu_budget
+            memory_over = self._memory + cost.memory - self.memory_budget
+            if self._in_flight and (cpu_over > 0 or memory_over > 0):
+                self.rejected += 1
+                # Time until enough of the work in flight has finished
+                excess = max(cpu_over, memory_over * self._cpu / max(self._memory, 1))
+                retry_after = min(self.max_retry_after,
+                                  max(1, round(excess * self._seconds_per_unit)))
+                raise Overloaded(retry_after)
+            self._cpu += cost.cpu
+            self._memory += cost.memory
+            self._in_flight += 1
+            self.admitted += 1
+        return Ticket(self, cost)
+
+    def stats(self):
+        """Work in flight against the budgets, and admission counters."""
+        with self._lock:
+            return {'in_flight': self._in_flight, 'cpu': self._cpu, 'cpu_budget': self.cpu_budget,
+                    'memory': self._memory, 'memory_budget': self.memory_budget,
+                    'admitted': self.admitted, 'rejected': self.rejected,
+                    'seconds_per_megapixel': round(self._seconds_per_unit * 1e6, 4)}
+
+    def _release(self, ticket):
+        elapsed = time.perf_counter() - ticket.started
+        with self._lock:
+            self._cpu -= ticket.cost.cpu
+            self._memory -= ticket.cost.memory
+            self._in_flight -= 1
+            if ticket.cost.cpu:
+                self._seconds_per_unit += 0.2 * (elapsed / ticket.cost.cpu - self._seconds_per_unit)
@@ -1,15 +1,34 @@
-from flask import Flask, render_template, request, send_file, flash, redirect, url_for, Response, jsonify, g
+from flask import Flask, Request, render_template, request, send_file, flash, redirect, url_for, Response, jsonify, g, current_app, has_request_context, stream_with_context, make_response
 import os
+import shutil
+import tempfile
 import logging
 from werkzeug.utils import secure_filename
 from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.exceptions import RequestEntityTooLarge
-from functools import wraps
+from werkzeug.wsgi import ClosingIterator
+from functools import wraps, lru_cache
 import time
 from datetime import timedelta
-from steganography import encode, decode, encode_audio, decode_audio
+from steganography import (encode, decode, encode_audio, decode_audio_stream, encode_batch, decode_batch, image_size,
+                           encode_audio_shards, decode_audio_shards, choose_output_profile,
+                           check_audio_capacity, choose_codec, estimate_compressed_size, set_timing_hook,
+                           MAX_BITS_PER_CHANNEL, CODECS, OUTPUT_PROFILES)
+from jobs import JobManager, QueueFull, DONE
+from cache import create_cache
+from metrics import Registry, BYTES_BUCKETS, PIXELS_BUCKETS
+from ratelimit import create_rate_limiter
+from storage import StorageManager
+from carriers import CarrierPool, carrier_size_for
+from admission import AdmissionController, Overloaded, estimate_cost
+from PIL import Image
+import math
+import hashlib
 import io
+import json
+import magic
 import secrets
+import zipfile
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -17,20 +36,422 @@ app = Flask(__name__)
 # Configuration
 app.config.update(
     SECRET_KEY=os.environ.get('FLASK_SECRET_KEY', secrets.token_hex(32)),
-    UPLOAD_FOLDER='uploads',
-    OUTPUT_FOLDER='outputs',
+    UPLOAD_FOLDER=os.environ.get('UPLOAD_FOLDER', 'uploads'),  # Uploads and results that spill out of memory
+    OUTPUT_FOLDER=os.environ.get('OUTPUT_FOLDER', 'outputs'),  # Decoded audio and job results
     MAX_CONTENT_LENGTH=100 * 1024 * 1024,  # 100MB max file size (reduced from 1GB for security)
-    UPLOAD_EXTENSIONS={'.png', '.jpg', '.jpeg', '.bmp', '.mp3', '.wav', '.ogg', '.webm', '.m4a'},
+    UPLOAD_EXTENSIONS={'.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp', '.mp3', '.wav', '.ogg', '.webm', '.m4a'},
     SESSION_COOKIE_SECURE=True,
     SESSION_COOKIE_HTTPONLY=True,
     SESSION_COOKIE_SAMESITE='Lax',
     PERMANENT_SESSION_LIFETIME=timedelta(hours=1),
-    RATELIMIT_DEFAULT='200 per hour'
+    RATELIMIT_DEFAULT=os.environ.get('RATELIMIT_DEFAULT', '200 per hour'),  # Per client, on the encode/decode endpoints
+    RATELIMIT_BACKEND=os.environ.get('RATELIMIT_BACKEND', 'sqlite'),  # 'sqlite' (shared by workers), 'memory' or 'none'
+    RATELIMIT_DB=os.environ.get('RATELIMIT_DB', 'ratelimit.sqlite3'),
+    STEGO_WORKERS=int(os.environ.get('STEGO_WORKERS', 1)),  # >1 spreads large images over worker processes
+    JOB_WORKERS=int(os.environ.get('JOB_WORKERS', 2)),  # Background jobs run at the same time
+    JOB_QUEUE_SIZE=int(os.environ.get('JOB_QUEUE_SIZE', 16)),  # Most jobs queued or running at once per worker
+    JOB_DB=os.environ.get('JOB_DB', 'jobs.sqlite3'),  # Job states and results, shared by all workers
+    SPOOL_THRESHOLD=int(os.environ.get('SPOOL_THRESHOLD', 32 * 1024 * 1024)),  # Uploads/results above this spill to disk
+    DECODE_CACHE_BACKEND=os.environ.get('DECODE_CACHE_BACKEND', 'memory'),  # 'memory', 'disk' or 'none'
+    DECODE_CACHE_DIR=os.environ.get('DECODE_CACHE_DIR', 'cache'),  # Shared by all workers with the disk backend
+    DECODE_CACHE_BYTES=int(os.environ.get('DECODE_CACHE_BYTES', 256 * 1024 * 1024)),
+    DECODE_CACHE_TTL=int(os.environ.get('DECODE_CACHE_TTL', 3600)),
+    METRICS_ENABLED=os.environ.get('METRICS_ENABLED', 'true').lower() == 'true',  # Per-stage timings for /metrics
+    BATCH_WORKERS=int(os.environ.get('BATCH_WORKERS', 4)),  # Batch items processed at the same time
+    BATCH_MAX_ITEMS=int(os.environ.get('BATCH_MAX_ITEMS', 500)),
+    BATCH_MAX_BYTES=int(os.environ.get('BATCH_MAX_BYTES', 1024 * 1024 * 1024)),  # Uncompressed size limit for zip uploads
+    STORAGE_MAX_BYTES=int(os.environ.get('STORAGE_MAX_BYTES', 2 * 1024 * 1024 * 1024)),  # Quota for OUTPUT_FOLDER
+    STORAGE_TTL=int(os.environ.get('STORAGE_TTL', 3600)),  # Seconds generated files are kept
+    STORAGE_SWEEP_INTERVAL=int(os.environ.get('STORAGE_SWEEP_INTERVAL', 60)),
+    CARRIER_DIR=os.environ.get('CARRIER_DIR', 'carriers'),  # Operator carriers, usable by file name
+    CARRIER_POOL_BYTES=int(os.environ.get('CARRIER_POOL_BYTES', 1024 * 1024 * 1024)),  # Decoded carriers kept per process
+    CARRIER_MAX_PIXELS=int(os.environ.get('CARRIER_MAX_PIXELS', 20000 * 20000)),  # Largest generated carrier
+    ADMISSION_CPU_PIXELS=int(os.environ.get('ADMISSION_CPU_PIXELS', 2 * 7680 * 4320)),  # Carrier pixels in flight per process
+    ADMISSION_MEMORY_BYTES=int(os.environ.get('ADMISSION_MEMORY_BYTES', 1024 * 1024 * 1024))  # Estimated peak memory in flight per process
 )
 
-# Ensure upload and output directories exist
+class HashingSpooledFile(tempfile.SpooledTemporaryFile):
+    """Spooled upload buffer that hashes the upload while it is received"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+
+    def write(self, s):
+        self.sha256.update(s)
+        return super().write(s)
+
+class SpoolingRequest(Request):
+    """Keep uploaded files in memory up to SPOOL_THRESHOLD bytes, spill to a temp file above it"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingSpooledFile(max_size=current_app.config['SPOOL_THRESHOLD'], mode='rb+',
+                                  dir=current_app.config['UPLOAD_FOLDER'])
+
+app.request_class = SpoolingRequest
+
+# Decode results keyed by the hash of the uploaded carrier
+decode_cache = create_cache(app.config['DECODE_CACHE_BACKEND'], app.config['DECODE_CACHE_BYTES'],
+                            app.config['DECODE_CACHE_TTL'], app.config['DECODE_CACHE_DIR'])
+
+# Token buckets per client address, shared by all workers with the sqlite backend
+rate_limiter = create_rate_limiter(app.config['RATELIMIT_BACKEND'], app.config['RATELIMIT_DEFAULT'],
+                                   app.config['RATELIMIT_DB'])
+
+# Work in flight in this process, estimated from image headers before any pixels are decoded
+admission = AdmissionController(app.config['ADMISSION_CPU_PIXELS'], app.config['ADMISSION_MEMORY_BYTES'])
+
+# Template and context of each form page, rendered again when its POST is refused
+FORM_PAGES = {
+    'encode_page': ('encode.html', dict),
+    'decode_page': ('decode.html', dict),
+    'encode_audio_page': ('encode_audio.html', lambda: {'carriers': carrier_pool.stats()['carriers']}),
+    'decode_audio_page': ('decode_audio.html', dict),
+}
+
+def refuse(status, message, retry_after):
+    """
+    Turn a request away with status and Retry-After: JSON for the API and job
+    routes, the form page again with a flash message for forms
+    """
+    headers = {'Retry-After': str(math.ceil(retry_after))}
+    page = FORM_PAGES.get(request.endpoint)
+    if page is None or request.path.startswith(('/api/', '/jobs/')):
+        return jsonify({'error': message}), status, headers
+    template, context = page
+    flash(message, 'error')
+    return render_template(template, **context()), status, headers
+
+def rate_limited(f):
+    """Take a token for every POST to a heavy endpoint, answering 429 with Retry-After when none is left"""
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        if request.method == 'POST':
+            allowed, retry_after = rate_limiter.acquire(request.remote_addr or 'unknown')
+            if not allowed:
+                rate_limit_rejections.inc(endpoint=request.endpoint)
+                return refuse(429, f'Rate limit exceeded, try again in {math.ceil(retry_after)} seconds',
+                              retry_after)
+        return f(*args, **kwargs)
+    return wrapped
+
+def uploaded_pixels(file):
+    """
+    Pixel count from an uploaded image's header, or 0 if it cannot be read
+    (the view reports that) or its decode result is cached (a hit never opens the image)
+    """
+    if cached_decode(file) is not None:
+        return 0
+    stream = file.stream
+    position = stream.tell()
+    try:
+        stream.seek(0)
+        width, height = image_size(stream)
+        return width * height
+    except Exception:
+        return 0
+    finally:
+        stream.seek(position)
+
+def archive_pixels(file):
+    """Pixel counts of the images in an uploaded zip, read from their headers"""
+    pixels = []
+    try:
+        with zipfile.ZipFile(file.stream) as archive:
+            for info in archive.infolist():
+                if allowed_file(info.filename) and not info.filename.startswith('__MACOSX/'):
+                    with archive.open(info) as member:
+                        width, height = image_size(member)
+                    pixels.append(width * height)
+    except Exception:
+        pass
+    file.stream.seek(0)
+    return pixels
+
+def request_cost():
+    """
+    Estimated cost of the current request from carrier headers and the request size.
+
+    Batches only hold twice BATCH_WORKERS images at once, so they are
+    charged for their largest images up to that many.
+    """
+    pixels = [uploaded_pixels(f) for name in ('image', 'images')
+              for f in request.files.getlist(name) if f.filename and allowed_file(f.filename)]
+    if 'archive' in request.files:
+        pixels += archive_pixels(request.files['archive'])
+    if request.endpoint == 'batch':
+        pixels = sorted(pixels)[-2 * app.config['BATCH_WORKERS']:]
+
+    payload = request.content_length or 0
+    carrier_id = request.form.get('carrier', '')
+    if carrier_id == 'auto':
+        width, height = carrier_size_for(payload, max(1, min(bits_per_channel(), MAX_BITS_PER_CHANNEL)))
+        pixels.append(width * height)
+    elif carrier_id:
+        try:
+            width, height = carrier_pool.size(carrier_id)
+            pixels.append(width * height)
+        except KeyError:
+            pass
+    return estimate_cost(sum(pixels), payload)
+
+def admitted(f):
+    """Admit a POST only while its estimated cost fits the in-flight budgets, answering 503 with Retry-After otherwise"""
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        if request.method != 'POST':
+            return f(*args, **kwargs)
+        try:
+            ticket = admission.admit(request_cost())
+        except Overloaded as e:
+            admission_rejections.inc(endpoint=request.endpoint)
+            return refuse(503, str(e), e.retry_after)
+        try:
+            response = make_response(f(*args, **kwargs))
+        except BaseException:
+            ticket.release()
+            raise
+        # Streamed responses keep working until the client has read them,
+        # so the ticket is released once the server closes the response
+        on_close(ticket.release)
+        return response
+    return wrapped
+
+ON_CLOSE = 'stego.on_close'
+
+def on_close(callback):
+    """Run callback once the server has closed this request's response"""
+    request.environ.setdefault(ON_CLOSE, []).append(callback)
+
+class RunOnClose:
+    """
+    WSGI middleware running a request's on_close() callbacks when the server closes its response.
+
+    Flask only runs Response.call_on_close for responses it iterates itself;
+    send_file responses are passed straight through to the server, so the
+    callbacks are tied to the iterator the server actually closes.
+    """
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        def run_callbacks():
+            for callback in environ.pop(ON_CLOSE, ()):
+                callback()
+
+        try:
+            app_iter = self.wsgi_app(environ, start_response)
+        except BaseException:
+            run_callbacks()
+            raise
+        return ClosingIterator(app_iter, run_callbacks)
+
+def upload_digest(file):
+    """SHA-256 of an uploaded file, computed while it was received when possible"""
+    stream = file.stream
+    if isinstance(stream, HashingSpooledFile):
+        return stream.sha256.hexdigest()
+
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+# Decode cache key prefix of each decode form
+DECODE_CACHE_PREFIXES = {'decode_page': 'text:', 'decode_audio_page': 'audio:'}
+
+def cached_decode(file):
+    """
+    Decode cache entry for an upload to a decode form, or None.
+
+    Looked up once per request, so admission and the view share one lookup.
+    Audio entries name a stored file and only count while that file is kept.
+    """
+    prefix = DECODE_CACHE_PREFIXES.get(request.endpoint)
+    if prefix is None:
+        return None
+    if 'decode_cache_key' not in g:
+        g.decode_cache_key = prefix + upload_digest(file)
+        cached = decode_cache.get(g.decode_cache_key)
+        if cached is not None and prefix == 'audio:' and storage.lookup(cached.decode('ascii')) is None:
+            cached = None
+        g.cached_decode = cached
+    return g.cached_decode
+
+def record_carrier(file):
+    """Read the carrier dimensions from its header and record its pixel count for /metrics"""
+    width, height = image_size(file.stream)
+    g.carrier_pixels = width * height
+    return width, height
+
+def output_profile_for(file):
+    """Resolve the output profile chosen in the form, picking one from the carrier size for 'auto'"""
+    return choose_output_profile(*record_carrier(file), request.form.get('profile', 'auto'))
+
+def bits_per_channel():
+    """Bits per color channel chosen in the form (1 when not given)"""
+    return request.form.get('bits_per_channel', 1, type=int)
+
+def pooled_carrier(carrier_id, audio_data):
+    """
+    Pooled carrier named by the form's 'carrier' field, with its output profile and download name.
+
+    'auto' picks the smallest carrier that holds the audio, generating one
+    when none does, from a sampled estimate of the compressed size.
+    """
+    if carrier_id == 'auto':
+        estimate, exact = estimate_compressed_size(audio_data,
+                                                   codec=choose_codec(audio_data, request.form.get('codec', 'auto')))
+        if not exact:
+            # Leave headroom for the estimate; audio that barely compresses is stored as is
+            estimate = min(len(audio_data), int(estimate * 1.02) + 4096)
+        carrier_id = carrier_pool.for_capacity(estimate, bits_per_channel())
+    try:
+        width, height = carrier_pool.size(carrier_id)
+    except KeyError:
+        raise ValueError(f'Unknown carrier {carrier_id!r}')
+    g.carrier_pixels = width * height
+    profile = choose_output_profile(width, height, request.form.get('profile', 'auto'))
+    return carrier_pool.get(carrier_id), profile, encoded_filename('audio_encoded_', carrier_id + '.png', profile)
+
+def close_carrier(image):
+    """Close a spooled upload; pooled carriers are shared and stay open"""
+    if not isinstance(image, Image.Image):
+        image.close()
+
+def encoded_filename(prefix, filename, profile):
+    """Download name for an encoded image in the given output profile"""
+    return prefix + secure_filename(filename).rsplit('.', 1)[0] + '.' + OUTPUT_PROFILES[profile].extension
+
+def spooled_buffer():
+    """In-memory buffer for a result that spills to a temp file above SPOOL_THRESHOLD"""
+    return tempfile.SpooledTemporaryFile(max_size=app.config['SPOOL_THRESHOLD'], mode='w+b',
+                                         dir=app.config['UPLOAD_FOLDER'])
+
+# Content types reported by libmagic for decoded audio -> (served type, file extension)
+AUDIO_TYPES = {
+    'audio/x-wav': ('audio/wav', 'wav'),
+    'audio/wav': ('audio/wav', 'wav'),
+    'audio/mpeg': ('audio/mpeg', 'mp3'),
+    'audio/ogg': ('audio/ogg', 'ogg'),
+    'audio/webm': ('audio/webm', 'webm'),
+    'video/webm': ('audio/webm', 'webm'),
+    'audio/x-m4a': ('audio/mp4', 'm4a'),
+    'audio/mp4': ('audio/mp4', 'm4a'),
+    'video/mp4': ('audio/mp4', 'm4a'),
+    'audio/flac': ('audio/flac', 'flac'),
+    'audio/x-flac': ('audio/flac', 'flac'),
+}
+
+def audio_file_info(path):
+    """
+    Strong ETag, content type and download name of a decoded audio file.
+
+    Stored files never change once written, so the result is remembered per
+    path, modification time and size and each file is hashed at most once.
+    """
+    stat = os.stat(path)
+    return _audio_file_info(path, stat.st_mtime_ns, stat.st_size)
+
+@lru_cache(maxsize=1024)
+def _audio_file_info(path, mtime_ns, size):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        head = f.read(2048)
+        digest.update(head)
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    mimetype, extension = AUDIO_TYPES.get(magic.from_buffer(head, mime=True),
+                                          ('application/octet-stream', 'bin'))
+    return digest.hexdigest(), mimetype, 'decoded_audio.' + extension
+
+def send_audio(path, as_attachment):
+    """
+    Serve a decoded audio file with its real content type.
+
+    Byte ranges (206), If-None-Match (304) and If-Range are answered by
+    send_file against the content-hash ETag. The URL names one immutable
+    file that is deleted after STORAGE_TTL, so clients may cache it privately
+    for that long.
+    """
+    etag, mimetype, download_name = audio_file_info(path)
+    response = send_file(path, mimetype=mimetype, as_attachment=as_attachment,
+                         download_name=download_name, etag=etag, conditional=True,
+                         max_age=app.config['STORAGE_TTL'])
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    response.accept_ranges = 'bytes'
+    return response
+
+# Prometheus metrics, served at /metrics
+metrics = Registry()
+request_duration = metrics.histogram('stego_request_duration_seconds', 'Request latency',
+                                     ['endpoint', 'method', 'status'])
+stage_duration = metrics.histogram('stego_stage_duration_seconds',
+                                   'Time spent in each steganography stage',
+                                   ['endpoint', 'stage'])
+payload_bytes = metrics.histogram('stego_payload_bytes', 'Size of the hidden message or audio',
+                                  ['endpoint'], buckets=BYTES_BUCKETS)
+rate_limit_rejections = metrics.counter('stego_rate_limited_total', 'Requests refused by the rate limiter',
+                                        ['endpoint'])
+admission_rejections = metrics.counter('stego_admission_rejected_total',
+                                       'Requests refused because the server was busy', ['endpoint'])
+carrier_pixels = metrics.histogram('stego_carrier_pixels', 'Pixel count of the carrier image',
+                                   ['endpoint'], buckets=PIXELS_BUCKETS)
+
+def observe_stage(stage, seconds):
+    """
+    Timing hook for the steganography engine; work done by background jobs is labelled 'job'.
+
+    Batch items and shards run on the engine's pool threads in a copy of the
+    request's context, so their stages keep the request's endpoint.
+    """
+    endpoint = (request.endpoint or 'unknown') if has_request_context() else 'job'
+    stage_duration.observe(seconds, endpoint=endpoint, stage=stage)
+
+if app.config['METRICS_ENABLED']:
+    set_timing_hook(observe_stage)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if app.config['METRICS_ENABLED'] and request.method == 'POST':
+        # Parse the multipart body up front so receiving the upload is timed as its own stage
+        request.files
+        observe_stage('upload', time.perf_counter() - g.request_start)
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        endpoint = request.endpoint or 'unknown'
+        labels = {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)}
+        # Streamed zips do their work while the body is sent, so latency runs
+        # until the server has closed the response
+        on_close(lambda: request_duration.observe(time.perf_counter() - start, **labels))
+        if 'payload_bytes' in g:
+            payload_bytes.observe(g.payload_bytes, endpoint=endpoint)
+        if 'carrier_pixels' in g:
+            carrier_pixels.observe(g.carrier_pixels, endpoint=endpoint)
+    return response
+
+# Ensure the upload directory exists; spooled uploads are deleted as soon as they are closed
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+
+# Generated files get unique names and are evicted by quota and TTL
+storage = StorageManager(app.config['OUTPUT_FOLDER'], app.config['STORAGE_MAX_BYTES'],
+                         app.config['STORAGE_TTL'])
+
+@app.before_request
+def start_storage_sweeper():
+    # Started by the first request a process serves, so a preloading master
+    # and forked engine workers never sweep the directory
+    storage.start_sweeper(app.config['STORAGE_SWEEP_INTERVAL'])
+
+# Pre-decoded carriers that audio requests can use instead of uploading an image
+carrier_pool = CarrierPool(app.config['CARRIER_POOL_BYTES'], app.config['CARRIER_MAX_PIXELS'])
+if os.path.isdir(app.config['CARRIER_DIR']):
+    carrier_pool.register_directory(app.config['CARRIER_DIR'])
 
 # Set up logging
 logging.basicConfig(
@@ -45,14 +466,10 @@ logger = logging.getLogger(__name__)
 
 # Apply proxy fix if behind a reverse proxy
 app.wsgi_app = ProxyFix(
-    app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1
+    RunOnClose(app.wsgi_app), x_for=1, x_proto=1, x_host=1, x_prefix=1
 )
 
-# Create necessary folders
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
-
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp'}
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'tif', 'tiff', 'webp'}
 ALLOWED_AUDIO_EXTENSIONS = {'mp3', 'wav', 'ogg', 'webm', 'm4a'}
 
 def allowed_file(filename):
@@ -66,6 +483,8 @@ def index():
     return render_template('index.html')
 
 @app.route('/encode', methods=['GET', 'POST'])
+@rate_limited
+@admitted
 def encode_page():
     if request.method == 'POST':
         # Check if file was uploaded
@@ -85,19 +504,18 @@ def encode_page():
             return redirect(request.url)
         
         if file and allowed_file(file.filename):
-            # Save uploaded file
-            filename = secure_filename(file.filename)
-            input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(input_path)
-            
-            # Encode message
-            output_filename = 'encoded_' + filename.rsplit('.', 1)[0] + '.png'
-            output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-            
+            # Encode message straight from the upload stream into a buffer
             try:
-                encode(input_path, secret_message, output_path)
+                profile = output_profile_for(file)
+                g.payload_bytes = len(secret_message.encode('utf-8'))
+                output_filename = encoded_filename('encoded_', file.filename, profile)
+                output = encode(file.stream, secret_message, spooled_buffer(),
+                                workers=app.config['STEGO_WORKERS'], output_profile=profile,
+                                bits_per_channel=bits_per_channel())
+                output.seek(0)
                 flash('Message encoded successfully!', 'success')
-                return send_file(output_path, as_attachment=True, download_name=output_filename)
+                return send_file(output, mimetype=OUTPUT_PROFILES[profile].mimetype,
+                                 as_attachment=True, download_name=output_filename)
             except ValueError as e:
                 flash(str(e), 'error')
                 return redirect(request.url)
@@ -105,12 +523,14 @@ def encode_page():
                 flash(f'Error encoding message: {str(e)}', 'error')
                 return redirect(request.url)
         else:
-            flash('Invalid file type. Please upload PNG, JPG, JPEG, or BMP', 'error')
+            flash('Invalid file type. Please upload PNG, JPG, JPEG, BMP, TIFF, or WebP', 'error')
             return redirect(request.url)
     
     return render_template('encode.html')
 
 @app.route('/decode', methods=['GET', 'POST'])
+@rate_limited
+@admitted
 def decode_page():
     if request.method == 'POST':
         # Check if file was uploaded
@@ -125,56 +545,65 @@ def decode_page():
             return redirect(request.url)
         
         if file and allowed_file(file.filename):
-            # Save uploaded file
-            filename = secure_filename(file.filename)
-            input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(input_path)
-            
-            # Decode message
+            # Decode message straight from the upload stream, unless this carrier was seen before
             try:
-                decoded_message = decode(input_path)
+                cached = cached_decode(file)
+                if cached is not None:
+                    decoded_message = cached.decode('utf-8')
+                else:
+                    record_carrier(file)
+                    decoded_message = decode(file.stream, workers=app.config['STEGO_WORKERS'])
+                    decode_cache.set(g.decode_cache_key, decoded_message.encode('utf-8'))
+                g.payload_bytes = len(decoded_message.encode('utf-8'))
                 return render_template('decode.html', decoded_message=decoded_message)
             except Exception as e:
                 flash(f'Error decoding message: {str(e)}', 'error')
                 return redirect(request.url)
         else:
-            flash('Invalid file type. Please upload PNG, JPG, JPEG, or BMP', 'error')
+            flash('Invalid file type. Please upload PNG, JPG, JPEG, BMP, TIFF, or WebP', 'error')
             return redirect(request.url)
     
     return render_template('decode.html')
 
 @app.route('/encode-audio', methods=['GET', 'POST'])
+@rate_limited
+@admitted
 def encode_audio_page():
     if request.method == 'POST':
-        # Check if files were uploaded
-        if 'image' not in request.files or 'audio' not in request.files:
+        # Check if files were uploaded; a pooled carrier replaces the image
+        carrier_id = request.form.get('carrier', '')
+        if 'audio' not in request.files or ('image' not in request.files and not carrier_id):
             flash('Please upload both image and audio files', 'error')
             return redirect(request.url)
 
-        image_file = request.files['image']
+        image_file = request.files.get('image')
         audio_file = request.files['audio']
 
-        if image_file.filename == '' or audio_file.filename == '':
+        if audio_file.filename == '' or (not carrier_id and image_file.filename == ''):
             flash('Please select both files', 'error')
             return redirect(request.url)
 
-        if image_file and allowed_file(image_file.filename):
-            # Save uploaded image
-            image_filename = secure_filename(image_file.filename)
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
-            image_file.save(image_path)
-
+        if carrier_id or allowed_file(image_file.filename):
             # Read audio data
             audio_data = audio_file.read()
 
-            # Encode audio
-            output_filename = 'audio_encoded_' + image_filename.rsplit('.', 1)[0] + '.png'
-            output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-
+            # Encode audio straight from the upload stream (or a pooled carrier) into a buffer
             try:
-                encode_audio(image_path, audio_data, output_path)
+                g.payload_bytes = len(audio_data)
+                if carrier_id:
+                    carrier, profile, output_filename = pooled_carrier(carrier_id, audio_data)
+                else:
+                    carrier = image_file.stream
+                    profile = output_profile_for(image_file)
+                    output_filename = encoded_filename('audio_encoded_', image_file.filename, profile)
+                output = encode_audio(carrier, audio_data, spooled_buffer(),
+                                      workers=app.config['STEGO_WORKERS'], output_profile=profile,
+                                      bits_per_channel=bits_per_channel(),
+                                      codec=request.form.get('codec', 'auto'))
+                output.seek(0)
                 flash('Audio encoded successfully!', 'success')
-                return send_file(output_path, as_attachment=True, download_name=output_filename)
+                return send_file(output, mimetype=OUTPUT_PROFILES[profile].mimetype,
+                                 as_attachment=True, download_name=output_filename)
             except ValueError as e:
                 flash(str(e), 'error')
                 return redirect(request.url)
@@ -182,12 +611,14 @@ def encode_audio_page():
                 flash(f'Error encoding audio: {str(e)}', 'error')
                 return redirect(request.url)
         else:
-            flash('Invalid image file type. Please upload PNG, JPG, JPEG, or BMP', 'error')
+            flash('Invalid image file type. Please upload PNG, JPG, JPEG, BMP, TIFF, or WebP', 'error')
             return redirect(request.url)
 
-    return render_template('encode_audio.html')
+    return render_template('encode_audio.html', carriers=carrier_pool.stats()['carriers'])
 
 @app.route('/decode-audio', methods=['GET', 'POST'])
+@rate_limited
+@admitted
 def decode_audio_page():
     if request.method == 'POST':
         # Check if file was uploaded
@@ -202,35 +633,47 @@ def decode_audio_page():
             return redirect(request.url)
 
         if file and allowed_file(file.filename):
-            # Save uploaded file
-            filename = secure_filename(file.filename)
-            input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(input_path)
+            # Decode audio straight into a file of this request's own, one chunk at a time
+            audio_filename, audio_path = storage.new_path('.wav')
+            own_path = audio_path
+            audio_size = 0
 
-            # Decode audio
             try:
-                audio_data = decode_audio(input_path)
-
-                # Save audio to temporary file
-                audio_filename = 'decoded_audio.wav'
-                audio_path = os.path.join(app.config['OUTPUT_FOLDER'], audio_filename)
-
-                with open(audio_path, 'wb') as f:
-                    f.write(audio_data)
+                # The cache holds the name of the stored file rather than the audio
+                # itself; it is a miss once the file has been evicted or expired
+                cached = cached_decode(file)
+                if cached is not None:
+                    audio_filename = cached.decode('ascii')
+                    audio_path = storage.lookup(audio_filename)
+                    audio_size = os.path.getsize(audio_path)
+                else:
+                    record_carrier(file)
+                    with open(audio_path, 'wb') as f:
+                        for chunk in decode_audio_stream(file.stream, workers=app.config['STEGO_WORKERS']):
+                            f.write(chunk)
+                            audio_size += len(chunk)
+                    storage.commit(audio_path)
+                    decode_cache.set(g.decode_cache_key, audio_filename.encode('ascii'))
+                g.payload_bytes = audio_size
 
                 # Return template with audio file info
                 return render_template('decode_audio.html',
                                      audio_decoded=True,
                                      audio_filename=audio_filename,
-                                     audio_size=len(audio_data))
+                                     audio_mimetype=audio_file_info(audio_path)[1],
+                                     audio_size=audio_size)
             except ValueError as e:
+                # Only the file this request wrote; a cached file belongs to the
+                # cache and is left to its eviction
+                storage.remove(own_path)
                 flash(str(e), 'error')
                 return redirect(request.url)
             except Exception as e:
+                storage.remove(own_path)
                 flash(f'Error decoding audio: {str(e)}', 'error')
                 return redirect(request.url)
         else:
-            flash('Invalid file type. Please upload PNG, JPG, JPEG, or BMP', 'error')
+            flash('Invalid file type. Please upload PNG, JPG, JPEG, BMP, TIFF, or WebP', 'error')
             return redirect(request.url)
 
     return render_template('decode_audio.html')
@@ -239,9 +682,9 @@ def decode_audio_page():
 def download_audio(filename):
     """Serve the decoded audio file for download"""
     try:
-        audio_path = os.path.join(app.config['OUTPUT_FOLDER'], secure_filename(filename))
-        if os.path.exists(audio_path):
-            return send_file(audio_path, as_attachment=True, download_name=filename, mimetype='audio/wav')
+        audio_path = storage.lookup(filename)
+        if audio_path is not None:
+            return send_audio(audio_path, as_attachment=True)
         else:
             flash('Audio file not found', 'error')
             return redirect(url_for('decode_audio_page'))
@@ -253,14 +696,435 @@ def download_audio(filename):
 def play_audio(filename):
     """Serve the decoded audio file for playback"""
     try:
-        audio_path = os.path.join(app.config['OUTPUT_FOLDER'], secure_filename(filename))
-        if os.path.exists(audio_path):
-            return send_file(audio_path, mimetype='audio/wav')
+        audio_path = storage.lookup(filename)
+        if audio_path is not None:
+            return send_audio(audio_path, as_attachment=False)
         else:
             return "Audio file not found", 404
     except Exception as e:
         return f"Error: {str(e)}", 500
 
+# Background jobs run in the worker that accepted them; their state is shared by all workers
+jobs = JobManager(app.config['JOB_DB'], max_workers=app.config['JOB_WORKERS'],
+                  max_queued=app.config['JOB_QUEUE_SIZE'])
+
+def spool_job_upload(file):
+    """Copy an upload into a buffer of its own, since the request closes its stream before a job runs"""
+    buffer = spooled_buffer()
+    shutil.copyfileobj(file.stream, buffer)
+    buffer.seek(0)
+    return buffer
+
+def run_encode_audio_job(image, audio_data, output_path, download_name, profile, depth, codec, progress):
+    try:
+        encode_audio(image, audio_data, output_path, workers=app.config['STEGO_WORKERS'],
+                     progress=progress, output_profile=profile, bits_per_channel=depth, codec=codec)
+        storage.commit(output_path)
+    except Exception:
+        storage.remove(output_path)
+        raise
+    finally:
+        close_carrier(image)
+    return {'path': output_path, 'download_name': download_name,
+            'mimetype': OUTPUT_PROFILES[profile].mimetype}
+
+def run_decode_audio_job(image, audio_path, progress):
+    try:
+        with open(audio_path, 'wb') as f:
+            for chunk in decode_audio_stream(image, workers=app.config['STEGO_WORKERS'],
+                                             progress=progress):
+                f.write(chunk)
+        storage.commit(audio_path)
+    except Exception:
+        storage.remove(audio_path)
+        raise
+    finally:
+        image.close()
+    _, mimetype, download_name = audio_file_info(audio_path)
+    return {'path': audio_path, 'download_name': download_name, 'mimetype': mimetype}
+
+def submit_job(func, image, *args):
+    """
+    Queue a job and answer with 202 and its URLs, or 503 when the queue is full.
+
+    The job's estimated cost is held from submission until it finishes or
+    is cancelled, so queued and running jobs count against the budgets.
+    """
+    try:
+        ticket = admission.admit(request_cost())
+    except Overloaded as e:
+        close_carrier(image)
+        admission_rejections.inc(endpoint=request.endpoint)
+        return refuse(503, str(e), e.retry_after)
+    try:
+        job = jobs.submit(func, image, *args, cleanup=lambda: close_carrier(image))
+    except QueueFull as e:
+        ticket.release()
+        close_carrier(image)
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
+    job.future.add_done_callback(lambda future: ticket.release())
+
+    body = job.to_dict()
+    body['status_url'] = url_for('job_status', job_id=job.id)
+    body['result_url'] = url_for('job_result', job_id=job.id)
+    return jsonify(body), 202, {'Location': body['status_url']}
+
+@app.route('/jobs/encode-audio', methods=['POST'])
+@rate_limited
+def submit_encode_audio_job():
+    """Queue an audio encoding job; poll /jobs/<id> for progress"""
+    image_file = request.files.get('image')
+    audio_file = request.files.get('audio')
+    carrier_id = request.form.get('carrier', '')
+    if (not audio_file or audio_file.filename == ''
+            or (not carrier_id and (not image_file or image_file.filename == ''))):
+        return jsonify({'error': 'Please upload both image and audio files'}), 400
+    if not carrier_id and not allowed_file(image_file.filename):
+        return jsonify({'error': 'Invalid image file type. Please upload PNG, JPG, JPEG, BMP, TIFF, or WebP'}), 400
+
+    depth = bits_per_channel()
+    if not 1 <= depth <= MAX_BITS_PER_CHANNEL:
+        return jsonify({'error': f'bits_per_channel must be between 1 and {MAX_BITS_PER_CHANNEL}'}), 400
+    codec = request.form.get('codec', 'auto')
+    if codec != 'auto' and codec not in CODECS:
+        return jsonify({'error': f'Unknown codec {codec!r}'}), 400
+
+    audio_data = audio_file.read()
+    try:
+        if carrier_id:
+            image, profile, output_filename = pooled_carrier(carrier_id, audio_data)
+        else:
+            profile = output_profile_for(image_file)
+            output_filename = encoded_filename('audio_encoded_', image_file.filename, profile)
+            image = spool_job_upload(image_file)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+    _, output_path = storage.new_path('_' + output_filename)
+    return submit_job(run_encode_audio_job, image, audio_data, output_path, output_filename,
+                      profile, depth, codec)
+
+@app.route('/jobs/decode-audio', methods=['POST'])
+@rate_limited
+def submit_decode_audio_job():
+    """Queue an audio decoding job; poll /jobs/<id> for progress"""
+    image_file = request.files.get('image')
+    if not image_file or image_file.filename == '':
+        return jsonify({'error': 'No image file uploaded'}), 400
+    if not allowed_file(image_file.filename):
+        return jsonify({'error': 'Invalid file type. Please upload PNG, JPG, JPEG, BMP, TIFF, or WebP'}), 400
+
+    image = spool_job_upload(image_file)
+    _, audio_path = storage.new_path('_decoded_audio.wav')
+    return submit_job(run_decode_audio_job, image, audio_path)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Report the state and percent complete of a job"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not job.cancel():
+        return jsonify({'error': f'Job is already {job.state}'}), 409
+    return jsonify(jobs.get(job_id).to_dict()), 202
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Download the output of a finished job"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.state != DONE:
+        return jsonify({'error': f'Job is {job.state}'}), 409
+    result = job.result
+    if not os.path.exists(result['path']):
+        return jsonify({'error': 'Job result has expired'}), 410
+    return send_file(result['path'], as_attachment=True,
+                     download_name=result['download_name'], mimetype=result['mimetype'])
+
+@app.route('/api/capacity', methods=['POST'])
+def capacity_check():
+    """Estimate whether audio fits an image from the image header and a sample of the audio"""
+    image_file = request.files.get('image')
+    audio_file = request.files.get('audio')
+    if not image_file or image_file.filename == '':
+        return jsonify({'error': 'No image file uploaded'}), 400
+    if not allowed_file(image_file.filename):
+        return jsonify({'error': 'Invalid file type. Please upload PNG, JPG, JPEG, BMP, TIFF, or WebP'}), 400
+
+    audio_data = audio_file.read() if audio_file else b''
+    audio_size = request.form.get('audio_size', type=int)
+    if not audio_data and audio_size is None:
+        return jsonify({'error': 'Upload the audio (or a sample of it) or give audio_size'}), 400
+    if audio_size is not None and audio_size < len(audio_data):
+        return jsonify({'error': 'audio_size is smaller than the uploaded audio'}), 400
+
+    try:
+        result = check_audio_capacity(image_file.stream, audio_data, audio_size, bits_per_channel(),
+                                      request.form.get('codec', 'auto'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'Could not read image header: {str(e)}'}), 400
+    g.carrier_pixels = result['width'] * result['height']
+    g.payload_bytes = result['audio_bytes']
+    return jsonify(result)
+
+# Batch processing
+class ZipStream:
+    """Write-only sink for zipfile that hands out what was written since the last call"""
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+def batch_items_from_zip(file, operation):
+    """(name, image, message) for every image in an uploaded zip; messages come from <name>.txt members"""
+    try:
+        archive = zipfile.ZipFile(file.stream)
+    except zipfile.BadZipFile:
+        raise ValueError('The uploaded archive is not a valid zip file')
+
+    members = {info.filename: info for info in archive.infolist() if not info.is_dir()}
+    images = [info for name, info in members.items()
+              if allowed_file(name) and not name.startswith('__MACOSX/')]
+    if sum(info.file_size for info in images) > app.config['BATCH_MAX_BYTES']:
+        raise ValueError('The archive is too large when uncompressed')
+
+    default_message = request.form.get('message', '')
+    items = []
+    for info in images:
+        message = None
+        if operation == 'encode':
+            text = members.get(info.filename.rsplit('.', 1)[0] + '.txt')
+            message = archive.read(text).decode('utf-8') if text else default_message
+        items.append((info.filename, lambda info=info: archive.read(info), message))
+    return items
+
+def batch_items_from_form(operation):
+    """(name, image, message) for every file in the multipart 'images' list"""
+    files = [f for f in request.files.getlist('images') if f.filename]
+    messages = request.form.getlist('message')
+    if operation == 'encode' and len(messages) not in (1, len(files)):
+        raise ValueError('Give one message for all images or one per image')
+
+    items = []
+    for i, f in enumerate(files):
+        if not allowed_file(f.filename):
+            raise ValueError(f'Invalid file type: {f.filename}')
+        message = None
+        if operation == 'encode':
+            message = messages[0] if len(messages) == 1 else messages[i]
+        items.append((f.filename, f.read, message))
+    return items
+
+def batch_entry_name(filename, extension, used):
+    """Unique, sanitised name for a result inside the output zip"""
+    stem = secure_filename(os.path.basename(filename)).rsplit('.', 1)[0] or 'item'
+    name = f'{stem}.{extension}'
+    counter = 1
+    while name in used:
+        counter += 1
+        name = f'{stem}_{counter}.{extension}'
+    used.add(name)
+    return name
+
+@app.route('/api/batch', methods=['POST'])
+@rate_limited
+@admitted
+def batch():
+    """
+    Encode or decode many images in one request.
+
+    Takes a zip ('archive') or a multipart list ('images') and answers with a
+    zip streamed as items finish, ending with manifest.json that records the
+    outcome of every item.
+    """
+    operation = request.form.get('operation', 'encode')
+    if operation not in ('encode', 'decode'):
+        return jsonify({'error': "operation must be 'encode' or 'decode'"}), 400
+    profile = request.form.get('profile', 'auto')
+    if profile != 'auto' and profile not in OUTPUT_PROFILES:
+        return jsonify({'error': f'Unknown output profile {profile!r}'}), 400
+
+    try:
+        if 'archive' in request.files:
+            items = batch_items_from_zip(request.files['archive'], operation)
+        else:
+            items = batch_items_from_form(operation)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not items:
+        return jsonify({'error': 'No images found in the request'}), 400
+    if len(items) > app.config['BATCH_MAX_ITEMS']:
+        return jsonify({'error': f"At most {app.config['BATCH_MAX_ITEMS']} items per batch"}), 400
+    if operation == 'encode' and any(not message for _, _, message in items):
+        return jsonify({'error': 'Every image needs a message'}), 400
+
+    concurrency = app.config['BATCH_WORKERS']
+    workers = app.config['STEGO_WORKERS']
+    if operation == 'encode':
+        results = encode_batch(((read(), message) for _, read, message in items), concurrency,
+                               workers=workers, output_profile=profile,
+                               bits_per_channel=bits_per_channel())
+        # 'auto' only ever picks one of the PNG profiles
+        extension = 'png' if profile == 'auto' else OUTPUT_PROFILES[profile].extension
+    else:
+        results = decode_batch((read() for _, read, _ in items), concurrency, workers=workers)
+        extension = 'txt'
+
+    def generate():
+        sink = ZipStream()
+        manifest = []
+        used = set()
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+            for result in results:
+                name = items[result.index][0]
+                entry = {'index': result.index, 'name': name, 'seconds': round(result.seconds, 4)}
+                if result.error is None:
+                    entry['status'] = 'ok'
+                    entry['output'] = batch_entry_name(name, extension, used)
+                    data = result.value.getvalue() if operation == 'encode' else result.value.encode('utf-8')
+                    archive.writestr(entry['output'], data)
+                else:
+                    entry['status'] = 'error'
+                    entry['error'] = result.error
+                manifest.append(entry)
+                yield sink.take()
+
+            manifest.sort(key=lambda e: e['index'])
+            summary = {'operation': operation, 'total': len(manifest),
+                       'succeeded': sum(1 for e in manifest if e['status'] == 'ok'),
+                       'items': manifest}
+            archive.writestr('manifest.json', json.dumps(summary, indent=2))
+        yield sink.take()
+
+    return Response(stream_with_context(generate()), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename=batch_{operation}.zip'})
+
+# Audio split across several carriers
+@app.route('/api/shards/encode', methods=['POST'])
+@rate_limited
+@admitted
+def encode_shards():
+    """
+    Split one audio file across every image in the multipart 'images' list.
+
+    The carriers are embedded concurrently and returned as a zip; the
+    encoded images can be decoded again in any order.
+    """
+    images = [f for f in request.files.getlist('images') if f.filename]
+    audio_file = request.files.get('audio')
+    if not images or not audio_file or audio_file.filename == '':
+        return jsonify({'error': 'Please upload the carrier images and an audio file'}), 400
+    if len(images) > app.config['BATCH_MAX_ITEMS']:
+        return jsonify({'error': f"At most {app.config['BATCH_MAX_ITEMS']} images per request"}), 400
+    if not all(allowed_file(f.filename) for f in images):
+        return jsonify({'error': 'Invalid file type. Please upload PNG, JPG, JPEG, BMP, TIFF, or WebP'}), 400
+    profile = request.form.get('profile', 'auto')
+    if profile != 'auto' and profile not in OUTPUT_PROFILES:
+        return jsonify({'error': f'Unknown output profile {profile!r}'}), 400
+    codec = request.form.get('codec', 'auto')
+    if codec != 'auto' and codec not in CODECS:
+        return jsonify({'error': f'Unknown codec {codec!r}'}), 400
+
+    audio_data = audio_file.read()
+    try:
+        outputs = encode_audio_shards([f.stream for f in images], audio_data,
+                                      [spooled_buffer() for _ in images],
+                                      concurrency=app.config['BATCH_WORKERS'],
+                                      workers=app.config['STEGO_WORKERS'], output_profile=profile,
+                                      bits_per_channel=bits_per_channel(), codec=codec)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    g.payload_bytes = len(audio_data)
+    # 'auto' only ever picks one of the PNG profiles
+    extension = 'png' if profile == 'auto' else OUTPUT_PROFILES[profile].extension
+
+    def generate():
+        sink = ZipStream()
+        used = set()
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+            for f, output in zip(images, outputs):
+                output.seek(0)
+                with output, archive.open(batch_entry_name(f.filename, extension, used), 'w') as entry:
+                    shutil.copyfileobj(output, entry)
+                yield sink.take()
+        yield sink.take()
+
+    return Response(stream_with_context(generate()), mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=audio_shards.zip'})
+
+@app.route('/api/shards/decode', methods=['POST'])
+@rate_limited
+@admitted
+def decode_shards():
+    """Reassemble audio from every shard image in the multipart 'images' list, in any order"""
+    images = [f for f in request.files.getlist('images') if f.filename]
+    if not images:
+        return jsonify({'error': 'No image files uploaded'}), 400
+    if not all(allowed_file(f.filename) for f in images):
+        return jsonify({'error': 'Invalid file type. Please upload PNG, JPG, JPEG, BMP, TIFF, or WebP'}), 400
+
+    chunks = decode_audio_shards([f.stream for f in images], workers=app.config['STEGO_WORKERS'])
+    try:
+        # The shard headers are checked before the first chunk is produced
+        first = next(chunks, b'')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    mimetype, extension = AUDIO_TYPES.get(magic.from_buffer(first[:2048], mime=True),
+                                          ('application/octet-stream', 'bin'))
+
+    def generate():
+        yield first
+        yield from chunks
+
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=decoded_audio.{extension}'})
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Hit/miss counters and usage of the decode cache"""
+    return jsonify(decode_cache.stats())
+
+@app.route('/carriers')
+def list_carriers():
+    """Pooled carriers, which of them are decoded in memory, and pool usage"""
+    return jsonify(carrier_pool.stats())
+
+@app.route('/admission/stats')
+def admission_stats():
+    """Estimated work in flight in this process against its CPU and memory budgets"""
+    return jsonify(admission.stats())
+
+@app.route('/storage/stats')
+def storage_stats():
+    """Files and bytes kept in the output directory, its quota and free disk space"""
+    return jsonify(storage.usage())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Request, payload, carrier and per-stage histograms in Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # Error Handlers
 @app.errorhandler(404)
 def not_found_error(error):
@@ -285,24 +1149,6 @@ def add_security_headers(response):
     response.headers['Content-Security-Policy'] = "default-src 'self'; script-src 'self' 'unsafe-inline' cdn.jsdelivr.net; style-src 'self' 'unsafe-inline'; img-src 'self' data:;"
     return response
 
-# Rate limiting decorator
-def rate_limited(limit=100, per=60):
-    def decorator(f):
-        calls = []
-        
-        @wraps(f)
-        def wrapped(*args, **kwargs):
-            now = time.time()
-            calls_in_time = [call for call in calls if call > now - per]
-            
-            if len(calls_in_time) >= limit:
-                return jsonify({"error": "Rate limit exceeded"}), 429
-                
-            calls.append(now)
-            return f(*args, **kwargs)
-        return wrapped
-    return decorator
-
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=False)
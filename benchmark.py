@@ -0,0 +1,330 @@
+"""
+Benchmark suite for the steganography engine and the Flask routes
+
+Times encode, decode, encode_audio and decode_audio on synthetic carriers
+at the resolutions from test_capacity.py (and optionally the
+create_large_image.py presets), reports throughput and peak RSS, and
+writes the results as JSON so runs can be compared.
+
+Usage:
+    python benchmark.py                                  # Full HD to 8K
+    python benchmark.py --large                          # plus 5k-20k presets
+    python benchmark.py --output run.json --compare baseline.json
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+from PIL import Image
+
+from create_large_image import PRESET_SIZES
+from steganography import payload_capacity
+from test_capacity import resolutions as RESOLUTIONS
+
+# Payload sizes tried on every carrier; sizes that do not fit are skipped
+DEFAULT_PAYLOAD_SIZES = [16 * 1024, 256 * 1024, 4 * 1024 * 1024]
+
+# Fixed seed so every run benchmarks the same carriers and payloads
+SEED = 1234
+
+# Bytes per MB, as used throughout the app
+MB = 1024 * 1024
+
+ENGINE_OPERATIONS = ['encode', 'decode', 'encode_audio', 'decode_audio']
+ROUTE_OPERATIONS = ['/encode', '/decode', '/encode-audio', '/decode-audio']
+
+
+def make_carrier(width, height, path):
+    """Write a noise-textured RGB carrier, so PNG sizes resemble real photos."""
+    rng = np.random.default_rng(SEED)
+    # Generate in bands to keep the generator itself light on memory
+    img = Image.new('RGB', (width, height))
+    band = max(1, (16 * MB) // (width * 3))
+    for top in range(0, height, band):
+        bottom = min(top + band, height)
+        pixels = rng.integers(0, 256, size=(bottom - top, width, 3), dtype=np.uint8)
+        img.paste(Image.fromarray(pixels, 'RGB'), (0, top))
+    img.save(path, 'PNG', compress_level=1)
+
+
+def make_message(size):
+    """Printable text message of the given size."""
+    rng = np.random.default_rng(SEED)
+    return rng.integers(ord('a'), ord('z') + 1, size=size, dtype=np.uint8).tobytes().decode('ascii')
+
+
+def make_audio(size):
+    """16-bit mono WAV of roughly the given size: a tone with some noise, compressible like speech."""
+    rng = np.random.default_rng(SEED)
+    frames = max(1, (size - 44) // 2)
+    t = np.arange(frames) / 44100
+    samples = 8000 * np.sin(2 * np.pi * 440 * t) + rng.normal(0, 300, frames)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(44100)
+        w.writeframes(samples.astype('<i2').tobytes())
+    return buffer.getvalue()
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (MB if sys.platform == 'darwin' else 1024)
+
+
+def run_case(case):
+    """
+    Time one operation in a fresh process.
+
+    Args:
+        case: Dict with 'operation', 'carrier', 'payload' (file holding the
+            payload or encoded input), 'output' and 'repeat'
+
+    Returns:
+        Dict with the timings in seconds and the peak RSS in MB
+    """
+    import steganography
+
+    operation = case['operation']
+    with open(case['payload'], 'rb') as f:
+        payload = f.read()
+    baseline_rss = _peak_rss_mb()
+
+    if operation.startswith('/'):
+        client = _route_client(case['workdir'])
+
+    timings = []
+    for _ in range(case['repeat']):
+        start = time.perf_counter()
+        if operation == 'encode':
+            steganography.encode(case['carrier'], payload.decode('ascii'), case['output'])
+        elif operation == 'decode':
+            steganography.decode(case['carrier'])
+        elif operation == 'encode_audio':
+            steganography.encode_audio(case['carrier'], payload, case['output'])
+        elif operation == 'decode_audio':
+            steganography.decode_audio(case['carrier'])
+        else:
+            _post_route(client, operation, case, payload)
+        timings.append(time.perf_counter() - start)
+
+    return {'seconds': timings, 'baseline_rss_mb': baseline_rss, 'peak_rss_mb': _peak_rss_mb()}
+
+
+def _route_client(workdir):
+    """Flask test client with caching and background state kept out of the way."""
+    os.environ['DECODE_CACHE_BACKEND'] = 'none'
+    os.environ['RATELIMIT_BACKEND'] = 'none'
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from app import app
+    app.config['TESTING'] = True
+    return app.test_client()
+
+
+def _post_route(client, route, case, payload):
+    with open(case['carrier'], 'rb') as f:
+        image = f.read()
+    data = {'image': (io.BytesIO(image), os.path.basename(case['carrier']))}
+    if route == '/encode':
+        data['message'] = payload.decode('ascii')
+    elif route == '/encode-audio':
+        data['audio'] = (io.BytesIO(payload), 'audio.wav')
+
+    response = client.post(route, data=data, content_type='multipart/form-data')
+    if route in ('/encode', '/encode-audio') and response.status_code == 200:
+        with open(case['output'], 'wb') as f:
+            f.write(response.get_data())
+    elif response.status_code != 200:
+        raise RuntimeError(f"{route} answered {response.status_code}")
+
+
+def _measure(case):
+    """Run a case in its own process so peak RSS belongs to that case alone."""
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(run_case, case).result()
+
+
+def _summarise(case, measured, payload_size):
+    median = statistics.median(measured['seconds'])
+    return {
+        'operation': case['operation'],
+        'resolution': case['resolution'],
+        'pixels': case['pixels'],
+        'payload_bytes': payload_size,
+        'seconds_median': median,
+        'seconds_min': min(measured['seconds']),
+        'throughput_mb_s': payload_size / MB / median if median else None,
+        'baseline_rss_mb': round(measured['baseline_rss_mb'], 1),
+        'peak_rss_mb': round(measured['peak_rss_mb'], 1),
+    }
+
+
+def run_benchmarks(sizes, payload_sizes, repeat=3, routes=True, workdir=None, log=print):
+    """
+    Benchmark every operation on every carrier size and payload size that fits.
+
+    Args:
+        sizes: List of (width, height) carrier sizes
+        payload_sizes: Payload sizes in bytes
+        repeat: Timed runs per case (the median is reported)
+        routes: Also benchmark the Flask routes through the test client
+        workdir: Directory for carriers and intermediate files
+        log: Callable receiving one progress line per case
+
+    Returns:
+        List of result dicts
+    """
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix='stego-bench-'))
+    os.makedirs(workdir, exist_ok=True)
+    results = []
+
+    for width, height in sizes:
+        resolution = f'{width}x{height}'
+        carrier = os.path.join(workdir, f'carrier_{resolution}.png')
+        if not os.path.exists(carrier):
+            make_carrier(width, height, carrier)
+        capacity = payload_capacity(width, height)
+
+        for payload_size in payload_sizes:
+            # Leave room for the container header and imperfect compression
+            if payload_size > capacity * 0.9:
+                continue
+
+            text_payload = os.path.join(workdir, f'message_{payload_size}.txt')
+            audio_payload = os.path.join(workdir, f'audio_{payload_size}.wav')
+            with open(text_payload, 'wb') as f:
+                f.write(make_message(payload_size).encode('ascii'))
+            with open(audio_payload, 'wb') as f:
+                f.write(make_audio(payload_size))
+
+            operations = ENGINE_OPERATIONS + (ROUTE_OPERATIONS if routes else [])
+
+            encoded = {}
+            for operation in operations:
+                audio = 'audio' in operation
+                source = 'audio' if audio else 'text'
+                is_encode = 'encode' in operation
+                output = os.path.join(workdir, f'encoded_{source}_{resolution}_{payload_size}.png')
+                case = {
+                    'operation': operation,
+                    'resolution': resolution,
+                    'pixels': width * height,
+                    'carrier': carrier if is_encode else encoded.get(source, output),
+                    'payload': audio_payload if audio else text_payload,
+                    'output': output,
+                    'repeat': repeat,
+                    'workdir': workdir,
+                }
+                measured = _measure(case)
+                if is_encode:
+                    encoded[source] = output
+
+                result = _summarise(case, measured, payload_size)
+                results.append(result)
+                log(f"{operation:14} {resolution:>11} {payload_size / MB:8.2f} MB "
+                    f"{result['seconds_median']:8.3f} s {result['throughput_mb_s'] or 0:8.2f} MB/s "
+                    f"{result['peak_rss_mb']:8.1f} MB RSS")
+
+    return results
+
+
+def environment():
+    """Versions and machine details recorded alongside the results."""
+    import PIL
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with a baseline run.
+
+    Args:
+        results: Result dicts of this run
+        baseline: Result dicts of the earlier run
+        tolerance: Allowed slowdown as a fraction (0.1 = 10%)
+
+    Returns:
+        List of (result, baseline result, ratio) for cases slower than allowed
+    """
+    def key(r):
+        return (r['operation'], r['resolution'], r['payload_bytes'])
+
+    previous = {key(r): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(key(result))
+        if before is None or not before['seconds_median']:
+            continue
+        ratio = result['seconds_median'] / before['seconds_median']
+        if ratio > 1 + tolerance:
+            regressions.append((result, before, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the steganography engine and routes')
+    parser.add_argument('--large', action='store_true',
+                        help='also benchmark the create_large_image.py preset sizes')
+    parser.add_argument('--sizes', nargs='+', metavar='WxH',
+                        help='carrier sizes to benchmark instead of the defaults')
+    parser.add_argument('--payloads', nargs='+', type=int, metavar='BYTES',
+                        default=DEFAULT_PAYLOAD_SIZES, help='payload sizes in bytes')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case')
+    parser.add_argument('--no-routes', action='store_true', help='skip the Flask route benchmarks')
+    parser.add_argument('--workdir', help='directory for carriers (reused between runs)')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file to write')
+    parser.add_argument('--compare', metavar='JSON', help='earlier results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='allowed slowdown before a case counts as a regression')
+    args = parser.parse_args(argv)
+
+    if args.sizes:
+        sizes = [tuple(int(v) for v in size.lower().split('x')) for size in args.sizes]
+    else:
+        sizes = list(RESOLUTIONS)
+        if args.large:
+            sizes += [(w, h) for w, h, _, _ in PRESET_SIZES.values()]
+
+    results = run_benchmarks(sizes, args.payloads, args.repeat, not args.no_routes, args.workdir)
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for result, before, ratio in regressions:
+            print(f"REGRESSION {result['operation']} {result['resolution']} "
+                  f"{result['payload_bytes']} bytes: {before['seconds_median']:.3f} s -> "
+                  f"{result['seconds_median']:.3f} s ({ratio:.2f}x)")
+        if regressions:
+            return 1
+        print("No regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""
+Content-addressed caches for decode results
+
+Keys are derived from a hash of the uploaded carrier, so re-uploading the
+same image returns the earlier result without decoding it again.
+"""
+from collections import OrderedDict
+import os
+import struct
+import tempfile
+import threading
+import time
+
+# Expiry timestamp stored in front of every on-disk entry
+_EXPIRY = struct.Struct('>d')
+
+
+class MemoryCache:
+    """
+    In-process LRU cache with a byte budget and a TTL.
+
+    Args:
+        max_bytes: Most value bytes kept; least recently used entries are
+            evicted first
+        ttl: Seconds an entry stays valid after it is stored
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl=3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached bytes for key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Store bytes under key, evicting old entries to stay within max_bytes."""
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+        """Hit/miss counters and current usage."""
+        with self._lock:
+            return {'backend': 'memory', 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'entries': len(self._entries),
+                    'bytes': self._size, 'max_bytes': self.max_bytes}
+
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self._size -= len(value)
+
+
+class DiskCache:
+    """
+    On-disk LRU cache shared by every worker process using the same directory.
+
+    Entries are written atomically with os.replace(); a hit refreshes the
+    file's modification time, which is what eviction orders by. Hit/miss
+    counters are per process.
+
+    Args:
+        directory: Cache directory (created if missing)
+        max_bytes: Most bytes kept on disk
+        ttl: Seconds an entry stays valid after it is stored
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, ttl=3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        """Return the cached bytes for key, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                (expires,) = _EXPIRY.unpack(f.read(_EXPIRY.size))
+                value = f.read() if expires >= time.time() else None
+        except (OSError, struct.error):
+            value = None
+
+        if value is None:
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Store bytes under key, evicting old entries to stay within max_bytes."""
+        if len(value) > self.max_bytes:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_EXPIRY.pack(time.time() + self.ttl))
+                f.write(value)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._evict()
+
+    def stats(self):
+        """Hit/miss counters and current usage."""
+        entries = self._entries()
+        return {'backend': 'disk', 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries), 'max_bytes': self.max_bytes}
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.replace(':', '_') + '.cache')
+
+    def _entries(self):
+        """(mtime, size, path) of every entry, oldest first."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.cache'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        return entries
+
+    def _evict(self):
+        """Remove expired entries, then least recently used ones until within budget."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        cutoff = time.time() - self.ttl
+        for mtime, size, path in entries:
+            if total <= self.max_bytes and mtime >= cutoff:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+
+class NullCache:
+    """Cache that never stores anything, used when caching is disabled."""
+
+    hits = misses = 0
+
+    def get(self, key):
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def stats(self):
+        return {'backend': 'none', 'hits': 0, 'misses': self.misses}
+
+
+def create_cache(backend, max_bytes, ttl, directory='cache'):
+    """
+    Build a cache from configuration values.
+
+    Args:
+        backend: 'memory', 'disk' or 'none'
+        max_bytes: Byte budget
+        ttl: Entry lifetime in seconds
+        directory: Cache directory for the disk backend
+
+    Returns:
+        A MemoryCache, DiskCache or NullCache
+    """
+    if backend == 'memory':
+        return MemoryCache(max_bytes, ttl)
+    if backend == 'disk':
+        return DiskCache(directory, max_bytes, ttl)
+    if backend == 'none':
+        return NullCache()
+    raise ValueError(f"Unknown cache backend {backend!r}")
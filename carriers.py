@@ -0,0 +1,224 @@
+"""
+Pool of pre-decoded carrier images
+
+Carriers are kept decoded in memory, so audio can be embedded without
+uploading and inflating a large PNG on every request. A carrier is either
+registered by the operator (an image file, loaded once) or generated
+procedurally as a noise texture of a given size. Only the recipe of each
+carrier is kept permanently; decoded pixels live in an LRU with a byte
+budget and are reloaded or regenerated after eviction.
+"""
+from collections import OrderedDict
+import math
+import os
+import re
+import threading
+
+import numpy as np
+from PIL import Image
+
+from steganography import HEADER_SIZE, MAX_BITS_PER_CHANNEL
+
+# Generated carriers are mid-grey with noise in the low bits of every
+# channel value, which hides the embedded bits and still compresses a little
+NOISE_BASE = 112
+NOISE_MASK = 0x1F
+NOISE_BLOCK = 1024
+
+# Sides of carriers generated for a requested capacity are rounded up to a
+# multiple of this, so similar payloads share one pooled carrier
+SIZE_STEP = 512
+
+# Pillow stores RGB images at 4 bytes per pixel (with a padding byte), which
+# is what a decoded carrier costs against the pool's byte budget
+BYTES_PER_PIXEL = 4
+
+_CARRIER_ID = re.compile(r'[A-Za-z0-9_.-]{1,64}')
+_IMAGE_EXTENSIONS = ('.png', '.bmp', '.tif', '.tiff', '.webp')
+
+
+def noise_carrier(width, height, seed=0):
+    """
+    Generate a noise-textured RGB carrier.
+
+    Args:
+        width: Width in pixels
+        height: Height in pixels
+        seed: Seed of the noise, so a carrier can be regenerated exactly
+
+    Returns:
+        An RGB image holding its own copy of the pixels (Pillow stores RGB
+        at 4 bytes per pixel, so it cannot share the generated array)
+    """
+    # One block of noise repeated over the image is much faster than drawing
+    # every pixel and looks the same
+    block_width, block_height = min(width, NOISE_BLOCK), min(height, NOISE_BLOCK)
+    block = np.frombuffer(np.random.default_rng(seed).bytes(block_width * block_height * 3),
+                          dtype=np.uint8).reshape(block_height, block_width, 3)
+    block = (block & NOISE_MASK) + NOISE_BASE
+    pixels = np.tile(block, (-(-height // block_height), -(-width // block_width), 1))
+    pixels = np.ascontiguousarray(pixels[:height, :width])
+    return Image.fromarray(pixels, 'RGB')
+
+
+def carrier_size_for(payload_bytes, bits_per_channel=1):
+    """
+    Smallest square-ish carrier size, rounded up to SIZE_STEP, that holds a payload.
+
+    Returns:
+        (width, height) tuple
+    """
+    values = HEADER_SIZE * 8 + -(-payload_bytes * 8 // bits_per_channel)
+    side = math.isqrt(-(-values // 3) - 1) + 1
+    side = -(-side // SIZE_STEP) * SIZE_STEP
+    # Drop a step of rows when that still leaves enough room
+    height = side
+    while height > SIZE_STEP and side * (height - SIZE_STEP) * 3 >= values:
+        height -= SIZE_STEP
+    return side, height
+
+
+class CarrierPool:
+    """
+    Named carriers, decoded on first use and kept within a memory budget.
+
+    Images returned by get() are shared between requests and must not be
+    modified; the steganography engine copies an Image carrier before
+    embedding into it.
+
+    Args:
+        max_bytes: Most decoded pixel bytes kept; least recently used
+            carriers are evicted first
+        max_pixels: Largest carrier generate() and for_capacity() create
+    """
+
+    def __init__(self, max_bytes=1024 * 1024 * 1024, max_pixels=20000 * 20000):
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._recipes = {}
+        self._images = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def register(self, carrier_id, path):
+        """
+        Register an image file as a carrier; it is decoded on first use.
+
+        Args:
+            carrier_id: Name requests refer to the carrier by
+            path: Image file (any mode; converted to RGB when loaded)
+        """
+        if not _CARRIER_ID.fullmatch(carrier_id):
+            raise ValueError(f"Invalid carrier id {carrier_id!r}")
+        with Image.open(path) as img:
+            size = img.size
+        with self._lock:
+            self._recipes[carrier_id] = ('file', path, size)
+            self._discard(carrier_id)
+
+    def register_directory(self, directory):
+        """Register every image in a directory under its file name without extension."""
+        for name in sorted(os.listdir(directory)):
+            stem, extension = os.path.splitext(name)
+            if extension.lower() in _IMAGE_EXTENSIONS and _CARRIER_ID.fullmatch(stem):
+                self.register(stem, os.path.join(directory, name))
+
+    def generate(self, width, height, seed=0):
+        """
+        Add a procedurally generated noise carrier.
+
+        Returns:
+            The id of the carrier ('noise-<width>x<height>-<seed>')
+        """
+        if width < 1 or height < 1 or width * height > self.max_pixels:
+            raise ValueError(f"Carriers are limited to {self.max_pixels:,} pixels")
+        carrier_id = f'noise-{width}x{height}-{seed}'
+        with self._lock:
+            self._recipes.setdefault(carrier_id, ('noise', seed, (width, height)))
+        return carrier_id
+
+    def for_capacity(self, payload_bytes, bits_per_channel=1):
+        """
+        Pick a carrier that holds payload_bytes at bits_per_channel.
+
+        The smallest registered or generated carrier with room is used;
+        when none has room, a noise carrier sized for the payload is added.
+
+        Returns:
+            The id of the carrier
+        """
+        if not 1 <= bits_per_channel <= MAX_BITS_PER_CHANNEL:
+            raise ValueError(f"bits_per_channel must be between 1 and {MAX_BITS_PER_CHANNEL}")
+        values = HEADER_SIZE * 8 + -(-payload_bytes * 8 // bits_per_channel)
+        with self._lock:
+            fitting = [(size[0] * size[1], carrier_id)
+                       for carrier_id, (_, _, size) in self._recipes.items()
+                       if size[0] * size[1] * 3 >= values]
+        if fitting:
+            return min(fitting)[1]
+        return self.generate(*carrier_size_for(payload_bytes, bits_per_channel))
+
+    def size(self, carrier_id):
+        """(width, height) of a carrier, without decoding it."""
+        with self._lock:
+            recipe = self._recipes.get(carrier_id)
+        if recipe is None:
+            raise KeyError(carrier_id)
+        return recipe[2]
+
+    def get(self, carrier_id):
+        """
+        Return the decoded RGB image of a carrier, loading it on a miss.
+
+        Raises:
+            KeyError: If no carrier has this id
+        """
+        with self._lock:
+            img = self._images.get(carrier_id)
+            if img is not None:
+                self._images.move_to_end(carrier_id)
+                self.hits += 1
+                return img
+            recipe = self._recipes.get(carrier_id)
+            self.misses += 1
+        if recipe is None:
+            raise KeyError(carrier_id)
+
+        # Decode outside the lock; two requests racing for one carrier both load it
+        img = self._load(recipe)
+        nbytes = img.width * img.height * BYTES_PER_PIXEL
+        if nbytes <= self.max_bytes:
+            with self._lock:
+                self._discard(carrier_id)
+                self._images[carrier_id] = img
+                self._size += nbytes
+                while self._size > self.max_bytes:
+                    self._discard(next(iter(self._images)))
+                    self.evictions += 1
+        return img
+
+    def stats(self):
+        """Carriers known, which are decoded, and hit/miss counters."""
+        with self._lock:
+            carriers = [{'id': carrier_id, 'source': recipe[0], 'width': recipe[2][0],
+                         'height': recipe[2][1], 'loaded': carrier_id in self._images}
+                        for carrier_id, recipe in self._recipes.items()]
+            return {'carriers': carriers, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'bytes': self._size,
+                    'max_bytes': self.max_bytes}
+
+    def _load(self, recipe):
+        source, arg, (width, height) = recipe
+        if source == 'noise':
+            return noise_carrier(width, height, arg)
+        with Image.open(arg) as img:
+            img.load()
+            return img if img.mode == 'RGB' else img.convert('RGB')
+
+    def _discard(self, carrier_id):
+        img = self._images.pop(carrier_id, None)
+        if img is not None:
+            self._size -= img.width * img.height * BYTES_PER_PIXEL
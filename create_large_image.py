@@ -4,6 +4,16 @@ Helper script to create large blank images for storing long audio recordings
 from PIL import Image
 import sys
 
+from steganography import payload_capacity
+
+# Predefined sizes offered by the interactive prompt
+PRESET_SIZES = {
+    '1': (5000, 5000, 'large_5k.png', '~9 MB storage'),
+    '2': (10000, 10000, 'large_10k.png', '~36 MB storage'),
+    '3': (15000, 15000, 'large_15k.png', '~81 MB storage'),
+    '4': (20000, 20000, 'large_20k.png', '~143 MB storage'),
+}
+
 def create_blank_image(width, height, output_path='large_image.png', color=(255, 255, 255)):
     """
     Create a large blank image for audio steganography
@@ -15,11 +25,13 @@ def create_blank_image(width, height, output_path='large_image.png', color=(255,
         color: RGB color tuple (default: white)
     """
     # Calculate storage capacity
-    total_bytes = (width * height * 3) // 8
+    total_bytes = payload_capacity(width, height)
     total_mb = total_bytes / (1024 * 1024)
     
     print(f"Creating {width}x{height} image...")
     print(f"Storage capacity: {total_mb:.2f} MB ({total_bytes:,} bytes)")
+    for bits in (2, 4):
+        print(f"  with {bits} bits per channel: {payload_capacity(width, height, bits) / (1024 * 1024):.2f} MB")
     
     # Create the image
     img = Image.new('RGB', (width, height), color)
@@ -35,13 +47,7 @@ if __name__ == '__main__':
     print("=" * 70)
     print()
     
-    # Predefined sizes
-    sizes = {
-        '1': (5000, 5000, 'large_5k.png', '~9 MB storage'),
-        '2': (10000, 10000, 'large_10k.png', '~36 MB storage'),
-        '3': (15000, 15000, 'large_15k.png', '~81 MB storage'),
-        '4': (20000, 20000, 'large_20k.png', '~143 MB storage'),
-    }
+    sizes = PRESET_SIZES
     
     print("Select image size:")
     for key, (w, h, name, capacity) in sizes.items():
@@ -0,0 +1,37 @@
+"""
+Gunicorn settings for production
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Embedding and extraction are CPU-bound, so the default is one worker
+process per core with a couple of threads each (NumPy and Pillow release
+the GIL for most of the work, which lets a second request overlap I/O).
+The app is imported once in the master before forking, so NumPy, Pillow
+and the steganography engine are loaded a single time and shared
+copy-on-write between workers.
+
+Every setting can be overridden with an environment variable.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 2))
+preload_app = os.environ.get('WEB_PRELOAD', 'true').lower() == 'true'
+
+# Large carriers take a while; uploads of up to MAX_CONTENT_LENGTH need time too
+timeout = int(os.environ.get('WEB_TIMEOUT', 300))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 60))
+keepalive = 5
+
+# Recycle workers now and then so memory fragmented by large images is returned
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+# Heartbeat files on tmpfs, so a busy disk never makes workers look hung
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = os.environ.get('WEB_ACCESS_LOG', '-')
@@ -0,0 +1,267 @@
+"""
+Background job queue for long-running steganography operations
+
+Jobs run on a thread pool in the worker process that accepted them, but
+their state, progress and result are kept in a SQLite database shared by
+every worker, so any worker can report on, cancel or serve a job.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+_ACTIVE = (QUEUED, RUNNING)
+
+# Seconds between progress writes (and cancellation checks) of a running job
+PROGRESS_INTERVAL = 0.25
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it has been cancelled."""
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at its depth limit."""
+
+
+class Job:
+    """
+    State of one background job.
+
+    The job function receives report() as its progress callback; calling it
+    after cancel() raises JobCancelled, which stops the function at its next
+    progress report. A job cancelled before it starts never calls the
+    function, so its cleanup callable (if any) is run instead.
+
+    Jobs returned by JobManager.get() are snapshots read from the database;
+    only the worker that runs a job holds its future.
+    """
+
+    def __init__(self, manager, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.state = QUEUED
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.future = None
+        self.cleanup = None
+        self._manager = manager
+        self._cancel_event = threading.Event()
+        self._reported = 0.0
+
+    def report(self, fraction):
+        """Progress callback: record the fraction done and honour cancellation."""
+        self.progress = max(0.0, min(1.0, fraction))
+        self._manager._report(self)
+
+    def cancel(self):
+        """
+        Request cancellation, from any worker.
+
+        Queued jobs are dropped before they start; running jobs stop at
+        their next progress report.
+
+        Returns:
+            True if the job was still queued or running
+        """
+        return self._manager.cancel(self.id)
+
+    def to_dict(self):
+        """Public view of the job for the status endpoint."""
+        return {
+            'id': self.id,
+            'state': self.state,
+            'progress': round(self.progress * 100, 1),
+            'error': self.error,
+        }
+
+
+class JobManager:
+    """
+    Runs job functions on a thread pool with a bounded queue.
+
+    Args:
+        path: SQLite database holding the state of every worker's jobs
+        max_workers: Number of jobs run at the same time in this process
+        max_queued: Most jobs waiting or running at once in this process;
+            further submissions raise QueueFull
+        result_ttl: Seconds finished jobs are kept for status and result lookups
+    """
+
+    def __init__(self, path, max_workers=2, max_queued=16, result_ttl=3600):
+        self.path = path
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._running = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, state TEXT NOT NULL, '
+            'progress REAL NOT NULL, error TEXT, result TEXT, created REAL NOT NULL, '
+            'finished REAL, owner INTEGER NOT NULL, cancel INTEGER NOT NULL DEFAULT 0)')
+
+    def _connection(self):
+        """
+        One connection per thread, as sqlite3 connections must not be shared;
+        a process forked after the manager was created (gunicorn --preload)
+        opens its own.
+        """
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def submit(self, func, *args, cleanup=None, **kwargs):
+        """
+        Queue func(*args, progress=job.report, **kwargs) to run in the background.
+
+        Args:
+            func: Callable doing the work; its return value becomes job.result
+                and must be JSON serializable
+            cleanup: Optional callable run instead of func when the job is
+                cancelled before it starts (e.g. to close its input)
+
+        Returns:
+            The new Job
+        """
+        job = Job(self)
+        job.cleanup = cleanup
+        with self._lock:
+            self._prune()
+            if len(self._running) >= self.max_queued:
+                raise QueueFull(f"Job queue is full ({self.max_queued} jobs)")
+            self._connection().execute(
+                'INSERT INTO jobs (id, state, progress, created, owner) VALUES (?, ?, 0, ?, ?)',
+                (job.id, QUEUED, job.created, os.getpid()))
+            self._running[job.id] = job
+            job.future = self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        """Return a snapshot of the job with this id, or None."""
+        row = self._connection().execute(
+            'SELECT state, progress, error, result, created, finished, owner FROM jobs WHERE id = ?',
+            (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = Job(self, job_id)
+        job.state, job.progress, job.error, result, job.created, job.finished, owner = row
+        job.result = json.loads(result) if result is not None else None
+        if job.state in _ACTIVE and not _alive(owner):
+            # The worker running it was restarted or crashed
+            job.state, job.error = FAILED, 'The worker running this job stopped'
+            job.finished = time.time()
+            self._store(job)
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job, whichever worker runs it.
+
+        Returns:
+            True if the job was still queued or running
+        """
+        cursor = self._connection().execute(
+            f'UPDATE jobs SET cancel = 1 WHERE id = ? AND state IN {_ACTIVE}', (job_id,))
+        if cursor.rowcount == 0:
+            return False
+        with self._lock:
+            job = self._running.get(job_id)
+        if job is not None:
+            job._cancel_event.set()
+            if job.future.cancel():
+                self._drop(job)
+        return True
+
+    def _cancelled(self, job):
+        """Whether cancellation was requested here or by another worker."""
+        if job._cancel_event.is_set():
+            return True
+        row = self._connection().execute('SELECT cancel FROM jobs WHERE id = ?', (job.id,)).fetchone()
+        if row is not None and row[0]:
+            job._cancel_event.set()
+        return job._cancel_event.is_set()
+
+    def _report(self, job):
+        """Store a running job's progress and check for cancellation, at most every PROGRESS_INTERVAL."""
+        if job._cancel_event.is_set():
+            raise JobCancelled()
+        now = time.monotonic()
+        if now - job._reported < PROGRESS_INTERVAL:
+            return
+        job._reported = now
+        self._connection().execute('UPDATE jobs SET progress = ? WHERE id = ?', (job.progress, job.id))
+        if self._cancelled(job):
+            raise JobCancelled()
+
+    def _run(self, job, func, args, kwargs):
+        if self._cancelled(job):
+            self._drop(job)
+            return
+        job.state = RUNNING
+        self._store(job)
+        try:
+            result = func(*args, progress=job.report, **kwargs)
+        except JobCancelled:
+            self._finish(job, CANCELLED)
+        except Exception as e:
+            self._finish(job, FAILED, error=str(e))
+        else:
+            job.progress = 1.0
+            self._finish(job, DONE, result=result)
+
+    def _drop(self, job):
+        """Finish a job cancelled before it started, releasing what its function would have."""
+        self._finish(job, CANCELLED)
+        if job.cleanup is not None:
+            job.cleanup()
+
+    def _finish(self, job, state, result=None, error=None):
+        job.state = state
+        job.result = result
+        job.error = error
+        job.finished = time.time()
+        self._store(job)
+        with self._lock:
+            self._running.pop(job.id, None)
+
+    def _store(self, job):
+        self._connection().execute(
+            'UPDATE jobs SET state = ?, progress = ?, error = ?, result = ?, finished = ? WHERE id = ?',
+            (job.state, job.progress, job.error,
+             json.dumps(job.result) if job.result is not None else None, job.finished, job.id))
+
+    def _prune(self):
+        """Forget finished jobs older than result_ttl."""
+        self._connection().execute('DELETE FROM jobs WHERE finished < ?',
+                                   (time.time() - self.result_ttl,))
+
+
+def _alive(pid):
+    """Whether a process with this id exists on this host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
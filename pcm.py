@@ -0,0 +1,448 @@
+"""
+Lossless predictive codec for PCM WAV audio
+
+General-purpose compressors barely shrink uncompressed audio: neighbouring
+samples are close, but their low bits differ all the time. Like FLAC, this
+codec predicts every sample from the ones before it with a fixed polynomial
+predictor, chosen per block of frames, and stores only the prediction
+residuals, Rice coded. Stereo blocks may store the side (left minus right)
+or mid channel instead when it predicts better. Everything around the
+sample frames (the RIFF header and any trailing chunks) is kept verbatim,
+so decoding gives back the original file byte for byte.
+"""
+from collections import namedtuple
+import io
+import struct
+import wave
+
+import numpy as np
+
+# Predictors are chosen per block of frames; a record of blocks is the unit
+# the decoder waits for before it produces output
+BLOCK_FRAMES = 4096
+RECORD_FRAMES = 16 * BLOCK_FRAMES
+
+# Order 0 stores the samples, order n their n-th differences
+MAX_ORDER = 4
+
+# Rice quotients this large are stored in full after the unary stream
+ESCAPE = 32
+
+# Most leading bytes searched for the sample data before parsing all of it
+HEADER_SEARCH = 1024 * 1024
+
+# Stereo blocks store one of these pairs of signals, indexes into _signal()
+LEFT, RIGHT, SIDE, MID = range(4)
+STEREO_MODES = ((LEFT, RIGHT), (LEFT, SIDE), (SIDE, RIGHT), (MID, SIDE))
+
+# Stream header: channels, sample width, bytes before the sample frames,
+# frames, bytes after them. Records follow, each with a header of its body
+# size, unary quotient bytes and escaped quotient count.
+_HEADER = struct.Struct('>HBIQI')
+_RECORD = struct.Struct('>III')
+
+WavInfo = namedtuple('WavInfo', 'channels sample_width frames offset')
+
+
+def parse_wav(data):
+    """
+    Locate the sample frames of a PCM WAV file.
+
+    Args:
+        data: The file, or a leading part of it that holds the header
+
+    Returns:
+        WavInfo(channels, sample_width, frames, offset) with the frame count
+        the header declares and the offset of the first frame, or None if
+        data is not an integer PCM WAV file
+    """
+    data = memoryview(data)
+    for size in (HEADER_SEARCH, len(data)):
+        stream = io.BytesIO(data[:size])
+        try:
+            with wave.open(stream) as wav:
+                params = wav.getparams()
+                # wave stops reading at the first byte of the sample data
+                offset = stream.tell()
+        except (wave.Error, EOFError, struct.error):
+            if size >= len(data):
+                return None
+            continue
+        if params.sampwidth not in (1, 2, 3, 4):
+            return None
+        return WavInfo(params.nchannels, params.sampwidth, params.nframes, offset)
+    return None
+
+
+def compress(data, level=MAX_ORDER):
+    """
+    Encode a PCM WAV file.
+
+    Args:
+        data: The whole file
+        level: Highest prediction order tried (0-4); lower is faster
+
+    Returns:
+        Encoded bytes
+
+    Raises:
+        ValueError: If data is not an integer PCM WAV file
+    """
+    if not 0 <= level <= MAX_ORDER:
+        raise ValueError(f"pcm level must be between 0 and {MAX_ORDER}")
+    data = memoryview(data)
+    info = parse_wav(data)
+    if info is None:
+        raise ValueError("The pcm codec only takes uncompressed PCM WAV audio")
+    frame_size = info.channels * info.sample_width
+    frames = min(info.frames, (len(data) - info.offset) // frame_size)
+    end = info.offset + frames * frame_size
+
+    encoded = [_HEADER.pack(info.channels, info.sample_width, info.offset, frames, len(data) - end),
+               data[:info.offset], data[end:]]
+    encoded += _encode_frames(data[info.offset:end], info.channels, info.sample_width, level)
+    return b''.join(encoded)
+
+
+def estimate_size(data, total_size, level=MAX_ORDER, sample_size=64 * 1024, samples=4):
+    """
+    Estimate the encoded size of a PCM WAV file, or of a leading sample of it.
+
+    Short audio is encoded whole. Otherwise a few evenly spaced windows of
+    the frames are encoded on their own and their ratio is extrapolated to
+    the whole file.
+
+    Returns:
+        (estimated_bytes, exact) where exact is True if nothing was extrapolated
+    """
+    data = memoryview(data)
+    info = parse_wav(data)
+    if info is None:
+        raise ValueError("The pcm codec only takes uncompressed PCM WAV audio")
+    if len(data) == total_size and len(data) - info.offset <= sample_size * samples:
+        return len(compress(data, level)), True
+    frame_size = info.channels * info.sample_width
+    frames = (len(data) - info.offset) // frame_size
+    if not frames:
+        return total_size, False
+
+    window = max(1, min(frames // samples, sample_size // frame_size))
+    stride = (frames - window) // (samples - 1) if samples > 1 else 0
+    sampled = encoded = 0
+    for i in range(samples):
+        start = info.offset + i * stride * frame_size
+        frames_bytes = data[start:start + window * frame_size]
+        encoded += sum(len(record) for record in
+                       _encode_frames(frames_bytes, info.channels, info.sample_width, level))
+        sampled += len(frames_bytes)
+    return _HEADER.size + info.offset + -(-(total_size - info.offset) * encoded // sampled), False
+
+
+class Decompressor:
+    """
+    Incremental decoder with the interface of lzma.LZMADecompressor:
+    decompress(data, max_length) keeps unconsumed input, and eof and
+    needs_input tell whether the stream has ended or wants more input.
+    """
+
+    def __init__(self):
+        self.eof = False
+        self.needs_input = True
+        self._input = bytearray()
+        self._output = bytearray()
+        self._info = None
+        self._suffix_size = 0
+        self._frames_left = 0
+        self._history = None
+        self._done = False
+
+    def decompress(self, data, max_length=-1):
+        if self.eof:
+            raise EOFError("End of stream already reached")
+        self._input += data
+        while (max_length < 0 or len(self._output) < max_length) and self._step():
+            pass
+        if max_length < 0:
+            max_length = len(self._output)
+        decoded = bytes(self._output[:max_length])
+        del self._output[:max_length]
+
+        # Decode ahead when the caller took everything, so needs_input is
+        # only set when the buffered input really cannot produce more
+        while not self._output and not self._done and self._step():
+            pass
+        self.needs_input = not self._output and not self._done
+        self.eof = self._done and not self._output
+        return decoded
+
+    def _step(self):
+        """Decode the next part of the stream; False if it is not all buffered yet."""
+        if self._done:
+            return False
+        if self._info is None:
+            if len(self._input) < _HEADER.size:
+                return False
+            channels, width, prefix_size, frames, suffix_size = _HEADER.unpack_from(self._input)
+            if not channels or width not in (1, 2, 3, 4):
+                raise ValueError("Hidden audio is corrupted (invalid pcm header)")
+            if len(self._input) < _HEADER.size + prefix_size:
+                return False
+            self._output += self._input[_HEADER.size:_HEADER.size + prefix_size]
+            del self._input[:_HEADER.size + prefix_size]
+            self._info = WavInfo(channels, width, frames, prefix_size)
+            self._suffix_size = suffix_size
+            self._frames_left = frames
+            self._history = np.zeros((channels, MAX_ORDER), dtype=np.int64)
+            return True
+
+        if self._suffix_size is not None:
+            # The bytes after the frames are stored right after the prefix
+            if len(self._input) < self._suffix_size:
+                return False
+            self._suffix = bytes(self._input[:self._suffix_size])
+            del self._input[:self._suffix_size]
+            self._suffix_size = None
+
+        if not self._frames_left:
+            self._output += self._suffix
+            self._done = True
+            return True
+
+        if len(self._input) < _RECORD.size:
+            return False
+        body_size, quotient_size, escapes = _RECORD.unpack_from(self._input)
+        if len(self._input) < _RECORD.size + body_size:
+            return False
+        body = memoryview(bytes(self._input[_RECORD.size:_RECORD.size + body_size]))
+        del self._input[:_RECORD.size + body_size]
+
+        frames = min(RECORD_FRAMES, self._frames_left)
+        samples = _decode_record(body, quotient_size, escapes, frames,
+                                 self._info.channels, self._history)
+        self._history = np.concatenate((self._history, samples), axis=1)[:, -MAX_ORDER:]
+        self._output += _from_samples(samples, self._info.sample_width)
+        self._frames_left -= frames
+        return True
+
+
+def _to_samples(frames_bytes, channels, width):
+    """Interleaved little-endian frames as an int64 array of shape (channels, frames)."""
+    if width == 1:
+        samples = np.frombuffer(frames_bytes, dtype=np.uint8).astype(np.int64) - 128
+    elif width == 3:
+        triples = np.frombuffer(frames_bytes, dtype=np.uint8).reshape(-1, 3).astype(np.int64)
+        samples = triples[:, 0] | triples[:, 1] << 8 | triples[:, 2] << 16
+        samples -= (samples & 0x800000) << 1
+    else:
+        samples = np.frombuffer(frames_bytes, dtype=f'<i{width}').astype(np.int64)
+    return samples.reshape(-1, channels).T
+
+
+def _from_samples(samples, width):
+    """Inverse of _to_samples()."""
+    interleaved = samples.T.ravel()
+    if width == 1:
+        return (interleaved + 128).astype(np.uint8).tobytes()
+    if width == 3:
+        return interleaved.astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    return interleaved.astype(f'<i{width}').tobytes()
+
+
+def _signal(index, left, right):
+    """Left, right, side or mid signal of a stereo pair."""
+    if index == LEFT:
+        return left
+    if index == RIGHT:
+        return right
+    if index == SIDE:
+        return left - right
+    return (left + right) >> 1
+
+
+def _channels(mode, first, second):
+    """Left and right from the pair of signals a stereo mode stores."""
+    if mode == 0:
+        return first, second
+    if mode == 1:
+        return first, first - second
+    if mode == 2:
+        return first + second, second
+    # mid is (left + right) >> 1, so its lost bit is the parity of side
+    total = (first << 1) | (second & 1)
+    left = (total + second) >> 1
+    return left, left - second
+
+
+def _block_starts(frames):
+    starts = np.arange(0, frames, BLOCK_FRAMES)
+    return starts, np.diff(np.append(starts, frames))
+
+
+def _predict(signal, history, max_order):
+    """
+    Pick the fixed predictor order of every block of a signal.
+
+    Returns:
+        (orders, costs, residuals) with the best order and its summed
+        absolute residual per block, and the residuals of those orders
+    """
+    starts, lengths = _block_starts(len(signal))
+    differences = np.concatenate((history, signal))
+    residuals = []
+    for order in range(max_order + 1):
+        residuals.append(differences[MAX_ORDER - order:])
+        differences = np.diff(differences)
+    residuals = np.stack(residuals)
+    costs = np.add.reduceat(np.abs(residuals), starts, axis=1)
+    orders = costs.argmin(axis=0)
+    selected = residuals[np.repeat(orders, lengths), np.arange(len(signal))]
+    return orders, costs.min(axis=0), selected
+
+
+def _encode_frames(frames_bytes, channels, width, level):
+    """Encode sample frames as consecutive records, starting from silence."""
+    frame_size = channels * width
+    history = np.zeros((channels, MAX_ORDER), dtype=np.int64)
+    records = []
+    for start in range(0, len(frames_bytes), RECORD_FRAMES * frame_size):
+        samples = _to_samples(frames_bytes[start:start + RECORD_FRAMES * frame_size], channels, width)
+        records.append(_encode_record(samples, history, level))
+        history = np.concatenate((history, samples), axis=1)[:, -MAX_ORDER:]
+    return records
+
+
+def _encode_record(samples, history, max_order):
+    """Encode up to RECORD_FRAMES frames, continuing the prediction from history."""
+    channels, frames = samples.shape
+    starts, lengths = _block_starts(frames)
+    blocks = len(starts)
+
+    if channels == 2:
+        predicted = [_predict(_signal(index, *samples), _signal(index, *history), max_order)
+                     for index in range(4)]
+        costs = np.stack([predicted[first][1] + predicted[second][1]
+                          for first, second in STEREO_MODES])
+        modes = costs.argmin(axis=0)
+        slots = np.array(STEREO_MODES)[modes].T
+        orders = np.stack([np.choose(slot, [p[0] for p in predicted]) for slot in slots])
+        all_residuals = np.stack([p[2] for p in predicted])
+        residuals = np.stack([all_residuals[np.repeat(slot, lengths), np.arange(frames)]
+                              for slot in slots])
+    else:
+        modes = np.zeros(blocks, dtype=np.int64)
+        predicted = [_predict(samples[c], history[c], max_order) for c in range(channels)]
+        orders = np.stack([p[0] for p in predicted])
+        residuals = np.stack([p[2] for p in predicted])
+
+    # Zigzag map to unsigned, then Rice code every block with its own parameter
+    residuals = residuals.ravel()
+    unsigned = (residuals << 1) ^ (residuals >> 63)
+    segment_starts = (np.arange(channels)[:, None] * frames + starts).ravel()
+    segment_lengths = np.tile(lengths, channels)
+    means = np.add.reduceat(unsigned, segment_starts) / segment_lengths
+    guess = np.floor(np.log2(np.maximum(means, 1))).astype(np.int64)
+    best_cost = None
+    for candidate in (guess - 1, guess, guess + 1):
+        candidate = np.maximum(candidate, 0)
+        quotients = np.minimum(unsigned >> np.repeat(candidate, segment_lengths), ESCAPE)
+        cost = np.add.reduceat(quotients, segment_starts) + segment_lengths * (candidate + 1)
+        if best_cost is None:
+            best_cost, parameters = cost, candidate
+        else:
+            better = cost < best_cost
+            best_cost = np.where(better, cost, best_cost)
+            parameters = np.where(better, candidate, parameters)
+    shifts = np.repeat(parameters, segment_lengths)
+    quotients = unsigned >> shifts
+    escaped = quotients >= ESCAPE
+    escapes = quotients[escaped].astype('<u8').tobytes()
+    quotients = np.minimum(quotients, ESCAPE)
+
+    # Unary quotients: q ones then a zero, so every zero ends a sample
+    unary = np.ones(int(quotients.sum()) + len(quotients), dtype=np.uint8)
+    unary[np.cumsum(quotients + 1) - 1] = 0
+    unary = np.packbits(unary).tobytes()
+
+    # Remainders, grouped by Rice parameter so each group has a fixed width
+    remainders = unsigned & ((1 << shifts) - 1)
+    packed = []
+    for parameter in np.unique(parameters):
+        if parameter:
+            values = remainders[shifts == parameter].astype('>u8')
+            bits = np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1)[:, 64 - parameter:]
+            packed.append(np.packbits(bits).tobytes())
+
+    body = b''.join([modes.astype(np.uint8).tobytes(), orders.astype(np.uint8).tobytes(),
+                     parameters.astype(np.uint8).tobytes(), unary, escapes] + packed)
+    return _RECORD.pack(len(body), len(unary), int(escaped.sum())) + body
+
+
+def _decode_record(body, quotient_size, escape_count, frames, channels, history):
+    """Decode one record body to int64 samples of shape (channels, frames)."""
+    starts, lengths = _block_starts(frames)
+    blocks = len(starts)
+    count = channels * frames
+    offset = 0
+
+    def take(size):
+        nonlocal offset
+        if offset + size > len(body):
+            raise ValueError("Hidden audio is corrupted (truncated pcm record)")
+        offset += size
+        return body[offset - size:offset]
+
+    modes = np.frombuffer(take(blocks), dtype=np.uint8)
+    orders = np.frombuffer(take(channels * blocks), dtype=np.uint8).reshape(channels, blocks)
+    parameters = np.frombuffer(take(channels * blocks), dtype=np.uint8).astype(np.int64)
+    unary = np.unpackbits(np.frombuffer(take(quotient_size), dtype=np.uint8))
+    escapes = np.frombuffer(take(escape_count * 8), dtype='<u8').astype(np.int64)
+    if modes.max(initial=0) >= len(STEREO_MODES) or orders.max(initial=0) > MAX_ORDER:
+        raise ValueError("Hidden audio is corrupted (invalid pcm record)")
+
+    ends = np.flatnonzero(unary == 0)[:count]
+    if len(ends) < count:
+        raise ValueError("Hidden audio is corrupted (truncated pcm record)")
+    quotients = np.diff(ends, prepend=-1) - 1
+    escaped = quotients == ESCAPE
+    if escaped.sum() != escape_count:
+        raise ValueError("Hidden audio is corrupted (invalid pcm record)")
+    quotients[escaped] = escapes
+
+    shifts = np.repeat(parameters, np.tile(lengths, channels))
+    remainders = np.zeros(count, dtype=np.int64)
+    for parameter in np.unique(parameters):
+        if parameter:
+            selected = shifts == parameter
+            width = int(parameter) * int(selected.sum())
+            bits = np.unpackbits(np.frombuffer(take(-(-width // 8)), dtype=np.uint8))[:width]
+            padded = np.zeros((len(bits) // parameter, 64), dtype=np.uint8)
+            padded[:, 64 - parameter:] = bits.reshape(-1, parameter)
+            remainders[selected] = np.packbits(padded, axis=1).view('>u8').ravel()
+    unsigned = (quotients << shifts) | remainders
+    residuals = ((unsigned >> 1) ^ -(unsigned & 1)).reshape(channels, frames)
+
+    # Undo the prediction block by block, each seeded by the frames before it
+    samples = np.empty((channels, frames), dtype=np.int64)
+    for block, (start, length) in enumerate(zip(starts, lengths)):
+        stop = start + length
+        if channels == 2:
+            mode = int(modes[block])
+            signals = [_integrate(residuals[slot, start:stop], int(orders[slot, block]),
+                                  _signal(index, *history))
+                       for slot, index in enumerate(STEREO_MODES[mode])]
+            samples[:, start:stop] = _channels(mode, *signals)
+        else:
+            for c in range(channels):
+                samples[c, start:stop] = _integrate(residuals[c, start:stop], int(orders[c, block]),
+                                                    history[c])
+        history = np.concatenate((history, samples[:, start:stop]), axis=1)[:, -MAX_ORDER:]
+    return samples
+
+
+def _integrate(residuals, order, history):
+    """Undo `order` differences, seeded with the differences of the preceding samples."""
+    signal = residuals
+    for level in range(order - 1, -1, -1):
+        seed = np.diff(history[MAX_ORDER - order:], level)[-1]
+        signal = seed + np.cumsum(signal)
+    return signal
@@ -0,0 +1,184 @@
+"""
+Token-bucket rate limiting keyed by client
+
+Every client key owns a bucket holding up to `capacity` tokens that refills
+at `rate` tokens per second; a request takes one token or is refused with
+the time until one is available. Each check is O(1) and only the token
+count and last update time are stored per key.
+"""
+from collections import OrderedDict
+import os
+import sqlite3
+import threading
+import time
+
+# Seconds per unit accepted in limits such as '200 per hour'
+_PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_limit(limit):
+    """
+    Parse a limit such as '200 per hour' or '10/minute'.
+
+    Returns:
+        (requests, seconds) tuple
+    """
+    count, _, period = limit.replace('/', ' per ').partition(' per ')
+    period = period.strip().rstrip('s')
+    if period not in _PERIODS or not count.strip().isdigit():
+        raise ValueError(f"Invalid rate limit {limit!r}")
+    return int(count), _PERIODS[period]
+
+
+def _refill(tokens, updated, now, rate, capacity, cost):
+    """
+    Apply one request to a bucket.
+
+    Returns:
+        (tokens left, seconds to wait or 0 if the request is allowed)
+    """
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / rate
+
+
+class MemoryRateLimiter:
+    """
+    Per-process token buckets, bounded to max_keys clients.
+
+    Args:
+        requests: Bucket capacity (burst size)
+        per: Seconds in which a full bucket refills
+        max_keys: Most clients tracked; the least recently seen are dropped,
+            which only ever resets them to a full bucket
+    """
+
+    def __init__(self, requests, per, max_keys=100000):
+        self.capacity = requests
+        self.rate = requests / per
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key, cost=1):
+        """
+        Take cost tokens from the bucket of key.
+
+        Returns:
+            (allowed, retry_after) where retry_after is in seconds
+        """
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens, retry_after = _refill(tokens, updated, now, self.rate, self.capacity, cost)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after == 0, retry_after
+
+
+class SQLiteRateLimiter:
+    """
+    Token buckets in a SQLite database shared by every worker process.
+
+    Each check is one indexed read and write inside an IMMEDIATE
+    transaction, so concurrent workers never double-spend a token. Buckets
+    that have refilled completely carry no information and are purged from
+    time to time, keeping the table as small as the set of active clients.
+
+    Args:
+        path: Database file (point it at tmpfs to keep it off disk)
+        requests: Bucket capacity (burst size)
+        per: Seconds in which a full bucket refills
+        purge_every: Checks between purges of full buckets
+    """
+
+    def __init__(self, path, requests, per, purge_every=1000):
+        self.path = path
+        self.capacity = requests
+        self.rate = requests / per
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._checks = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS buckets '
+                       '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+
+    def _connection(self):
+        """
+        One connection per thread, as sqlite3 connections must not be shared;
+        a process forked after the limiter was created (gunicorn --preload)
+        opens its own.
+        """
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=OFF')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def acquire(self, key, cost=1):
+        """
+        Take cost tokens from the bucket of key.
+
+        Returns:
+            (allowed, retry_after) where retry_after is in seconds
+        """
+        db = self._connection()
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row is not None else (self.capacity, now)
+            tokens, retry_after = _refill(tokens, updated, now, self.rate, self.capacity, cost)
+            db.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                       (key, tokens, now))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+        self._checks += 1
+        if self._checks % self.purge_every == 0:
+            self.purge()
+        return retry_after == 0, retry_after
+
+    def purge(self):
+        """Delete buckets that have refilled completely."""
+        cutoff = time.time() - self.capacity / self.rate
+        self._connection().execute('DELETE FROM buckets WHERE updated < ?', (cutoff,))
+
+
+class NullRateLimiter:
+    """Limiter that allows everything, used when rate limiting is disabled."""
+
+    def acquire(self, key, cost=1):
+        return True, 0.0
+
+
+def create_rate_limiter(backend, limit, path='ratelimit.sqlite3'):
+    """
+    Build a rate limiter from configuration values.
+
+    Args:
+        backend: 'sqlite', 'memory' or 'none'
+        limit: Limit such as '200 per hour'
+        path: Database file for the sqlite backend
+
+    Returns:
+        A SQLiteRateLimiter, MemoryRateLimiter or NullRateLimiter
+    """
+    if backend == 'none':
+        return NullRateLimiter()
+    requests, per = parse_limit(limit)
+    if backend == 'sqlite':
+        return SQLiteRateLimiter(path, requests, per)
+    if backend == 'memory':
+        return MemoryRateLimiter(requests, per)
+    raise ValueError(f"Unknown rate limit backend {backend!r}")
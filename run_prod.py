@@ -1,6 +1,24 @@
-from waitress import serve
-from app import app
+"""
+Production server runner
+
+Runs gunicorn with gunicorn.conf.py (worker processes, threads and
+preloading are configured there and through environment variables).
+Gunicorn does not run on Windows, where waitress is used instead.
+"""
+import os
+import sys
 
 if __name__ == "__main__":
-    print("Starting production server on http://127.0.0.1:8080")
-    serve(app, host='0.0.0.0', port=8080, threads=4)
+    if os.name == 'nt':
+        from waitress import serve
+        from app import app
+
+        port = int(os.environ.get('PORT', 5000))
+        print(f"Starting production server on http://127.0.0.1:{port}")
+        serve(app, host='0.0.0.0', port=port, threads=int(os.environ.get('WEB_THREADS', 4)))
+    else:
+        from gunicorn.app.wsgiapp import run
+
+        config = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+        sys.argv = ['gunicorn', '-c', config, 'wsgi:app']
+        run()
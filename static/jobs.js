@@ -0,0 +1,70 @@
+// Submit a form as a background job and poll its progress, so a long encode
+// or decode never holds a request open and can be cancelled. Without
+// JavaScript the form posts to its synchronous route as before.
+//
+// The page provides #jobStatus (shown while the job runs) holding
+// #jobProgress, #jobText and #jobCancel, and an #jobError alert.
+function submitAsJob(form, jobUrl, onDone) {
+    const panel = document.getElementById('jobStatus');
+    const bar = document.getElementById('jobProgress');
+    const text = document.getElementById('jobText');
+    const cancel = document.getElementById('jobCancel');
+    const error = document.getElementById('jobError');
+    const submit = form.querySelector('button[type="submit"]');
+    const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+    const finish = (message) => {
+        panel.style.display = 'none';
+        submit.disabled = false;
+        if (message) {
+            error.textContent = message;
+            error.style.display = '';
+        }
+    };
+
+    form.addEventListener('submit', async (event) => {
+        event.preventDefault();
+        error.style.display = 'none';
+        submit.disabled = true;
+        bar.value = 0;
+        text.textContent = 'Uploading...';
+        panel.style.display = '';
+
+        let job;
+        try {
+            const response = await fetch(jobUrl, { method: 'POST', body: new FormData(form) });
+            job = await response.json();
+            if (!response.ok) {
+                return finish(job.error || response.statusText);
+            }
+        } catch (err) {
+            return finish('Upload failed: ' + err.message);
+        }
+
+        cancel.onclick = () => fetch(job.status_url, { method: 'DELETE' });
+        try {
+            while (true) {
+                const response = await fetch(job.status_url);
+                const status = await response.json().catch(() => ({}));
+                if (!response.ok) {
+                    return finish(status.error || `Job status unavailable (${response.status})`);
+                }
+                bar.value = status.progress;
+                text.textContent = `${status.state} - ${status.progress}%`;
+                if (status.state === 'done') {
+                    finish();
+                    return onDone(job.result_url);
+                }
+                if (status.state === 'failed') {
+                    return finish(status.error);
+                }
+                if (status.state === 'cancelled') {
+                    return finish('Cancelled');
+                }
+                await sleep(500);
+            }
+        } catch (err) {
+            finish('Lost track of the job: ' + err.message);
+        }
+    });
+}
@@ -1,279 +1,2287 @@
+"""
+LSB steganography engine for hiding text and audio in images
+
+Also usable from the command line:
+    python -m steganography encode carrier.png -m "secret" -o encoded.png
+    echo "secret" | python -m steganography encode photos/ --output-dir out/ --jobs 4
+    python -m steganography decode encoded.png
+    python -m steganography encode-audio carrier.png < voice.wav > encoded.png
+    python -m steganography decode-audio encoded.png > voice.wav
+    python -m steganography capacity 'photos/*.png' --audio voice.wav --bits 2
+    python -m steganography encode-audio --shards 'photos/*.png' -a long.wav --output-dir shards/
+    python -m steganography decode-audio --shards 'shards/*.png' -o long.wav
+    python -m steganography encode carrier.png -m "secret" --key hunter2 -o scattered.png
+"""
 from PIL import Image
+import PIL
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing import shared_memory
+import numpy as np
+import argparse
 import base64
+import bz2
+import contextvars
+import hashlib
+import io
+import lzma
+import os
+import struct
+import sys
+import threading
+import time
 import zlib
 
-def encode(image_path, secret_message, output_path):
+import pcm
+
+# Container format: a fixed binary header stored in the LSBs of the first
+# pixels, followed by the payload itself. Images written before the header
+# existed ("message###" and "size:size###...") are still detected and read.
+MAGIC = b'STEG'
+CONTAINER_VERSION = 2
+
+# Payload kinds
+KIND_TEXT = 0
+KIND_AUDIO = 1
+
+# Payload codecs
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+CODEC_BZ2 = 3
+CODEC_PCM = 4
+
+# magic, version, kind, codec, flags, payload length, CRC32 of the payload
+_HEADER = struct.Struct('>4sBBBBQI')
+HEADER_SIZE = _HEADER.size
+
+ContainerHeader = namedtuple('ContainerHeader', 'version kind codec flags length crc')
+
+# One slice of an audio payload split across several carriers. Each shard's
+# container payload starts with: payload id, shard index, shard count, length
+# and CRC32 of the whole (encoded) payload. The container codec is the codec
+# of the whole payload; the container checksum covers only the shard.
+KIND_AUDIO_SHARD = 2
+_SHARD_HEADER = struct.Struct('>16sHHQI')
+SHARD_HEADER_SIZE = _SHARD_HEADER.size
+MAX_SHARDS = 0xFFFF
+
+ShardHeader = namedtuple('ShardHeader', 'payload_id index count total_length total_crc')
+
+# The header is always stored 1 bit per channel value; the payload follows
+# it with the number of bits per channel value kept in the low flag bits
+# (stored as depth - 1, so images without the flag read as 1 bit)
+MAX_BITS_PER_CHANNEL = 4
+_FLAG_DEPTH_MASK = 0x03
+_PAYLOAD_FIRST_VALUE = HEADER_SIZE * 8
+
+# Keyed scattering: the header stays in the first channel values, but the
+# payload goes into keyed pseudo-random channel values after it. Those are
+# split into one segment per payload value; a keyed Feistel permutation
+# gives every segment its payload value and a keyed hash picks the channel
+# value within the segment. Any band of rows maps to the payload values it
+# holds, so the placement is computed a tile at a time and never as a
+# permutation of the whole image.
+_FLAG_SCATTERED = 0x04
+_SCATTER_ROUNDS = 4
+
+# Scattered containers change the payload layout, so they are written as
+# version 2 and readers that predate them refuse them; everything else is
+# still written as version 1. Flag bits a reader does not know are refused
+# rather than ignored.
+_SCATTERED_VERSION = 2
+_KNOWN_FLAGS = _FLAG_DEPTH_MASK | _FLAG_SCATTERED
+
+# Transient bytes per scattered payload value while its tile is processed:
+# segment, bound, hash, slot and index arrays
+_SCATTER_BYTES_PER_VALUE = 48
+
+# Bytes read per step while scanning for a legacy '###' delimiter
+_LEGACY_SCAN_CHUNK = 64 * 1024
+
+# Default working-memory budget for embedding, spent on one horizontal tile
+# of the carrier at a time
+TILE_MEMORY_BUDGET = 64 * 1024 * 1024
+
+# Transient bytes per pixel while a tile is embedded: the cropped tile
+# (4 bytes per RGB pixel in Pillow), its array copy and the payload bits
+_TILE_BYTES_PER_PIXEL = 16
+
+# Parallel mode: tiles and bands with fewer channel values than this are
+# not worth shipping to worker processes and are handled in-process
+_PARALLEL_MIN_VALUES = 4 * 1024 * 1024
+
+# Process pools for parallel mode, one per worker count, created on first use
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Payload bytes extracted per band, and the most audio yielded per chunk,
+# when streaming a payload out of an image
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Lossless output encodings for encoded images; alpha tells whether an
+# RGBA carrier keeps its alpha channel (Pillow writes BMP as 32-bit BGRA
+# but reads it back as RGB, so RGBA carriers are converted to RGB for it)
+OutputProfile = namedtuple('OutputProfile', 'format options extension mimetype alpha')
+OUTPUT_PROFILES = {
+    'png': OutputProfile('PNG', {}, 'png', 'image/png', True),
+    'fast': OutputProfile('PNG', {'compress_level': 1}, 'png', 'image/png', True),
+    'small': OutputProfile('PNG', {'compress_level': 9, 'optimize': True}, 'png', 'image/png', True),
+    'bmp': OutputProfile('BMP', {}, 'bmp', 'image/bmp', False),
+    'tiff': OutputProfile('TIFF', {'compression': 'tiff_deflate'}, 'tiff', 'image/tiff', True),
+    # exact keeps the color of fully transparent RGBA pixels, which hold payload bits too
+    'webp': OutputProfile('WEBP', {'lossless': True, 'method': 0, 'exact': True}, 'webp', 'image/webp', True),
+}
+DEFAULT_OUTPUT_PROFILE = 'png'
+
+# Largest width or height libwebp can encode
+WEBP_MAX_SIDE = 16383
+
+# 'auto' switches to the fast PNG profile above this many pixels, where the
+# default zlib effort makes saving slower than embedding
+FAST_PROFILE_MIN_PIXELS = 3840 * 2160
+
+# Compression estimates for capacity checks compress this many evenly
+# spaced windows of the audio instead of all of it
+COMPRESSION_SAMPLE_SIZE = 64 * 1024
+COMPRESSION_SAMPLES = 4
+
+# Audio payload codecs: header id, default level, compress(data, level) and
+# a factory for an incremental decompressor. pcm only takes PCM WAV audio
+# and its level is the highest prediction order it tries.
+Codec = namedtuple('Codec', 'id default_level compress decompressor')
+CODECS = {
+    'none': Codec(CODEC_NONE, None, None, None),
+    'zlib': Codec(CODEC_ZLIB, 9, lambda data, level: zlib.compress(data, level), zlib.decompressobj),
+    'lzma': Codec(CODEC_LZMA, 6, lambda data, level: lzma.compress(data, preset=level),
+                  lzma.LZMADecompressor),
+    'bz2': Codec(CODEC_BZ2, 9, lambda data, level: bz2.compress(data, level), bz2.BZ2Decompressor),
+    'pcm': Codec(CODEC_PCM, pcm.MAX_ORDER, pcm.compress, pcm.Decompressor),
+}
+_CODECS_BY_ID = {codec.id: codec for codec in CODECS.values()}
+DEFAULT_CODEC = 'zlib'
+
+# 'auto' stores audio uncompressed when a fast trial compression of a
+# sample saves less than this fraction (mp3, ogg, webm and m4a are
+# already compressed)
+AUTO_CODEC_MIN_SAVING = 0.05
+
+# Outcome of one batch item: value is None and error a message if it failed
+BatchResult = namedtuple('BatchResult', 'index value error seconds')
+
+# Optional timing hook, called as hook(stage, seconds) after every
+# instrumented stage; see set_timing_hook()
+_timing_hook = None
+
+
+class _Stage:
+    """Context manager timing one stage and reporting it to the timing hook."""
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        hook = _timing_hook
+        if hook is not None:
+            hook(self.name, time.perf_counter() - self.start)
+
+
+class _NullStage:
+    """Shared do-nothing stage used while no timing hook is installed."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def _stage(name):
+    """Time a block as the named stage, or do nothing if no hook is installed."""
+    return _NULL_STAGE if _timing_hook is None else _Stage(name)
+
+
+def _in_caller_context(func):
+    """
+    Wrap func to run on a pool thread in a copy of the calling thread's
+    context variables, so the timing hook sees the caller's context (such
+    as the web request a batch belongs to) rather than the pool thread's.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args):
+        # A context can only be entered by one thread at a time
+        return context.copy().run(func, *args)
+    return run
+
+
+def set_timing_hook(hook):
+    """
+    Install a per-stage timing hook for the whole process.
+
+    Stages: open, convert, payload, compress, embed, save, header, extract
+    and decompress. Streaming decodes report extract and decompress once
+    per band. Stages of batch items and shards run on pool threads in a
+    copy of the caller's context variables.
+
+    Args:
+        hook: Callable receiving (stage, seconds), or None to disable timing
+    """
+    global _timing_hook
+    _timing_hook = hook
+
+
+def _bytes_to_bits(data):
+    """
+    Unpack a byte string into an array of bits (MSB first).
+
+    Args:
+        data: Bytes to unpack
+
+    Returns:
+        uint8 array holding one 0/1 value per bit
+    """
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+
+
+def _message_to_bits(message):
+    """
+    Convert a text message into the bit sequence written by encode().
+
+    Every character is written as format(ord(char), '08b'), which is a
+    plain Latin-1 byte for the usual case and a longer bit group for
+    characters above U+00FF.
+
+    Args:
+        message: Text to convert
+
+    Returns:
+        uint8 array holding one 0/1 value per bit
+    """
+    try:
+        return _bytes_to_bits(message.encode('latin-1'))
+    except UnicodeEncodeError:
+        # Characters above U+00FF do not fit in one byte; keep their full width
+        bit_string = ''.join(format(ord(char), '08b') for char in message)
+        return np.frombuffer(bit_string.encode('ascii'), dtype=np.uint8) - ord('0')
+
+
+def _open_image(image_path):
+    """
+    Open an image from a path, a binary file-like object or raw bytes.
+
+    Args:
+        image_path: Path, file-like object or bytes holding the image
+
+    Returns:
+        The (lazily loaded) image
+    """
+    if isinstance(image_path, (bytes, bytearray, memoryview)):
+        image_path = io.BytesIO(image_path)
+    return Image.open(image_path)
+
+
+# Carrier modes embedded into without converting: the payload goes into the
+# R, G and B values and RGBA keeps its alpha channel untouched
+_EMBED_MODES = ('RGB', 'RGBA')
+
+# Once a read needs more than this fraction of the rows, the whole image is
+# decoded instead of a prefix
+_PREFIX_MAX_FRACTION = 0.5
+
+# Prefix decoding narrows Image.tile and Image._size, which are Pillow
+# internals; it is only used on the Pillow releases it was tested with (see
+# requirements.txt), and any failure falls back to decoding the whole image
+_PREFIX_PILLOW_VERSIONS = ((10, 0), (11, 0))
+_PREFIX_DECODING = (_PREFIX_PILLOW_VERSIONS[0]
+                    <= tuple(int(part) for part in PIL.__version__.split('.')[:2])
+                    < _PREFIX_PILLOW_VERSIONS[1])
+
+
+def _prefix_tile(img):
+    """
+    The tile of an opened image if its pixels are stored top row first in
+    one stream, so the first rows can be decoded without the rest; else None.
+
+    That holds for non-interlaced PNG and uncompressed top-down raw data
+    (TIFF, PPM, ...); BMP is stored bottom row first.
+    """
+    if len(img.tile) != 1:
+        return None
+    tile = img.tile[0]
+    name, extent, _, args = tile
+    if extent != (0, 0) + img.size:
+        return None
+    if name == 'zip' and img.format == 'PNG' and not img.info.get('interlace'):
+        return tile
+    if name == 'raw':
+        orientation = args[2] if isinstance(args, tuple) and len(args) > 2 else 1
+        if orientation > 0:
+            return tile
+    return None
+
+
+class _RowReader:
+    """
+    Read-only image that decodes only as many leading rows as are read.
+
+    Reading a container header or a short message from a large photo then
+    inflates a few rows rather than the whole image. Formats that cannot be
+    decoded a prefix at a time, and reads reaching past half the image,
+    decode the whole image once.
+
+    Provides the parts of the Image interface the readers use: size, crop()
+    and close().
+    """
+
+    def __init__(self, image_path):
+        if isinstance(image_path, (bytes, bytearray, memoryview)):
+            image_path = io.BytesIO(image_path)
+        self._source = image_path
+        self._start = image_path.tell() if hasattr(image_path, 'tell') else None
+        self._img = Image.open(image_path)
+        self.size = self._img.size
+        self._partial = _PREFIX_DECODING and _prefix_tile(self._img) is not None
+        self._rows = 0
+
+    def load_rows(self, bottom):
+        """Make sure rows [0, bottom) are decoded."""
+        height = self.size[1]
+        bottom = min(bottom, height)
+        if bottom <= self._rows:
+            return
+        if not self._partial or bottom > height * _PREFIX_MAX_FRACTION:
+            bottom = height
+        img = self._reopen() if self._rows else self._img
+        if bottom < height:
+            try:
+                self._load_prefix(img, bottom)
+            except Exception:
+                # Pillow internals behaved unexpectedly: decode everything from now on
+                self._partial = False
+                bottom = height
+                img = self._reopen()
+                img.load()
+        else:
+            img.load()
+        self._img, self._rows = img, bottom
+
+    def _load_prefix(self, img, bottom):
+        """Decode rows [0, bottom) of a freshly opened image by narrowing its tile to them."""
+        # The decoder stops once the narrowed tile is filled
+        name, _, offset, args = img.tile[0]
+        img.tile = [(name, (0, 0, self.size[0], bottom), offset, args)]
+        img._size = (self.size[0], bottom)
+        img.load()
+        if img.size != (self.size[0], bottom) or img.im.size != img.size:
+            raise ValueError("Prefix decoding is not supported by this Pillow version")
+
+    def crop(self, box):
+        # Grow in steps of at least doubling, so sequential reads decode each row a bounded number of times
+        if box[3] > self._rows:
+            self.load_rows(max(box[3], 2 * self._rows))
+        return self._img.crop(box)
+
+    def close(self):
+        """Close files opened from a path; streams passed in stay open, as with Image.open()."""
+        self._img.__exit__(None, None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _reopen(self):
+        if self._start is not None:
+            self._source.seek(self._start)
+        return Image.open(self._source)
+
+
+def _rows_for(img, first_value, count, depth):
+    """Number of leading rows holding count payload bytes starting at channel value first_value."""
+    return -(-(first_value + -(-count * 8 // depth)) // (img.size[0] * 3))
+
+
+def _load_rows(img, first_value, count, depth=1):
+    """Decode up front every row a read of count bytes needs, when img is a _RowReader."""
+    if isinstance(img, _RowReader):
+        img.load_rows(_rows_for(img, first_value, count, depth))
+
+
+def image_size(image_path):
+    """
+    Read the dimensions of an image from its header without decoding pixels.
+
+    File-like objects are rewound to where they were afterwards.
+
+    Args:
+        image_path: Path, file-like object or bytes holding the image, or
+            an already decoded Image
+
+    Returns:
+        (width, height) tuple
+    """
+    if isinstance(image_path, Image.Image):
+        return image_path.size
+    position = image_path.tell() if hasattr(image_path, 'tell') else None
+    with _open_image(image_path) as img:
+        size = img.size
+    if position is not None:
+        image_path.seek(position)
+    return size
+
+
+def choose_output_profile(width, height, profile='auto'):
+    """
+    Resolve an output profile name for a carrier of the given size.
+
+    Args:
+        width: Carrier width in pixels
+        height: Carrier height in pixels
+        profile: A key of OUTPUT_PROFILES, or 'auto'
+
+    Returns:
+        A key of OUTPUT_PROFILES
+
+    Raises:
+        ValueError: For an unknown profile, or WebP for a carrier wider or
+            taller than WEBP_MAX_SIDE
+    """
+    if profile != 'auto':
+        if profile not in OUTPUT_PROFILES:
+            raise ValueError(f"Unknown output profile {profile!r}")
+        if OUTPUT_PROFILES[profile].format == 'WEBP' and max(width, height) > WEBP_MAX_SIDE:
+            raise ValueError(f"WebP output is limited to {WEBP_MAX_SIDE} pixels per side; "
+                             f"this image is {width}x{height}")
+        return profile
+    return 'fast' if width * height > FAST_PROFILE_MIN_PIXELS else DEFAULT_OUTPUT_PROFILE
+
+
+def payload_capacity(width, height, bits_per_channel=1):
+    """
+    Payload bytes a carrier of the given size holds in the container format.
+
+    Args:
+        width: Carrier width in pixels
+        height: Carrier height in pixels
+        bits_per_channel: Payload bits stored in each channel value
+
+    Returns:
+        Bytes left for the payload after the container header
+    """
+    return max(0, (width * height * 3 - _PAYLOAD_FIRST_VALUE) * bits_per_channel // 8)
+
+
+def _sample_windows(data, sample_size=COMPRESSION_SAMPLE_SIZE, samples=COMPRESSION_SAMPLES):
+    """Evenly spaced windows of a memoryview, or the whole view if it is short."""
+    if len(data) <= sample_size * samples:
+        return [data]
+    stride = (len(data) - sample_size) // (samples - 1) if samples > 1 else 0
+    return [data[i * stride:i * stride + sample_size] for i in range(samples)]
+
+
+def choose_codec(audio_data, codec='auto'):
+    """
+    Resolve a codec name for some audio.
+
+    'auto' picks 'pcm' for PCM WAV audio. Other audio has a few windows
+    trial-compressed at the fastest zlib level, and gets 'none' when that
+    saves less than AUTO_CODEC_MIN_SAVING, otherwise DEFAULT_CODEC.
+
+    Args:
+        audio_data: Audio bytes, or a leading sample of them
+        codec: A key of CODECS, or 'auto'
+
+    Returns:
+        A key of CODECS
+    """
+    if codec != 'auto':
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec!r}")
+        return codec
+
+    if pcm.parse_wav(audio_data) is not None:
+        return 'pcm'
+    windows = _sample_windows(memoryview(audio_data))
+    sampled = sum(len(window) for window in windows)
+    if not sampled:
+        return 'none'
+    compressed = sum(len(zlib.compress(window, 1)) for window in windows)
+    return 'none' if compressed > sampled * (1 - AUTO_CODEC_MIN_SAVING) else DEFAULT_CODEC
+
+
+def _compress(audio_data, codec, level=None):
+    """Compress audio with a codec from CODECS, returning it unchanged for 'none'."""
+    spec = CODECS[codec]
+    if spec.compress is None:
+        return audio_data
+    return spec.compress(audio_data, spec.default_level if level is None else level)
+
+
+def estimate_compressed_size(audio_data, total_size=None, codec=DEFAULT_CODEC, level=None,
+                             sample_size=COMPRESSION_SAMPLE_SIZE, samples=COMPRESSION_SAMPLES):
+    """
+    Estimate the size of audio after encode_audio() compresses it.
+
+    Short audio is compressed whole. Longer audio is sampled: a few evenly
+    spaced windows are compressed on their own and their ratio is
+    extrapolated, which slightly overestimates since every window starts
+    with an empty dictionary.
+
+    Args:
+        audio_data: Audio bytes, or a leading sample of them
+        total_size: Size of the whole audio if audio_data is only a sample
+        codec: A key of CODECS, or 'auto'
+        level: Compression level (default: the codec's default)
+        sample_size: Bytes per window
+        samples: Number of windows
+
+    Returns:
+        (estimated_bytes, exact) where exact is True if nothing was extrapolated
+    """
+    data = memoryview(audio_data)
+    total_size = len(data) if total_size is None else total_size
+    resolved = choose_codec(data, codec)
+    if resolved == 'none':
+        # Stored as is; only a guess when 'auto' probed no more than a sample
+        return total_size, codec != 'auto' or len(data) == total_size
+    codec = resolved
+    if codec == 'pcm':
+        # Windows of a WAV file are not WAV files; the codec samples its frames itself
+        return pcm.estimate_size(data, total_size, CODECS[codec].default_level if level is None else level,
+                                 sample_size, samples)
+    if not data:
+        # Without a sample, assume the audio does not compress at all
+        if total_size == 0:
+            return len(_compress(b'', codec, level)), True
+        return total_size, False
+
+    windows = _sample_windows(data, sample_size, samples)
+    compressed = sum(len(_compress(window, codec, level)) for window in windows)
+    sampled = sum(len(window) for window in windows)
+    if sampled == total_size:
+        return compressed, True
+    return -(-total_size * compressed // sampled), False
+
+
+def check_audio_capacity(image_path, audio_data, total_size=None, bits_per_channel=1,
+                         codec='auto', level=None):
+    """
+    Check whether audio will fit a carrier, without decoding any pixels.
+
+    Only the image header is read, so a leading slice of the image file is
+    enough. The audio may likewise be a leading sample when total_size
+    gives the full size.
+
+    Args:
+        image_path: Path, file-like object or bytes holding the image
+        audio_data: Audio bytes, or a leading sample of them
+        total_size: Size of the whole audio if audio_data is only a sample
+        bits_per_channel: Audio bits stored in each channel value
+        codec: A key of CODECS, or 'auto' as in encode_audio()
+        level: Compression level (default: the codec's default)
+
+    Returns:
+        Dict with the carrier size, its capacity, the audio size, the
+        estimated payload size and whether it fits
+    """
+    _check_depth(bits_per_channel)
+    width, height = image_size(image_path)
+    capacity = payload_capacity(width, height, bits_per_channel)
+    audio_size = len(audio_data) if total_size is None else total_size
+    codec = choose_codec(audio_data, codec)
+    estimated, exact = estimate_compressed_size(audio_data, audio_size, codec, level)
+    return {
+        'width': width,
+        'height': height,
+        'bits_per_channel': bits_per_channel,
+        'capacity_bytes': capacity,
+        'audio_bytes': audio_size,
+        'codec': codec,
+        'estimated_bytes': estimated,
+        'exact': exact,
+        'fits': estimated <= capacity,
+    }
+
+
+def _save_image(img, output_path, output_profile=DEFAULT_OUTPUT_PROFILE):
+    """
+    Save an encoded image with a lossless output profile.
+
+    Args:
+        img: Image to save
+        output_path: Path or writable file-like object, or None to save
+            into a new in-memory buffer
+        output_profile: A key of OUTPUT_PROFILES, or 'auto'
+
+    Returns:
+        output_path, or the BytesIO (rewound to the start) if it was None
+    """
+    profile = OUTPUT_PROFILES[choose_output_profile(*img.size, output_profile)]
+
+    if output_path is None:
+        buffer = io.BytesIO()
+        img.save(buffer, profile.format, **profile.options)
+        buffer.seek(0)
+        return buffer
+
+    img.save(output_path, profile.format, **profile.options)
+    return output_path
+
+
+def _embed_modes_for(img, output_profile):
+    """
+    Modes a carrier can be embedded into in place for an output profile:
+    RGBA only where the profile keeps alpha. Raises ValueError for a
+    carrier the profile cannot hold at all (WebP above its size limit).
+    Only the header is needed, so this runs before any pixels are decoded.
+    """
+    if output_profile is None:
+        return _EMBED_MODES
+    profile = OUTPUT_PROFILES[choose_output_profile(*img.size, output_profile)]
+    return _EMBED_MODES if profile.alpha else ('RGB',)
+
+
+def _open_carrier(image_path, output_profile=None):
+    """
+    Open a carrier image for embedding.
+
+    RGB and RGBA images are loaded and modified in place (RGBA keeps its
+    alpha channel); other modes, and RGBA for output profiles that cannot
+    store alpha, are converted to RGB first. Already decoded
+    Image objects (such as pooled carriers) are copied, so the caller's
+    image is never modified.
+
+    Args:
+        image_path: Path, file-like object or bytes holding the carrier
+            image, or a decoded Image
+        output_profile: Output profile the result will be saved with; a
+            carrier too large for it is refused before decoding
+
+    Returns:
+        A loaded RGB or RGBA image
+    """
+    if isinstance(image_path, Image.Image):
+        modes = _embed_modes_for(image_path, output_profile)
+        with _stage('convert'):
+            return image_path.copy() if image_path.mode in modes else image_path.convert('RGB')
+    with _stage('open'):
+        img = _open_image(image_path)
+        try:
+            modes = _embed_modes_for(img, output_profile)
+        except ValueError:
+            img.close()
+            raise
+        img.load()
+    if img.mode not in modes:
+        with _stage('convert'):
+            img = img.convert('RGB')
+    return img
+
+
+def _get_pool(workers):
+    """Return the shared process pool for a worker count, creating it on first use."""
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers)
+        return pool
+
+
+def _stripes(count, workers, align=1):
+    """
+    Split range(count) into up to `workers` contiguous stripes.
+
+    Args:
+        count: Number of channel values to split
+        workers: Number of stripes to aim for
+        align: Every stripe but the last starts on a multiple of this
+
+    Returns:
+        List of (start, stop) pairs
+    """
+    step = -(-count // workers)
+    step += -step % align
+    return [(start, min(start + step, count)) for start in range(0, count, step)]
+
+
+def _run_stripes(func, workers, shm, count, *args, align=1):
+    """
+    Run a stripe function over a shared-memory buffer on the process pool.
+
+    Args:
+        func: Module-level function called as func(shm_name, count, *args, start, stop)
+        workers: Number of worker processes
+        shm: SharedMemory block holding the buffers func works on
+        count: Number of channel values to split into stripes
+        align: Alignment of stripe starts
+    """
+    pool = _get_pool(workers)
+    futures = [pool.submit(func, shm.name, count, *args, start, stop)
+               for start, stop in _stripes(count, workers, align)]
+    for future in futures:
+        future.result()
+
+
+def _embed_values(flat, payload, first_bit, count, depth=1):
+    """
+    Write payload bits from first_bit on into the low bits of flat[:count].
+
+    Args:
+        flat: uint8 array of channel values, modified in place
+        payload: uint8 array of payload bytes
+        first_bit: Index of the first payload bit to write
+        count: Number of channel values to write
+        depth: Payload bits per channel value (MSB first within the value)
+    """
+    # Unpack only the payload bytes that land in this range
+    bit_count = count * depth
+    byte_slice = payload[first_bit // 8:-(-(first_bit + bit_count) // 8)]
+    bits = np.unpackbits(byte_slice)[first_bit % 8:first_bit % 8 + bit_count]
+
+    if depth == 1:
+        # Clear LSBs using AND with 11111110, then OR with the payload bits
+        flat[:count] &= 0xFE
+        flat[:count] |= bits
+        return
+
+    # The last value may receive fewer bits than depth; pad it with zeros
+    if bits.size < bit_count:
+        bits = np.concatenate([bits, np.zeros(bit_count - bits.size, dtype=np.uint8)])
+    # Fold each group of depth bits into one value by packing it into the
+    # top of a byte and shifting it down
+    groups = np.zeros((count, 8), dtype=np.uint8)
+    groups[:, :depth] = bits.reshape(count, depth)
+    values = np.packbits(groups, axis=1).reshape(-1) >> (8 - depth)
+
+    flat[:count] &= 0xFF ^ ((1 << depth) - 1)
+    flat[:count] |= values
+
+
+def _embed_stripe(shm_name, count, bit_offset, depth, start, stop):
+    """Worker side of _embed_values_parallel(): embed one stripe."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        flat = np.ndarray((count,), dtype=np.uint8, buffer=shm.buf)
+        payload = np.ndarray((shm.size - count,), dtype=np.uint8, buffer=shm.buf, offset=count)
+        _embed_values(flat[start:stop], payload, bit_offset + start * depth, stop - start, depth)
+        del flat, payload
+    finally:
+        shm.close()
+
+
+def _embed_values_parallel(flat, payload, first_bit, count, workers, depth=1):
+    """
+    Parallel version of _embed_values() using stripes on the process pool.
+
+    The channel values and the payload bytes they receive are copied into
+    one shared-memory block, so no pixel data is pickled.
+    """
+    byte_slice = payload[first_bit // 8:-(-(first_bit + count * depth) // 8)]
+    shm = shared_memory.SharedMemory(create=True, size=count + byte_slice.size)
+    try:
+        shared = np.ndarray((shm.size,), dtype=np.uint8, buffer=shm.buf)
+        shared[:count] = flat[:count]
+        shared[count:count + byte_slice.size] = byte_slice
+
+        _run_stripes(_embed_stripe, workers, shm, count, first_bit % 8, depth)
+
+        flat[:count] = shared[:count]
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _embed_bytes(img, data, bit_count=None, memory_budget=TILE_MEMORY_BUDGET, workers=1,
+                 progress=None, first_value=0, depth=1):
+    """
+    Write a payload into the low bits of an image's R, G and B values, in place.
+
+    Channel values are visited in raster order (R, G, B of pixel (0, 0),
+    then pixel (1, 0), ...), depth bits per channel. The image is processed
+    in horizontal tiles sized to fit memory_budget; only tiles that receive
+    payload bits are cropped, modified and pasted back. With workers > 1,
+    large tiles are split into stripes embedded on a process pool.
+
+    The budget bounds the working memory on top of img itself: the decoded
+    raster (4 bytes per pixel in Pillow) has to be in memory already, and
+    saving the result needs all of it again.
+
+    Args:
+        img: Loaded RGB or RGBA image to embed into (alpha is left as is)
+        data: Payload bytes (MSB first)
+        bit_count: Number of leading bits of data to embed (default: all)
+        memory_budget: Working memory to spend on one tile, in bytes
+        workers: Number of worker processes (1 embeds in-process)
+        progress: Optional callable receiving the fraction of bits embedded
+            after every tile
+        first_value: Index of the first channel value to write
+        depth: Payload bits per channel value
+    """
+    width, height = img.size
+    row_values = width * 3
+    if bit_count is None:
+        bit_count = len(data) * 8
+
+    payload = np.frombuffer(data, dtype=np.uint8)
+    tile_rows = max(1, memory_budget // (width * _TILE_BYTES_PER_PIXEL))
+    end_value = first_value + -(-bit_count // depth)
+    rows_needed = min(-(-end_value // row_values), height)
+
+    for top in range(first_value // row_values, rows_needed, tile_rows):
+        box = (0, top, width, min(top + tile_rows, rows_needed))
+        tile = np.array(img.crop(box), dtype=np.uint8)
+        rgb = tile if img.mode == 'RGB' else np.ascontiguousarray(tile[..., :3])
+        flat = rgb.reshape(-1)
+
+        # Channel values of this tile that receive payload bits
+        tile_first = top * row_values
+        start = max(first_value - tile_first, 0)
+        stop = min(flat.size, end_value - tile_first)
+        first_bit = (tile_first + start - first_value) * depth
+        if workers > 1 and stop - start >= _PARALLEL_MIN_VALUES:
+            _embed_values_parallel(flat[start:stop], payload, first_bit, stop - start, workers, depth)
+        else:
+            _embed_values(flat[start:stop], payload, first_bit, stop - start, depth)
+
+        if rgb is not tile:
+            tile[..., :3] = rgb
+        img.paste(Image.fromarray(tile, img.mode), box)
+
+        if progress is not None:
+            progress(min(first_bit + (stop - start) * depth, bit_count) / bit_count)
+
+
+def _pack_low_bits(values, depth=1):
+    """
+    Pack the low depth bits of every channel value, MSB first.
+
+    Args:
+        values: uint8 array of channel values (length a multiple of 8)
+        depth: Bits taken from each value
+
+    Returns:
+        uint8 array of values.size * depth // 8 packed bytes
+    """
+    if depth == 1:
+        # Extract LSB from each channel using AND with 00000001
+        return np.packbits(values & 1)
+    bits = np.unpackbits(values.reshape(-1, 1), axis=1)[:, 8 - depth:]
+    return np.packbits(bits.reshape(-1))
+
+
+def _extract_stripe(shm_name, count, depth, start, stop):
+    """Worker side of _read_lsb_bytes(): pack the low bits of one stripe."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        values = np.ndarray((count,), dtype=np.uint8, buffer=shm.buf)
+        packed = np.ndarray((count * depth // 8,), dtype=np.uint8, buffer=shm.buf, offset=count)
+        packed[start * depth // 8:stop * depth // 8] = _pack_low_bits(values[start:stop], depth)
+        del values, packed
+    finally:
+        shm.close()
+
+
+def _pack_lsbs_parallel(values, workers, depth=1):
+    """
+    Parallel low-bit packing using byte-aligned stripes on the process pool.
+
+    Args:
+        values: uint8 array of channel values (length a multiple of 8)
+        workers: Number of worker processes
+        depth: Bits taken from each value
+
+    Returns:
+        The packed bytes
+    """
+    count = values.size
+    shm = shared_memory.SharedMemory(create=True, size=count + count * depth // 8)
+    try:
+        shared = np.ndarray((shm.size,), dtype=np.uint8, buffer=shm.buf)
+        shared[:count] = values
+
+        _run_stripes(_extract_stripe, workers, shm, count, depth, align=8)
+
+        packed = shared[count:].tobytes()
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+    return packed
+
+
+def _read_lsb_bytes(img, start, count, workers=1, first_value=0, depth=1):
+    """
+    Read bytes from the low-bit stream of an image without touching other rows.
+
+    Only the rows holding the requested channel values are cropped and
+    converted, so reading a short header from a large photo stays cheap.
+    Trailing bits that do not fill a whole byte are dropped.
+
+    Args:
+        img: Image to read from (any mode)
+        start: Byte offset into the stream; a multiple of depth, so that
+            it falls on a channel value boundary
+        count: Number of bytes to read
+        workers: Number of worker processes (1 reads in-process)
+        first_value: Index of the channel value the stream starts at
+        depth: Stream bits per channel value
+
+    Returns:
+        The extracted bytes (shorter than count at the end of the image)
+    """
+    width, height = img.size
+    row_values = width * 3
+    first_value += start * 8 // depth
+    last_value = min(first_value + -(-count * 8 // depth), width * height * 3)
+    if count <= 0 or first_value >= last_value:
+        return b''
+
+    top = first_value // row_values
+    bottom = -(-last_value // row_values)
+    band = img.crop((0, top, width, bottom))
+    if band.mode != 'RGB':
+        band = band.convert('RGB')
+    flat = np.asarray(band, dtype=np.uint8).reshape(-1)
+
+    offset = first_value - top * row_values
+    values = flat[offset:offset + (last_value - first_value)]
+    available = min(count, values.size * depth // 8)
+
+    # Whole groups of 8 values pack into whole bytes; a shorter tail is
+    # padded with zeros and packed on its own
+    whole = values.size - values.size % 8
+    if workers > 1 and whole >= _PARALLEL_MIN_VALUES:
+        packed = _pack_lsbs_parallel(values[:whole], workers, depth)
+    else:
+        packed = _pack_low_bits(values[:whole], depth).tobytes()
+    if whole < values.size and len(packed) < available:
+        tail = np.zeros(8, dtype=np.uint8)
+        tail[:values.size - whole] = values[whole:]
+        packed += _pack_low_bits(tail, depth).tobytes()
+    return packed[:available]
+
+
+# Odd 32-bit constants for multiplicative hashing (the high bits of the
+# wrapped product depend on every bit of the input)
+_HASH_MULTIPLIERS = (np.uint32(0x9E3779B1), np.uint32(0x85EBCA6B))
+
+
+class _Scatter:
+    """
+    Keyed placement of payload values in the channel values after the header.
+
+    Args:
+        key: Secret the placement is derived from (str or bytes)
+        count: Number of payload values (channel values written)
+        total_values: Number of channel values in the image
+    """
+
+    def __init__(self, key, count, total_values):
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        if not key:
+            raise ValueError("The scatter key must not be empty")
+        if count > 1 << 32:
+            raise ValueError("Payloads of more than 2**32 channel values cannot be scattered")
+        digest = hashlib.blake2b(key, digest_size=4 * (_SCATTER_ROUNDS + 1),
+                                 person=b'STEG-scatter').digest()
+        keys = np.frombuffer(digest, dtype='>u4').astype(np.uint32)
+        self._round_keys, self._offset_key = keys[:-1], keys[-1]
+        self.count = count
+        self._values = total_values - _PAYLOAD_FIRST_VALUE
+        # The Feistel network permutes bits-bit numbers with halves of
+        # unequal size when bits is odd; numbers beyond count are walked on
+        # until they land inside, which takes under two steps on average
+        bits = max(2, (count - 1).bit_length())
+        self._left_bits, self._right_bits = (bits + 1) // 2, bits // 2
+
+    def bands(self, width, height, memory_budget=TILE_MEMORY_BUDGET):
+        """
+        Split an image into bands of rows with the payload values each holds.
+
+        Bands are sized so that the band and the placement arrays of its
+        values fit memory_budget.
+
+        Yields:
+            (top, bottom, indices, offsets) with the payload value indices
+            in rows [top, bottom) and their channel values counted from the
+            start of the band
+        """
+        row_values = width * 3
+        row_bytes = (width * _TILE_BYTES_PER_PIXEL
+                     + row_values * self.count * _SCATTER_BYTES_PER_VALUE // max(self._values, 1))
+        band_rows = max(1, memory_budget // row_bytes)
+        for top in range(_PAYLOAD_FIRST_VALUE // row_values, height, band_rows):
+            bottom = min(top + band_rows, height)
+            indices, slots = self.slots(top * row_values, bottom * row_values)
+            if indices.size:
+                yield top, bottom, indices, slots - top * row_values
+
+    def slots(self, start, stop):
+        """
+        Payload values stored in channel values [start, stop).
+
+        Segment j spans the channel values from j * values // count on, so
+        the segments cover all of the image after the header.
+
+        Returns:
+            (indices, slots): int64 arrays of payload value indices and the
+            channel value each of them is stored in
+        """
+        count, values = self.count, self._values
+        first = max(0, (start - _PAYLOAD_FIRST_VALUE) * count // values - 1)
+        last = min(count, max(0, stop - _PAYLOAD_FIRST_VALUE) * count // values + 1)
+        if first >= last:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        segments = np.arange(first, last, dtype=np.uint32)
+        bounds = np.arange(first, last + 1, dtype=np.int64) * values // count
+        hashed = (segments ^ self._offset_key) * _HASH_MULTIPLIERS[1]
+        hashed ^= hashed >> np.uint32(16)
+        slots = bounds[:-1] + hashed % np.diff(bounds) + _PAYLOAD_FIRST_VALUE
+        keep = (slots >= start) & (slots < stop)
+        return self._permute(segments[keep]).astype(np.int64), slots[keep]
+
+    def _permute(self, segments):
+        """Payload value index of every segment, by cycle walking the Feistel network."""
+        indices = self._feistel(segments)
+        outside = np.flatnonzero(indices >= self.count)
+        while outside.size:
+            walked = self._feistel(indices[outside])
+            indices[outside] = walked
+            outside = outside[walked >= self.count]
+        return indices
+
+    def _feistel(self, values):
+        left_bits, right_bits = self._left_bits, self._right_bits
+        left, right = values >> np.uint32(right_bits), values & np.uint32((1 << right_bits) - 1)
+        for round_key in self._round_keys:
+            # The halves swap sizes every round; an even number of rounds restores them
+            hashed = ((right ^ round_key) * _HASH_MULTIPLIERS[0]) >> np.uint32(32 - left_bits)
+            left, right = right, left ^ hashed
+            left_bits, right_bits = right_bits, left_bits
+        return (left << np.uint32(right_bits)) | right
+
+
+def _tile_positions(offsets, channels):
+    """Indexes into a flattened tile of the R, G and B values at offsets (counted over RGB only)."""
+    if channels == 4:
+        offsets += offsets // 3
+    return offsets
+
+
+def _embed_scattered(img, data, key, memory_budget=TILE_MEMORY_BUDGET, progress=None, depth=1):
+    """
+    Write a payload into keyed pseudo-random channel values after the header, in place.
+
+    Tiles of rows are cropped, modified and pasted back as in _embed_bytes(),
+    and the placement is only evaluated for the segments in each tile, so
+    it costs time in proportion to the payload and memory in proportion to
+    a tile rather than to the image.
+
+    Args:
+        img: Loaded RGB or RGBA image to embed into (alpha is left as is)
+        data: Payload bytes (MSB first)
+        key: Secret the placement is derived from
+        memory_budget: Working memory to spend on one tile, in bytes
+        progress: Optional callable receiving the fraction of values
+            embedded after every tile
+        depth: Payload bits per channel value
+    """
+    width, height = img.size
+    count = -(-len(data) * 8 // depth)
+    scatter = _Scatter(key, count, width * height * 3)
+    # A spare zero byte lets every value read a two-byte window
+    payload = np.frombuffer(bytes(data) + b'\0', dtype=np.uint8)
+    mask = (1 << depth) - 1
+
+    done = 0
+    for top, bottom, indices, offsets in scatter.bands(width, height, memory_budget):
+        box = (0, top, width, bottom)
+        tile = np.array(img.crop(box), dtype=np.uint8)
+        flat = tile.reshape(-1)
+        positions = _tile_positions(offsets, tile.shape[2])
+
+        bits = indices * depth
+        windows = (payload[bits >> 3].astype(np.int64) << 8) | payload[(bits >> 3) + 1]
+        values = ((windows >> (16 - depth - (bits & 7))) & mask).astype(np.uint8)
+        flat[positions] = (flat[positions] & (0xFF ^ mask)) | values
+        img.paste(Image.fromarray(tile, img.mode), box)
+
+        done += indices.size
+        if progress is not None:
+            progress(done / count)
+
+
+def _read_scattered(img, header, key, progress=None):
+    """
+    Read a payload embedded by _embed_scattered() and verify its checksum.
+
+    Only the channel values holding payload bits are gathered, one tile of
+    rows at a time, and their bits are set straight into a payload-sized
+    buffer.
+
+    Args:
+        img: Image to read from
+        header: ContainerHeader with the scattered flag set
+        key: Secret the payload was scattered with
+        progress: Optional callable receiving the fraction of values read
+            after every tile
+
+    Returns:
+        The payload bytes
+    """
+    if key is None:
+        raise ValueError("Hidden data is scattered with a key; the key is needed to decode it")
+    depth = _header_depth(header)
+    width, height = img.size
+    count = -(-header.length * 8 // depth)
+    scatter = _Scatter(key, count, width * height * 3)
+    # A spare byte takes the low half of the two-byte window of the last value
+    payload = np.zeros(header.length + 1, dtype=np.uint8)
+    mask = (1 << depth) - 1
+    # Payload values are spread over every row: decode them all at once
+    # rather than growing a prefix band by band
+    if isinstance(img, _RowReader):
+        img.load_rows(height)
+
+    done = 0
+    for top, bottom, indices, offsets in scatter.bands(width, height):
+        band = img.crop((0, top, width, bottom))
+        if band.mode not in _EMBED_MODES:
+            band = band.convert('RGB')
+        band = np.asarray(band, dtype=np.uint8)
+        positions = _tile_positions(offsets, band.shape[2])
+        values = (band.reshape(-1)[positions] & mask).astype(np.uint16)
+
+        # Place every value in the two-byte window holding its bits. Values
+        # sharing a byte hold disjoint bits, so an unbuffered add ORs them
+        # (NumPy has a fast path for add.at, not for bitwise_or.at)
+        bits = indices * depth
+        windows = values << (16 - depth - (bits & 7)).astype(np.uint16)
+        np.add.at(payload, bits >> 3, (windows >> 8).astype(np.uint8))
+        straddling = np.flatnonzero((bits & 7) > 8 - depth)
+        if straddling.size:
+            np.add.at(payload, (bits[straddling] >> 3) + 1,
+                      (windows[straddling] & 0xFF).astype(np.uint8))
+
+        done += indices.size
+        if progress is not None:
+            progress(done / count)
+
+    payload = payload[:header.length].tobytes()
+    if zlib.crc32(payload) != header.crc:
+        raise ValueError("Hidden data is corrupted or the key is wrong (checksum mismatch)")
+    return payload
+
+
+def _capacity_bytes(img):
+    """Number of whole bytes the LSB stream of an image can hold."""
+    width, height = img.size
+    return width * height * 3 // 8
+
+
+def _header_depth(header):
+    """Payload bits per channel value recorded in a container header."""
+    return (header.flags & _FLAG_DEPTH_MASK) + 1
+
+
+def _check_depth(bits_per_channel):
+    """Raise ValueError for an unsupported bits_per_channel value."""
+    if not 1 <= bits_per_channel <= MAX_BITS_PER_CHANNEL:
+        raise ValueError(f"bits_per_channel must be between 1 and {MAX_BITS_PER_CHANNEL}")
+
+
+def _pack_container(kind, codec, payload, bits_per_channel=1, scattered=False):
+    """
+    Prefix a payload with the container header.
+
+    Args:
+        kind: KIND_TEXT or KIND_AUDIO
+        codec: Codec the payload was encoded with
+        payload: Payload bytes
+        bits_per_channel: Payload bits per channel value, recorded in the flags
+        scattered: Record that the payload is embedded with a key
+
+    Returns:
+        Header and payload as one byte string
+    """
+    flags = (bits_per_channel - 1) | (_FLAG_SCATTERED if scattered else 0)
+    version = _SCATTERED_VERSION if scattered else 1
+    header = _HEADER.pack(MAGIC, version, kind, codec, flags,
+                          len(payload), zlib.crc32(payload))
+    return header + payload
+
+
+def _embed_container(img, container, bits_per_channel=1, memory_budget=TILE_MEMORY_BUDGET,
+                     workers=1, progress=None, key=None):
+    """
+    Embed a packed container: the header at 1 bit per channel value, the
+    payload after it at bits_per_channel, in raster order or scattered with
+    a key (packed with scattered=True).
+    """
+    if key is not None:
+        container = memoryview(container)
+        _embed_bytes(img, container[:HEADER_SIZE], memory_budget=memory_budget)
+        _embed_scattered(img, container[HEADER_SIZE:], key, memory_budget, progress,
+                         bits_per_channel)
+        return
+    if bits_per_channel == 1:
+        _embed_bytes(img, container, memory_budget=memory_budget, workers=workers,
+                     progress=progress)
+        return
+    container = memoryview(container)
+    _embed_bytes(img, container[:HEADER_SIZE], memory_budget=memory_budget)
+    _embed_bytes(img, container[HEADER_SIZE:], memory_budget=memory_budget, workers=workers,
+                 progress=progress, first_value=_PAYLOAD_FIRST_VALUE, depth=bits_per_channel)
+
+
+def _read_header(img):
+    """
+    Read and validate the container header from the first pixels of an image.
+
+    Args:
+        img: Image to read from
+
+    Returns:
+        A ContainerHeader, or None if the image does not start with MAGIC
+    """
+    raw = _read_lsb_bytes(img, 0, HEADER_SIZE)
+    if len(raw) < HEADER_SIZE or raw[:len(MAGIC)] != MAGIC:
+        return None
+
+    _, version, kind, codec, flags, length, crc = _HEADER.unpack(raw)
+    if version > CONTAINER_VERSION:
+        raise ValueError(f"Unsupported container version {version}")
+    if flags & ~_KNOWN_FLAGS or (flags & _FLAG_SCATTERED and version < _SCATTERED_VERSION):
+        raise ValueError(f"Unsupported container flags 0x{flags:02x}")
+    header = ContainerHeader(version, kind, codec, flags, length, crc)
+    if length > payload_capacity(*img.size, _header_depth(header)):
+        raise ValueError("Corrupted header: payload length exceeds image capacity")
+
+    return header
+
+
+def _check_kind(header, kind):
+    """Raise ValueError if a header describes a different payload kind."""
+    if header.kind == KIND_AUDIO_SHARD and kind == KIND_AUDIO:
+        raise ValueError("Image holds one shard of audio split across several images; "
+                         "decode all of them together")
+    if header.kind != kind:
+        expected = 'audio' if kind == KIND_AUDIO else 'a text message'
+        raise ValueError(f"Image does not contain {expected}")
+
+
+def _read_payload(img, header, kind, workers=1, key=None):
+    """
+    Read the payload described by a header and verify its checksum.
+
+    Args:
+        img: Image to read from
+        header: ContainerHeader returned by _read_header()
+        kind: Payload kind the caller expects
+        workers: Number of worker processes for extraction
+        key: Secret a scattered payload was embedded with
+
+    Returns:
+        The payload bytes
+    """
+    _check_kind(header, kind)
+    if header.flags & _FLAG_SCATTERED:
+        return _read_scattered(img, header, key)
+
+    depth = _header_depth(header)
+    _load_rows(img, _PAYLOAD_FIRST_VALUE, header.length, depth)
+    payload = _read_lsb_bytes(img, 0, header.length, workers, _PAYLOAD_FIRST_VALUE, depth)
+    if zlib.crc32(payload) != header.crc:
+        raise ValueError("Hidden data is corrupted (checksum mismatch)")
+    return payload
+
+
+def _iter_payload(img, header, chunk_size=STREAM_CHUNK_SIZE, workers=1, progress=None, key=None):
+    """
+    Yield the payload described by a header in bands of rows.
+
+    The checksum is accumulated while reading and verified after the last
+    band, so a corrupted payload raises ValueError at the end of iteration.
+    A scattered payload has bytes in every row, so it is gathered into a
+    payload-sized buffer first and then sliced.
+
+    Args:
+        img: Image to read from
+        header: ContainerHeader returned by _read_header()
+        chunk_size: Payload bytes extracted per band
+        workers: Number of worker processes for extraction
+        progress: Optional callable receiving the fraction of the payload
+            read after every band
+        key: Secret a scattered payload was embedded with
+
+    Yields:
+        Consecutive slices of the payload
+    """
+    if header.flags & _FLAG_SCATTERED:
+        with _stage('extract'):
+            payload = _read_scattered(img, header, key, progress)
+        for offset in range(0, len(payload), chunk_size):
+            yield payload[offset:offset + chunk_size]
+        return
+
+    depth = _header_depth(header)
+    # Keep every band starting on a channel value boundary
+    chunk_size = max(depth, chunk_size - chunk_size % depth)
+    with _stage('extract'):
+        _load_rows(img, _PAYLOAD_FIRST_VALUE, header.length, depth)
+
+    crc = 0
+    for offset in range(0, header.length, chunk_size):
+        with _stage('extract'):
+            chunk = _read_lsb_bytes(img, offset, min(chunk_size, header.length - offset),
+                                    workers, _PAYLOAD_FIRST_VALUE, depth)
+            crc = zlib.crc32(chunk, crc)
+        if progress is not None:
+            progress((offset + len(chunk)) / header.length)
+        yield chunk
+
+    if crc != header.crc:
+        raise ValueError("Hidden data is corrupted (checksum mismatch)")
+
+
+def _inflate(chunks, codec, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Incrementally reverse a payload codec.
+
+    Args:
+        chunks: Iterable of encoded payload slices
+        codec: Codec the payload was encoded with
+        chunk_size: Most decoded bytes yielded at once
+
+    Yields:
+        Consecutive slices of the decoded payload
+    """
+    if codec == CODEC_NONE:
+        yield from chunks
+        return
+    if codec not in _CODECS_BY_ID:
+        raise ValueError(f"Unsupported audio codec {codec}")
+    if codec != CODEC_ZLIB:
+        yield from _inflate_buffered(chunks, _CODECS_BY_ID[codec].decompressor(), chunk_size)
+        return
+
+    decompressor = zlib.decompressobj()
+    for chunk in chunks:
+        # Bound every output slice, even for highly compressible audio
+        while chunk:
+            with _stage('decompress'):
+                audio_chunk = decompressor.decompress(chunk, chunk_size)
+            if audio_chunk:
+                yield audio_chunk
+            chunk = decompressor.unconsumed_tail
+
+    with _stage('decompress'):
+        audio_chunk = decompressor.flush()
+    if audio_chunk:
+        yield audio_chunk
+    if not decompressor.eof:
+        raise ValueError("Hidden audio is truncated")
+
+
+def _inflate_buffered(chunks, decompressor, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    _inflate() for the lzma, bz2 and pcm decompressors, which keep unconsumed
+    input internally and signal needs_input instead of unconsumed_tail.
+    """
+    for chunk in chunks:
+        while not decompressor.eof:
+            with _stage('decompress'):
+                audio_chunk = decompressor.decompress(chunk, chunk_size)
+            chunk = b''
+            if audio_chunk:
+                yield audio_chunk
+            if decompressor.needs_input:
+                break
+
+    if not decompressor.eof:
+        raise ValueError("Hidden audio is truncated")
+
+
+def _first_control_byte(data):
+    """
+    Find the first byte that cannot appear in a typed text message.
+
+    Args:
+        data: Bytes to check
+
+    Returns:
+        Index of the first control byte, or -1 if all bytes are printable
+    """
+    values = np.frombuffer(data, dtype=np.uint8)
+    control = ((values < 0x20) & (values != 0x09) & (values != 0x0A) & (values != 0x0D)) \
+        | ((values >= 0x7F) & (values < 0xA0))
+    hits = np.flatnonzero(control)
+    return int(hits[0]) if hits.size else -1
+
+
+def _scan_legacy_text(img):
+    """
+    Read a message written in the legacy "message###" format.
+
+    The LSB stream is read in chunks and scanning stops at the delimiter.
+    A control byte before the delimiter means the image does not hold a
+    legacy message, which rejects most foreign images after a few bytes.
+
+    Args:
+        img: Image to read from
+
+    Returns:
+        The message bytes, or None if the image does not hold a legacy message
+    """
+    capacity = _capacity_bytes(img)
+    data = b''
+    while len(data) < capacity:
+        chunk = _read_lsb_bytes(img, len(data), _LEGACY_SCAN_CHUNK)
+        search_from = max(len(data) - 2, 0)
+        data += chunk
+
+        delimiter_index = data.find(b'###', search_from)
+        end = delimiter_index if delimiter_index != -1 else len(data)
+        if _first_control_byte(data[search_from:end]) != -1:
+            return None
+        if delimiter_index != -1:
+            return data[:delimiter_index]
+
+    return None
+
+
+def encode(image_path, secret_message, output_path=None, legacy=False,
+           memory_budget=TILE_MEMORY_BUDGET, workers=1, output_profile=DEFAULT_OUTPUT_PROFILE,
+           bits_per_channel=1, key=None):
     """
     Encode a secret message into an image using LSB steganography.
     
     Args:
-        image_path: Path to the input image
+        image_path: Path, file-like object or bytes holding the input image,
+            or a decoded Image such as a pooled carrier (copied, not modified)
         secret_message: Message to hide in the image
-        output_path: Path to save the encoded image
+        output_path: Path or file-like object to save the encoded image to,
+            or None to return it in a BytesIO
+        legacy: Write the old "message###" format instead of the container
+        memory_budget: Working memory for one embedding tile, in bytes (on
+            top of the decoded carrier, which is always held whole)
+        workers: Number of worker processes (1 embeds in-process)
+        output_profile: Lossless output encoding, a key of OUTPUT_PROFILES
+            or 'auto' to pick one from the carrier size
+        bits_per_channel: Message bits stored in each channel value (1-4);
+            more bits need a smaller carrier but alter pixels more visibly
+        key: Secret that scatters the message over keyed pseudo-random
+            channel values instead of the first rows; decoding needs the
+            same key (None writes in raster order)
+
+    Returns:
+        output_path, or a BytesIO holding the image if output_path is None
     """
-    # Open the image and convert to RGB
-    img = Image.open(image_path)
-    img = img.convert('RGB')
+    _check_depth(bits_per_channel)
+    if legacy and bits_per_channel != 1:
+        raise ValueError("The legacy format only supports 1 bit per channel")
+    if legacy and key is not None:
+        raise ValueError("The legacy format cannot be scattered with a key")
+    img = _open_carrier(image_path, output_profile)
     
-    # Add delimiter to mark end of message
-    message = secret_message + '###'
-    
-    # Convert message to binary
-    binary_message = ''.join(format(ord(char), '08b') for char in message)
+    with _stage('payload'):
+        if legacy:
+            # Add delimiter to mark end of message
+            binary_message = _message_to_bits(secret_message + '###')
+            data = np.packbits(binary_message).tobytes()
+            bit_count = binary_message.size
+        else:
+            data = _pack_container(KIND_TEXT, CODEC_NONE, secret_message.encode('utf-8'),
+                                   bits_per_channel, key is not None)
+            bit_count = len(data) * 8
     
     # Get image dimensions
     width, height = img.size
-    pixels = img.load()
     
     # Check if message fits in image
-    max_bytes = width * height * 3  # 3 channels (R, G, B)
-    if len(binary_message) > max_bytes:
+    if legacy:
+        fits = bit_count <= width * height * 3  # 3 channels (R, G, B)
+    else:
+        fits = len(data) - HEADER_SIZE <= payload_capacity(width, height, bits_per_channel)
+    if not fits:
         raise ValueError("Message too large for this image")
     
     # Encode message into image
-    message_index = 0
-    message_length = len(binary_message)
-    
-    for y in range(height):
-        for x in range(width):
-            if message_index >= message_length:
-                break
-                
-            r, g, b = pixels[x, y]
-            
-            # Modify LSB of R channel
-            if message_index < message_length:
-                # Clear LSB using AND with 11111110, then OR with message bit
-                r = (r & 0xFE) | int(binary_message[message_index])
-                message_index += 1
-            
-            # Modify LSB of G channel
-            if message_index < message_length:
-                g = (g & 0xFE) | int(binary_message[message_index])
-                message_index += 1
-            
-            # Modify LSB of B channel
-            if message_index < message_length:
-                b = (b & 0xFE) | int(binary_message[message_index])
-                message_index += 1
-            
-            pixels[x, y] = (r, g, b)
-        
-        if message_index >= message_length:
-            break
+    with _stage('embed'):
+        if legacy:
+            _embed_bytes(img, data, bit_count, memory_budget, workers)
+        else:
+            _embed_container(img, data, bits_per_channel, memory_budget, workers, key=key)
     
     # Save the encoded image
-    img.save(output_path, 'PNG')
-    return output_path
+    with _stage('save'):
+        return _save_image(img, output_path, output_profile)
 
 
-def decode(image_path):
+def decode(image_path, workers=1, key=None):
     """
     Decode a secret message from an image using LSB steganography.
+
+    Both the container format and the legacy "message###" format are
+    detected automatically; only the pixels holding the message are read.
     
     Args:
-        image_path: Path to the encoded image
+        image_path: Path, file-like object or bytes holding the encoded image
+        workers: Number of worker processes (1 decodes in-process)
+        key: Secret the message was scattered with, if any
         
     Returns:
         The decoded secret message
     """
-    # Open the image
-    img = Image.open(image_path)
-    img = img.convert('RGB')
-    
-    width, height = img.size
-    pixels = img.load()
-    
-    binary_message = ''
-    
-    # Extract LSBs from image
-    for y in range(height):
-        for x in range(width):
-            r, g, b = pixels[x, y]
-            
-            # Extract LSB from each channel using AND with 00000001
-            binary_message += str(r & 1)
-            binary_message += str(g & 1)
-            binary_message += str(b & 1)
-    
-    # Convert binary to text
-    message = ''
-    for i in range(0, len(binary_message), 8):
-        byte = binary_message[i:i+8]
-        if len(byte) == 8:
-            char = chr(int(byte, 2))
-            message += char
-            
-            # Check for delimiter
-            if message.endswith('###'):
-                return message[:-3]  # Remove delimiter
-    
-    return message
+    with _stage('open'):
+        img = _RowReader(image_path)
+
+    with _stage('header'):
+        header = _read_header(img)
+    if header is not None:
+        with _stage('extract'):
+            payload = _read_payload(img, header, KIND_TEXT, workers, key)
+        return payload.decode('utf-8')
 
+    with _stage('extract'):
+        message = _scan_legacy_text(img)
+    if message is None:
+        raise ValueError("No hidden message found in image")
 
-def encode_audio(image_path, audio_data, output_path):
+    # Legacy messages hold one character per byte
+    return message.decode('latin-1')
+
+
+def encode_audio(image_path, audio_data, output_path=None, legacy=False,
+                 memory_budget=TILE_MEMORY_BUDGET, workers=1, progress=None,
+                 output_profile=DEFAULT_OUTPUT_PROFILE, bits_per_channel=1, codec='auto',
+                 level=None, key=None):
     """
     Encode audio data into an image using LSB steganography with compression.
 
     Args:
-        image_path: Path to the input image
+        image_path: Path, file-like object or bytes holding the input image,
+            or a decoded Image such as a pooled carrier (copied, not modified)
         audio_data: Binary audio data (bytes)
-        output_path: Path to save the encoded image
-    """
-    # Open the image and convert to RGB
-    img = Image.open(image_path)
-    img = img.convert('RGB')
-
-    # Compress audio data using zlib (can reduce size by 50-70%)
-    compressed_audio = zlib.compress(audio_data, level=9)
+        output_path: Path or file-like object to save the encoded image to,
+            or None to return it in a BytesIO
+        legacy: Write the old "size:size###" format instead of the container
+        memory_budget: Working memory for one embedding tile, in bytes (on
+            top of the decoded carrier, which is always held whole)
+        workers: Number of worker processes (1 embeds in-process)
+        progress: Optional callable receiving the fraction of the payload
+            embedded so far (0.0 to 1.0)
+        output_profile: Lossless output encoding, a key of OUTPUT_PROFILES
+            or 'auto' to pick one from the carrier size
+        bits_per_channel: Audio bits stored in each channel value (1-4);
+            2 or 4 bits need a carrier 2-4x smaller
+        codec: A key of CODECS, or 'auto' to use pcm for WAV audio and skip
+            compression for audio that is already compressed (the legacy
+            format always uses zlib)
+        level: Compression level (default: the codec's default)
+        key: Secret that scatters the audio over keyed pseudo-random channel
+            values as in encode()
 
-    # Store the original size for decompression
-    original_size = len(audio_data)
-    compressed_size = len(compressed_audio)
-
-    # Create header with sizes (for decompression)
-    header = f"{original_size}:{compressed_size}###"
-    header_bytes = header.encode('ascii')
+    Returns:
+        output_path, or a BytesIO holding the image if output_path is None
+    """
+    _check_depth(bits_per_channel)
+    if legacy and bits_per_channel != 1:
+        raise ValueError("The legacy format only supports 1 bit per channel")
+    if legacy and key is not None:
+        raise ValueError("The legacy format cannot be scattered with a key")
+    codec = 'zlib' if legacy else choose_codec(audio_data, codec)
+    img = _open_carrier(image_path, output_profile)
 
-    # Combine header and compressed audio
-    data_to_encode = header_bytes + compressed_audio
+    # Compress audio data (PCM shrinks; mp3/ogg/webm/m4a are stored as is under 'auto')
+    with _stage('compress'):
+        compressed_audio = _compress(audio_data, codec, level)
+    if not legacy and codec != 'none' and len(compressed_audio) >= len(audio_data):
+        # Compression did not pay off after all
+        codec, compressed_audio = 'none', audio_data
 
-    # Convert to binary bits directly from bytes (more efficient than base64)
-    binary_data = ''.join(format(byte, '08b') for byte in data_to_encode)
+    with _stage('payload'):
+        if legacy:
+            # Create header with sizes (for decompression)
+            header = f"{len(audio_data)}:{len(compressed_audio)}###"
+            data_to_encode = header.encode('ascii') + compressed_audio
+        else:
+            data_to_encode = _pack_container(KIND_AUDIO, CODECS[codec].id, compressed_audio,
+                                             bits_per_channel, key is not None)
 
     # Get image dimensions
     width, height = img.size
-    pixels = img.load()
 
     # Check if audio fits in image
-    max_bits = width * height * 3  # 3 channels (R, G, B)
-    if len(binary_data) > max_bits:
-        max_bytes = max_bits // 8
+    if legacy:
+        max_bytes = width * height * 3 // 8  # 3 channels (R, G, B)
         current_bytes = len(data_to_encode)
-        raise ValueError(f"Audio file too large for this image. Image can store {max_bytes:,} bytes ({max_bytes/1024/1024:.2f} MB), but audio needs {current_bytes:,} bytes ({current_bytes/1024/1024:.2f} MB). Try using a larger image or shorter audio.")
+    else:
+        max_bytes = payload_capacity(width, height, bits_per_channel)
+        current_bytes = len(compressed_audio)
+    if current_bytes > max_bytes:
+        raise ValueError(f"Audio file too large for this image. Image can store {max_bytes:,} bytes ({max_bytes/1024/1024:.2f} MB), but audio needs {current_bytes:,} bytes ({current_bytes/1024/1024:.2f} MB). Try using a larger image, more bits per channel or shorter audio.")
 
     # Encode audio into image
-    data_index = 0
-    data_length = len(binary_data)
+    with _stage('embed'):
+        if legacy:
+            _embed_bytes(img, data_to_encode, memory_budget=memory_budget, workers=workers,
+                         progress=progress)
+        else:
+            _embed_container(img, data_to_encode, bits_per_channel, memory_budget, workers,
+                             progress, key)
 
-    for y in range(height):
-        for x in range(width):
-            if data_index >= data_length:
-                break
+    # Save the encoded image
+    with _stage('save'):
+        return _save_image(img, output_path, output_profile)
+
+
+def decode_audio(image_path, workers=1, progress=None, key=None):
+    """
+    Decode compressed audio data from an image using LSB steganography.
+
+    The container format is read from its header; images in the legacy
+    "size:size###" format are detected from their leading bytes.
+
+    Args:
+        image_path: Path, file-like object or bytes holding the encoded image
+        workers: Number of worker processes (1 decodes in-process)
+        progress: Optional callable receiving the fraction of the payload
+            extracted so far (0.0 to 1.0)
+        key: Secret the audio was scattered with, if any
+
+    Returns:
+        The decoded audio data as bytes
+    """
+    return b''.join(decode_audio_stream(image_path, workers=workers, progress=progress, key=key))
 
-            r, g, b = pixels[x, y]
 
-            # Modify LSB of R channel
-            if data_index < data_length:
-                r = (r & 0xFE) | int(binary_data[data_index])
-                data_index += 1
+def decode_audio_stream(image_path, chunk_size=STREAM_CHUNK_SIZE, workers=1, progress=None,
+                        key=None):
+    """
+    Decode audio from an image as a stream of chunks.
+
+    Pixel rows are extracted in bands and fed through an incremental
+    decompressor, so memory use does not grow with the size of the carrier
+    or of the audio. Errors (including a checksum mismatch, which is only
+    known once the last band has been read) are raised from the iteration,
+    so callers writing chunks out should discard the output on ValueError.
+    Audio scattered with a key is gathered whole before it is decompressed.
+
+    Args:
+        image_path: Path, file-like object or bytes holding the encoded image
+        chunk_size: Payload bytes extracted per band and most audio bytes
+            yielded per chunk
+        workers: Number of worker processes (1 decodes in-process)
+        progress: Optional callable receiving the fraction of the payload
+            extracted so far (0.0 to 1.0)
+        key: Secret the audio was scattered with, if any
+
+    Yields:
+        Consecutive chunks of the decoded audio data
+    """
+    with _stage('open'):
+        img = _RowReader(image_path)
+
+    with _stage('header'):
+        header = _read_header(img)
+    if header is not None:
+        _check_kind(header, KIND_AUDIO)
+        chunks = _iter_payload(img, header, chunk_size, workers, progress, key)
+        yield from _inflate(chunks, header.codec, chunk_size)
+        return
+
+    with _stage('extract'):
+        audio_bytes = _decode_legacy_audio(img, workers)
+    if audio_bytes is None:
+        raise ValueError("No valid audio data found in image")
+    if progress is not None:
+        progress(1.0)
+    for offset in range(0, len(audio_bytes), chunk_size):
+        yield audio_bytes[offset:offset + chunk_size]
 
-            # Modify LSB of G channel
-            if data_index < data_length:
-                g = (g & 0xFE) | int(binary_data[data_index])
-                data_index += 1
 
-            # Modify LSB of B channel
-            if data_index < data_length:
-                b = (b & 0xFE) | int(binary_data[data_index])
-                data_index += 1
+def _split_sizes(length, capacities):
+    """
+    Split length bytes across carriers in proportion to their capacities.
 
-            pixels[x, y] = (r, g, b)
+    Every carrier gets the same share of its capacity, so carriers of
+    different sizes take about the same time to embed.
 
-        if data_index >= data_length:
+    Returns:
+        Shard sizes, one per capacity, summing to length
+    """
+    total = sum(capacities)
+    sizes = [length * capacity // total for capacity in capacities]
+    # Hand the bytes lost to rounding (fewer than one per carrier) to carriers with room left
+    remainder = length - sum(sizes)
+    for i, capacity in enumerate(capacities):
+        if remainder == 0:
             break
+        if sizes[i] < capacity:
+            sizes[i] += 1
+            remainder -= 1
+    return sizes
 
-    # Save the encoded image
-    img.save(output_path, 'PNG')
-    return output_path
+
+def _encode_shard(image_path, container, output_path, bits_per_channel, memory_budget, workers,
+                  output_profile):
+    """Embed one packed shard container into its carrier and save it."""
+    img = _open_carrier(image_path, output_profile)
+    with _stage('embed'):
+        _embed_container(img, container, bits_per_channel, memory_budget, workers)
+    with _stage('save'):
+        return _save_image(img, output_path, output_profile)
 
 
-def decode_audio(image_path):
+def encode_audio_shards(images, audio_data, output_paths=None, concurrency=4,
+                        memory_budget=TILE_MEMORY_BUDGET, workers=1,
+                        output_profile=DEFAULT_OUTPUT_PROFILE, bits_per_channel=1, codec='auto',
+                        level=None):
     """
-    Decode compressed audio data from an image using LSB steganography.
+    Split audio across several carrier images, embedding them concurrently.
+
+    The audio is compressed once and the result is cut into one shard per
+    carrier, sized in proportion to the carrier capacities. Every shard
+    records which payload it belongs to and its position, so
+    decode_audio_shards() accepts the encoded images in any order.
 
     Args:
-        image_path: Path to the encoded image
+        images: Carrier images (paths, file-like objects or bytes)
+        audio_data: Binary audio data (bytes)
+        output_paths: One path or file-like object per carrier, or None to
+            return every encoded image in a BytesIO
+        concurrency: Number of carriers embedded at the same time
+        memory_budget: Working memory for one embedding tile, in bytes (on
+            top of the decoded carrier, which is always held whole)
+        workers: Number of worker processes per carrier
+        output_profile: Lossless output encoding, a key of OUTPUT_PROFILES
+            or 'auto' to pick one from each carrier's size
+        bits_per_channel: Audio bits stored in each channel value (1-4)
+        codec: A key of CODECS, or 'auto' as in encode_audio()
+        level: Compression level (default: the codec's default)
 
     Returns:
-        The decoded audio data as bytes
+        The encoded images (output_paths or BytesIO objects), in carrier order
     """
-    # Open the image
-    img = Image.open(image_path)
-    img = img.convert('RGB')
+    _check_depth(bits_per_channel)
+    images = list(images)
+    if not 1 <= len(images) <= MAX_SHARDS:
+        raise ValueError(f"Give between 1 and {MAX_SHARDS} carrier images")
+    if output_paths is None:
+        output_paths = [None] * len(images)
+    elif len(output_paths) != len(images):
+        raise ValueError("Give one output path per carrier image")
+
+    capacities = []
+    for image in images:
+        capacity = payload_capacity(*image_size(image), bits_per_channel) - SHARD_HEADER_SIZE
+        if capacity <= 0:
+            raise ValueError("A carrier image is too small to hold a shard")
+        capacities.append(capacity)
+
+    codec = choose_codec(audio_data, codec)
+    with _stage('compress'):
+        compressed_audio = _compress(audio_data, codec, level)
+    if codec != 'none' and len(compressed_audio) >= len(audio_data):
+        codec, compressed_audio = 'none', audio_data
+
+    total = sum(capacities)
+    if len(compressed_audio) > total:
+        raise ValueError(f"Audio file too large for these images. Together they can store {total:,} bytes ({total/1024/1024:.2f} MB), but audio needs {len(compressed_audio):,} bytes ({len(compressed_audio)/1024/1024:.2f} MB). Add more or larger images, or use more bits per channel.")
+
+    with _stage('payload'):
+        payload_id = os.urandom(16)
+        total_crc = zlib.crc32(compressed_audio)
+        payload = memoryview(compressed_audio)
+        containers = []
+        offset = 0
+        for index, size in enumerate(_split_sizes(len(compressed_audio), capacities)):
+            shard_header = _SHARD_HEADER.pack(payload_id, index, len(images), len(compressed_audio),
+                                              total_crc)
+            containers.append(_pack_container(KIND_AUDIO_SHARD, CODECS[codec].id,
+                                              shard_header + payload[offset:offset + size],
+                                              bits_per_channel))
+            offset += size
+
+    def encode_one(args):
+        image, container, output_path = args
+        return _encode_shard(image, container, output_path, bits_per_channel, memory_budget,
+                             workers, output_profile)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='shard') as pool:
+        return list(pool.map(_in_caller_context(encode_one), zip(images, containers, output_paths)))
+
+
+def _read_shard_header(image_path):
+    """
+    Read the container and shard headers of a shard image.
+
+    Only the headers are kept; file-like objects are rewound to where they
+    were, so the image can be opened again for its payload.
+
+    Returns:
+        (ContainerHeader, ShardHeader) tuple
+    """
+    position = image_path.tell() if hasattr(image_path, 'tell') else None
+    with _RowReader(image_path) as img:
+        header = _read_header(img)
+        if header is None or header.kind != KIND_AUDIO_SHARD:
+            raise ValueError("Image does not contain an audio shard")
+        if header.length < SHARD_HEADER_SIZE:
+            raise ValueError("Corrupted header: shard is shorter than its header")
+        raw = _read_lsb_bytes(img, 0, SHARD_HEADER_SIZE, 1, _PAYLOAD_FIRST_VALUE,
+                              _header_depth(header))
+    if position is not None:
+        image_path.seek(position)
+    return header, ShardHeader(*_SHARD_HEADER.unpack(raw))
 
-    width, height = img.size
-    pixels = img.load()
 
-    binary_data = ''
+def _iter_shards(images, shards, chunk_size, workers, progress):
+    """
+    Yield the whole payload from shard images in index order, without the
+    shard headers, verifying the checksum of the whole payload at the end.
+    """
+    total_length = shards[0][2].total_length
+    done = 0
+    crc = 0
+    for i, header, shard in shards:
+        with _stage('open'):
+            img = _RowReader(images[i])
+        skip = SHARD_HEADER_SIZE
+        with img:
+            for chunk in _iter_payload(img, header, chunk_size, workers):
+                if skip:
+                    chunk, skip = chunk[skip:], max(0, skip - len(chunk))
+                if not chunk:
+                    continue
+                crc = zlib.crc32(chunk, crc)
+                done += len(chunk)
+                if progress is not None:
+                    progress(done / total_length if total_length else 1.0)
+                yield chunk
+
+    if done != total_length or crc != shards[0][2].total_crc:
+        raise ValueError("Hidden audio is corrupted (shards do not reassemble)")
+
+
+def decode_audio_shards(images, chunk_size=STREAM_CHUNK_SIZE, workers=1, progress=None):
+    """
+    Decode audio split across several images by encode_audio_shards().
+
+    The shard headers are read first to check that every shard of one
+    payload is present; the shards are then read one at a time in index
+    order and decompressed as a single stream, so only one carrier is held
+    in memory at once. Errors are raised from the iteration, as for
+    decode_audio_stream().
+
+    Args:
+        images: The encoded images, in any order (paths, file-like objects
+            or bytes; file-like objects must be seekable)
+        chunk_size: Payload bytes extracted per band and most audio bytes
+            yielded per chunk
+        workers: Number of worker processes per carrier
+        progress: Optional callable receiving the fraction of the payload
+            extracted so far (0.0 to 1.0)
+
+    Yields:
+        Consecutive chunks of the decoded audio data
+    """
+    images = list(images)
+    if not images:
+        raise ValueError("No shard images given")
+
+    shards = []
+    with _stage('header'):
+        for i, image in enumerate(images):
+            header, shard = _read_shard_header(image)
+            shards.append((i, header, shard))
 
-    # Extract LSBs from image
-    for y in range(height):
-        for x in range(width):
-            r, g, b = pixels[x, y]
+    first = shards[0][2]
+    if any(shard.payload_id != first.payload_id for _, _, shard in shards):
+        raise ValueError("The images hold shards of different audio payloads")
+    if first.count != len(images):
+        raise ValueError(f"The audio was split across {first.count} images, but {len(images)} were given")
+    shards.sort(key=lambda item: item[2].index)
+    if [shard.index for _, _, shard in shards] != list(range(first.count)):
+        raise ValueError("The same shard was given more than once")
+    if len({header.codec for _, header, _ in shards}) != 1:
+        raise ValueError("The shards disagree on the audio codec")
 
-            # Extract LSB from each channel using AND with 00000001
-            binary_data += str(r & 1)
-            binary_data += str(g & 1)
-            binary_data += str(b & 1)
+    chunks = _iter_shards(images, shards, chunk_size, workers, progress)
+    yield from _inflate(chunks, shards[0][1].codec, chunk_size)
 
-    # Convert binary to bytes
-    byte_data = bytearray()
-    for i in range(0, len(binary_data), 8):
-        byte = binary_data[i:i+8]
-        if len(byte) == 8:
-            byte_data.append(int(byte, 2))
 
-    # Convert to string to find header
+def _run_batch_item(func, index, args):
+    """Run one batch item, turning any exception into a failed BatchResult."""
+    start = time.perf_counter()
     try:
-        # Find the header delimiter
-        decoded_str = byte_data.decode('ascii', errors='ignore')
-        if '###' in decoded_str:
-            header_end = decoded_str.index('###')
-            header = decoded_str[:header_end]
-
-            # Parse header to get sizes
-            if ':' in header:
-                parts = header.split(':')
-                if len(parts) == 2:
-                    original_size = int(parts[0])
-                    compressed_size = int(parts[1])
-
-                    # Calculate where compressed data starts
-                    header_bytes = (header + '###').encode('ascii')
-                    data_start = len(header_bytes)
-
-                    # Extract compressed audio data
-                    compressed_audio = bytes(byte_data[data_start:data_start + compressed_size])
-
-                    # Decompress the audio
-                    audio_bytes = zlib.decompress(compressed_audio)
-
-                    return audio_bytes
+        value, error = func(*args), None
     except Exception as e:
-        # Fallback: try old base64 format for backward compatibility
+        value, error = None, str(e) or type(e).__name__
+    return BatchResult(index, value, error, time.perf_counter() - start)
+
+
+def _run_batch(func, items, concurrency):
+    """
+    Apply func to every item on a thread pool, yielding results as they finish.
+
+    Items are pulled from the iterable only as slots free up, so at most
+    twice `concurrency` items are held in memory at once.
+    """
+    items = iter(enumerate(items))
+    pending = set()
+    run_item = _in_caller_context(_run_batch_item)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch') as pool:
+        while True:
+            for index, args in items:
+                pending.add(pool.submit(run_item, func, index, args))
+                if len(pending) >= concurrency * 2:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def encode_batch(items, concurrency=4, **options):
+    """
+    Encode many (image, message) pairs concurrently.
+
+    Items run on a thread pool (Pillow and NumPy release the GIL for most
+    of the work). A failing item is reported in its result and does not
+    stop the rest of the batch.
+
+    Args:
+        items: Iterable of (image, message) pairs, consumed lazily; images
+            are paths, file-like objects or bytes as for encode()
+        concurrency: Number of items processed at the same time
+        **options: Keyword arguments passed to encode() for every item
+
+    Yields:
+        BatchResult per item in completion order; value is a BytesIO
+        holding the encoded image
+    """
+    def encode_item(image, message):
+        return encode(image, message, **options)
+
+    return _run_batch(encode_item, items, concurrency)
+
+
+def decode_batch(images, concurrency=4, **options):
+    """
+    Decode messages from many images concurrently.
+
+    Args:
+        images: Iterable of images (paths, file-like objects or bytes),
+            consumed lazily
+        concurrency: Number of images decoded at the same time
+        **options: Keyword arguments passed to decode() for every image
+
+    Yields:
+        BatchResult per image in completion order; value is the message
+    """
+    def decode_item(image):
+        return decode(image, **options)
+
+    return _run_batch(decode_item, ((image,) for image in images), concurrency)
+
+
+def _decode_legacy_audio(img, workers=1):
+    """
+    Read audio written in the legacy "size:size###" format.
+
+    Args:
+        img: Image to read from
+        workers: Number of worker processes for extraction
+
+    Returns:
+        The decoded audio bytes, or None if the image holds no legacy audio
+    """
+    # The legacy header is two decimal sizes, which fit in the first 48 bytes
+    prefix = _read_lsb_bytes(img, 0, 48)
+    header_end = prefix.find(b'###')
+    if header_end != -1:
+        parts = prefix[:header_end].split(b':')
+        if len(parts) == 2 and parts[0].isdigit() and parts[1].isdigit():
+            compressed_size = int(parts[1])
+            data_start = header_end + 3
+            if compressed_size <= _capacity_bytes(img) - data_start:
+                compressed_audio = _read_lsb_bytes(img, data_start, compressed_size, workers)
+                try:
+                    return zlib.decompress(compressed_audio)
+                except zlib.error:
+                    pass
+
+    # Fallback: try old base64 format for backward compatibility
+    if _first_control_byte(prefix[:16]) != -1:
+        return None
+    byte_data = _read_lsb_bytes(img, 0, _capacity_bytes(img), workers)
+    end_index = byte_data.find(b'###END###')
+    if end_index != -1:
+        parts = byte_data[:end_index].split(b'###', 1)
+        if len(parts) == 2:
+            try:
+                return base64.b64decode(parts[1])
+            except ValueError:
+                pass
+    return None
+
+
+# Command-line interface
+
+# Carrier files picked up when a directory is given on the command line
+_CLI_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+
+
+def _cli_inputs(patterns):
+    """Expand carrier arguments: directories to their images, glob patterns to their matches."""
+    import glob
+
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths += sorted(os.path.join(pattern, name) for name in os.listdir(pattern)
+                            if name.lower().endswith(_CLI_IMAGE_EXTENSIONS))
+        elif any(c in pattern for c in '*?['):
+            paths += sorted(glob.glob(pattern))
+        else:
+            paths.append(pattern)
+    return paths
+
+
+def _cli_read(path):
+    """Read a payload file, or stdin for '-'."""
+    if path == '-':
+        return sys.stdin.buffer.read()
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _cli_output_path(args, path, extension):
+    """Where the result for one carrier goes: --output, a file in --output-dir, or None for stdout."""
+    if args.output_dir:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(args.output_dir, f'{stem}.{extension}')
+    if args.output and args.output != '-':
+        return args.output
+    return None
+
+
+def _cli_write(output_path, data):
+    if output_path is None:
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+    else:
+        with open(output_path, 'wb') as f:
+            f.write(data)
+
+
+def _cli_encode(args, payload, encoder):
+    """Item function for encode and encode-audio: returns the payload size."""
+    extension = 'png' if args.profile == 'auto' else OUTPUT_PROFILES[args.profile].extension
+
+    def run(path):
+        output = encoder(path, payload)
+        _cli_write(_cli_output_path(args, path, extension), output.getvalue())
+        return len(payload)
+    return run
+
+
+def _cli_decode(args):
+    def run(path):
+        message = decode(path, workers=args.workers, key=args.key)
+        if args.output_dir:
+            _cli_write(_cli_output_path(args, path, 'txt'), message.encode('utf-8'))
+        elif args.many:
+            print(f'{path}: {message}', flush=True)
+        else:
+            print(message, flush=True)
+        return len(message.encode('utf-8'))
+    return run
+
+
+def _cli_decode_audio(args):
+    def run(path):
+        output_path = _cli_output_path(args, path, 'wav')
+        out = sys.stdout.buffer if output_path is None else open(output_path, 'wb')
+        size = 0
+        try:
+            # Stream chunk by chunk, so long recordings never sit in memory
+            for chunk in decode_audio_stream(path, workers=args.workers, key=args.key):
+                out.write(chunk)
+                size += len(chunk)
+            out.flush()
+        finally:
+            if output_path is not None:
+                out.close()
+        return size
+    return run
+
+
+def _cli_capacity(args, audio):
+    def run(path):
+        if audio is None:
+            width, height = image_size(path)
+            capacity = payload_capacity(width, height, args.bits)
+            line = f'{path}: {width}x{height}, {capacity:,} bytes ({capacity / 1024 / 1024:.2f} MB)'
+        else:
+            result = check_audio_capacity(path, audio, bits_per_channel=args.bits, codec=args.codec)
+            verdict = 'fits' if result['fits'] else 'does not fit'
+            line = (f"{path}: {result['width']}x{result['height']}, {result['capacity_bytes']:,} bytes; "
+                    f"audio ~{result['estimated_bytes']:,} bytes with {result['codec']}: {verdict}")
+        print(line, flush=True)
+        return 0
+    return run
+
+
+def _cli_shards(args, paths, audio=None):
+    """encode-audio/decode-audio --shards: treat all carriers as one split payload."""
+    start = time.perf_counter()
+    if args.command == 'encode-audio':
+        extension = 'png' if args.profile == 'auto' else OUTPUT_PROFILES[args.profile].extension
+        output_paths = [_cli_output_path(args, path, extension) for path in paths]
+        encode_audio_shards(paths, audio, output_paths, concurrency=max(1, args.jobs),
+                            workers=args.workers, output_profile=args.profile,
+                            bits_per_channel=args.bits, codec=args.codec, level=args.level)
+        size = len(audio)
+    else:
+        output_path = args.output if args.output and args.output != '-' else None
+        out = sys.stdout.buffer if output_path is None else open(output_path, 'wb')
+        size = 0
+        try:
+            for chunk in decode_audio_shards(paths, workers=args.workers):
+                out.write(chunk)
+                size += len(chunk)
+            out.flush()
+        finally:
+            if output_path is not None:
+                out.close()
+
+    if not args.quiet:
+        elapsed = time.perf_counter() - start
+        print(f'{len(paths)} shards in {elapsed:.3f} s, {size:,} bytes of audio', file=sys.stderr)
+    return 0
+
+
+def main(argv=None):
+    """Entry point for python -m steganography."""
+    parser = argparse.ArgumentParser(prog='python -m steganography',
+                                     description='Hide text and audio in images with LSB steganography')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('images', nargs='+', help='carrier files, directories or glob patterns')
+    common.add_argument('-j', '--jobs', type=int, default=1, help='carriers processed at the same time')
+    common.add_argument('--workers', type=int, default=1, help='worker processes per carrier')
+    common.add_argument('-q', '--quiet', action='store_true', help='do not print per-file timings')
+
+    outputs = argparse.ArgumentParser(add_help=False)
+    outputs.add_argument('-o', '--output', help="output file for a single carrier ('-' for stdout)")
+    outputs.add_argument('--output-dir', help='directory for the results of several carriers')
+    outputs.add_argument('--key', help='secret that scatters the payload over the image '
+                         '(needed again to decode; not supported with --shards)')
+
+    encoding = argparse.ArgumentParser(add_help=False)
+    encoding.add_argument('--profile', default=DEFAULT_OUTPUT_PROFILE,
+                          choices=['auto'] + list(OUTPUT_PROFILES), help='lossless output encoding')
+    encoding.add_argument('--bits', type=int, default=1, help='bits per color channel (1-4)')
+
+    command = commands.add_parser('encode', parents=[common, outputs, encoding], help='hide a text message')
+    command.add_argument('-m', '--message', help='message to hide (default: read from stdin)')
+    command = commands.add_parser('encode-audio', parents=[common, outputs, encoding], help='hide audio')
+    command.add_argument('-a', '--audio', default='-', help="audio file ('-' for stdin)")
+    command.add_argument('--codec', default='auto', choices=['auto'] + list(CODECS))
+    command.add_argument('--level', type=int, help='compression level')
+    command.add_argument('--shards', action='store_true',
+                         help='split the audio across all carriers instead of hiding it in each')
+    commands.add_parser('decode', parents=[common, outputs], help='extract a text message')
+    command = commands.add_parser('decode-audio', parents=[common, outputs], help='extract audio')
+    command.add_argument('--shards', action='store_true',
+                         help='reassemble audio split across all the given images')
+    command = commands.add_parser('capacity', parents=[common], help='show how much a carrier holds')
+    command.add_argument('--audio', help="audio file to check against every carrier ('-' for stdin)")
+    command.add_argument('--bits', type=int, default=1, help='bits per color channel (1-4)')
+    command.add_argument('--codec', default='auto', choices=['auto'] + list(CODECS))
+
+    args = parser.parse_args(argv)
+    paths = _cli_inputs(args.images)
+    if not paths:
+        parser.error('no carrier images found')
+    args.many = len(paths) > 1
+    shards = getattr(args, 'shards', False)
+    if shards and args.key is not None:
+        parser.error('--key is not supported with --shards')
+    if args.command != 'capacity':
+        if (args.many and not args.output_dir and args.command != 'decode'
+                and not (shards and args.command == 'decode-audio')):
+            parser.error('--output-dir is required with several carriers')
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+
+    if shards:
         try:
-            decoded_text = ''
-            for i in range(0, len(binary_data), 8):
-                byte = binary_data[i:i+8]
-                if len(byte) == 8:
-                    try:
-                        char = chr(int(byte, 2))
-                        decoded_text += char
-
-                        if decoded_text.endswith('###END###'):
-                            decoded_text = decoded_text[:-9]
-                            if '###' in decoded_text:
-                                parts = decoded_text.split('###', 1)
-                                if len(parts) == 2:
-                                    audio_b64 = parts[1]
-                                    audio_bytes = base64.b64decode(audio_b64)
-                                    return audio_bytes
-                    except (ValueError, UnicodeDecodeError):
-                        continue
-        except:
-            pass
-
-    raise ValueError("No valid audio data found in image")
+            return _cli_shards(args, paths, _cli_read(args.audio) if args.command == 'encode-audio' else None)
+        except ValueError as e:
+            print(f'FAILED: {e}', file=sys.stderr)
+            return 1
+
+    if args.command == 'encode':
+        message = args.message
+        if message is None:
+            message = sys.stdin.buffer.read().decode('utf-8').rstrip('\n')
+        run = _cli_encode(args, message, lambda path, payload: encode(
+            path, payload, workers=args.workers, output_profile=args.profile,
+            bits_per_channel=args.bits, key=args.key))
+    elif args.command == 'encode-audio':
+        run = _cli_encode(args, _cli_read(args.audio), lambda path, payload: encode_audio(
+            path, payload, workers=args.workers, output_profile=args.profile,
+            bits_per_channel=args.bits, codec=args.codec, level=args.level, key=args.key))
+    elif args.command == 'decode':
+        run = _cli_decode(args)
+    elif args.command == 'decode-audio':
+        run = _cli_decode_audio(args)
+    else:
+        run = _cli_capacity(args, None if args.audio is None else _cli_read(args.audio))
+
+    # Per-file timings go to stderr, so results can be piped from stdout
+    failed = 0
+    total_bytes = 0
+    start = time.perf_counter()
+    for result in _run_batch(run, ((path,) for path in paths), max(1, args.jobs)):
+        path = paths[result.index]
+        if result.error is not None:
+            failed += 1
+            print(f'{path}: FAILED: {result.error}', file=sys.stderr)
+            continue
+        total_bytes += result.value
+        if not args.quiet and args.command != 'capacity':
+            rate = result.value / 1024 / 1024 / result.seconds if result.seconds else 0
+            print(f'{path}: {result.seconds:.3f} s, {result.value:,} bytes, {rate:.2f} MB/s',
+                  file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    if not args.quiet and args.many and args.command != 'capacity':
+        print(f'{len(paths) - failed}/{len(paths)} carriers in {elapsed:.3f} s '
+              f'({len(paths) / elapsed:.2f} files/s, {total_bytes / 1024 / 1024 / elapsed:.2f} MB/s)',
+              file=sys.stderr)
+    return 1 if failed else 0
 
 
+if __name__ == '__main__':
+    sys.exit(main())
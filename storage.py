@@ -0,0 +1,162 @@
+"""
+Managed directory for generated files
+
+Every file gets an unguessable name, so concurrent requests never share or
+overwrite one another's output. The directory is kept under a byte quota by
+evicting the oldest files first, and a background sweeper removes files
+older than the TTL.
+"""
+import os
+import re
+import secrets
+import shutil
+import threading
+import time
+
+# Stored names: a 32 hex digit token, optionally followed by a safe suffix
+_NAME = re.compile(r'[0-9a-f]{32}[A-Za-z0-9_.-]*')
+
+
+class StorageManager:
+    """
+    Bounded store for generated files in one directory.
+
+    Args:
+        directory: Where files are kept (can be a tmpfs mount)
+        max_bytes: Total size kept; the oldest files are evicted beyond it
+        ttl: Seconds a file is kept after it was last written
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, ttl=3600):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evictions = 0
+        self.expired = 0
+        self._sweeper = None
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def new_path(self, suffix=''):
+        """
+        Reserve a unique, unguessable path.
+
+        Args:
+            suffix: Appended to the random token, e.g. '.wav' or '_name.png'
+                (must already be a safe filename fragment)
+
+        Returns:
+            (name, path) where name is what lookup() accepts
+        """
+        name = secrets.token_hex(16) + suffix
+        if not _NAME.fullmatch(name):
+            raise ValueError(f"Unsafe file suffix {suffix!r}")
+        return name, os.path.join(self.directory, name)
+
+    def lookup(self, name):
+        """Path of a stored file, or None if the name is invalid, unknown or expired."""
+        if not _NAME.fullmatch(name):
+            return None
+        path = os.path.join(self.directory, name)
+        try:
+            if os.path.getmtime(path) < time.time() - self.ttl:
+                return None
+        except OSError:
+            return None
+        return path
+
+    def remove(self, path):
+        """Delete a stored file if it still exists."""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def commit(self, path):
+        """Record that a file has been written, evicting older files to stay within the quota."""
+        self.enforce_quota(keep=path)
+
+    def enforce_quota(self, keep=None):
+        """Remove the oldest files until the directory fits max_bytes."""
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                self.remove(path)
+                total -= size
+                self.evictions += 1
+
+    def sweep(self):
+        """Remove files older than the TTL, then enforce the quota."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for mtime, _, path in self._entries():
+                if mtime >= cutoff:
+                    break
+                self.remove(path)
+                self.expired += 1
+        self.enforce_quota()
+
+    def start_sweeper(self, interval=60):
+        """
+        Run sweep() every `interval` seconds on a daemon thread.
+
+        Safe to call on every request: only the first call in a process
+        starts the thread. Call it from the processes that serve requests,
+        not at import time, so a preloading master and the pool processes
+        forked for the engine never run sweepers of their own.
+        """
+        if self._sweeper is not None:
+            return
+        with self._lock:
+            if self._sweeper is not None:
+                return
+
+            def run():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        self.sweep()
+                    except OSError:
+                        pass
+
+            self._sweeper = threading.Thread(target=run, name='storage-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def _after_fork(self):
+        """
+        In a process forked from one that used the manager, the lock may
+        have been copied while held: start it afresh. The sweeper thread
+        does not survive the fork and is only restarted if this process
+        calls start_sweeper() itself.
+        """
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def usage(self):
+        """Bytes and files stored, the quota, and free space on the underlying disk."""
+        entries = self._entries()
+        disk = shutil.disk_usage(self.directory)
+        return {'directory': self.directory, 'files': len(entries),
+                'bytes': sum(size for _, size, _ in entries), 'max_bytes': self.max_bytes,
+                'ttl': self.ttl, 'evictions': self.evictions, 'expired': self.expired,
+                'disk_total': disk.total, 'disk_free': disk.free}
+
+    def _entries(self):
+        """(mtime, size, path) of every stored file, oldest first."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and _NAME.fullmatch(entry.name):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        return entries
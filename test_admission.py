@@ -0,0 +1,69 @@
+"""
+Admission tickets must be released once the server closes the response
+
+    python -m pytest test_admission.py
+"""
+import io
+import os
+import tempfile
+
+from PIL import Image
+from werkzeug.test import EnvironBuilder
+
+from admission import Overloaded
+
+# Keep the app's files out of the working tree
+_workdir = tempfile.mkdtemp(prefix='stego-test-')
+os.environ.update(RATELIMIT_BACKEND='none', DECODE_CACHE_BACKEND='none',
+                  UPLOAD_FOLDER=os.path.join(_workdir, 'uploads'),
+                  OUTPUT_FOLDER=os.path.join(_workdir, 'outputs'))
+_cwd = os.getcwd()
+os.chdir(_workdir)
+try:
+    from app import app, admission
+finally:
+    os.chdir(_cwd)
+
+
+def carrier_png(size=(64, 64)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (120, 80, 40)).save(buffer, 'PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def call_wsgi(path, data):
+    """Run one request through app.wsgi_app, returning (status, app_iter) without closing it."""
+    environ = EnvironBuilder(path=path, method='POST', data=data).get_environ()
+    status = []
+    app_iter = app.wsgi_app(environ, lambda s, headers, exc_info=None: status.append(s))
+    return status[0], app_iter
+
+
+def test_file_response_releases_ticket_on_close():
+    status, app_iter = call_wsgi('/encode', {'image': (carrier_png(), 'carrier.png'),
+                                             'message': 'hello'})
+    assert status.startswith('200')
+    # send_file responses pass straight through; the ticket stays held until the server closes them
+    assert admission.stats()['in_flight'] == 1
+    body = b''.join(app_iter)
+    app_iter.close()
+    assert body.startswith(b'\x89PNG')
+    assert admission.stats()['in_flight'] == 0
+
+
+def test_refused_form_releases_ticket_on_close():
+    status, app_iter = call_wsgi('/encode', {'image': (carrier_png(), 'carrier.png')})
+    assert status.startswith('302')
+    app_iter.close()
+    assert admission.stats()['in_flight'] == 0
+
+
+def test_refused_form_is_shown_again_with_status(monkeypatch):
+    def overloaded(cost):
+        raise Overloaded(2)
+    monkeypatch.setattr(admission, 'admit', overloaded)
+    response = app.test_client().post('/encode-audio', data={'image': (carrier_png(), 'carrier.png')})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '2'
+    assert b'Server is busy' in response.data
@@ -1,33 +1,81 @@
 """
 Test script to calculate audio storage capacity for different image sizes
+
+Usage:
+    python test_capacity.py              # typical audio formats
+    python test_capacity.py song.wav     # plus the compressed size of a real file
+    python test_capacity.py song.wav 2   # with 2 bits per color channel
 """
+import io
+import os
+import sys
+import wave
+
+import numpy as np
+
+from steganography import estimate_compressed_size, payload_capacity
+
+def synthetic_wav(rate, channels, noise, speech=False, seconds=5):
+    """
+    A few seconds of 16-bit PCM WAV: a chord of tones over background noise
+    (its standard deviation in sample units), or for speech a tone broken
+    into syllables with pauses between words
+    """
+    rng = np.random.default_rng(0)
+    t = np.arange(rate * seconds) / rate
+    tones = sum(np.sin(2 * np.pi * f * t) for f in (220, 277, 330, 440)) * 3000
+    if speech:
+        tones *= np.clip(np.sin(2 * np.pi * 4 * t), 0, None) * (np.sin(2 * np.pi * 0.5 * t) > -0.3)
+    frames = np.stack([tones + rng.normal(0, noise, t.size) for _ in range(channels)], axis=1)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(np.clip(frames, -32768, 32767).astype('<i2').tobytes())
+    return buffer.getvalue()
+
+def compression_ratio(sample):
+    """Compressed size of a sample under the 'auto' codec, as a fraction of its size"""
+    return estimate_compressed_size(sample, codec='auto')[0] / len(sample)
+
+# Typical audio formats: (name, bytes per second, compressed size as a
+# fraction of the original). The ratios are measured with the codec 'auto'
+# picks on synthetic samples (tones over noise for WAV, which 'auto' stores
+# with the lossless pcm codec; random bytes standing in for already
+# compressed formats, which are stored as is), so real recordings differ:
+# music with more going on compresses less, quiet speech more.
+AUDIO_FORMATS = [
+    ('WAV 16-bit 44.1 kHz stereo', 176400, compression_ratio(synthetic_wav(44100, 2, noise=600))),
+    ('WAV 16-bit 16 kHz mono (speech)', 32000, compression_ratio(synthetic_wav(16000, 1, noise=100, speech=True))),
+    ('MP3 192 kbps', 24000, compression_ratio(os.urandom(24000 * 5))),
+    ('MP3 128 kbps', 16000, compression_ratio(os.urandom(16000 * 5))),
+    ('Opus/WebM 64 kbps', 8000, compression_ratio(os.urandom(8000 * 5))),
+]
+
+def calculate_capacity(width, height, formats=AUDIO_FORMATS, bits_per_channel=1):
+    """
+    Calculate how much audio data can be stored in an image
+
+    Capacity is what the container format leaves for the payload; durations
+    divide it by the compressed bytes per minute of each audio format.
+    """
+    # Each pixel has 3 channels (R, G, B), each storing bits_per_channel bits, less the container header
+    total_bytes = payload_capacity(width, height, bits_per_channel)
 
-def calculate_capacity(width, height):
-    """Calculate how much audio data can be stored in an image"""
-    # Total pixels
-    total_pixels = width * height
-    
-    # Each pixel has 3 channels (R, G, B), each can store 1 bit
-    total_bits = total_pixels * 3
-    
-    # Convert to bytes
-    total_bytes = total_bits // 8
-    
     # Convert to MB
     total_mb = total_bytes / (1024 * 1024)
-    
-    # Estimate audio duration (assuming ~1MB per minute for compressed audio)
-    # WAV audio is typically 10MB per minute, but with compression (50-70% reduction)
-    # we get approximately 3-5MB per minute
-    min_minutes = total_mb / 5  # Conservative estimate
-    max_minutes = total_mb / 3  # Optimistic estimate
-    
+
+    minutes = {name: total_bytes / (bytes_per_second * ratio * 60)
+               for name, bytes_per_second, ratio in formats}
+
     return {
         'resolution': f'{width}x{height}',
         'total_bytes': total_bytes,
         'total_mb': total_mb,
-        'min_minutes': min_minutes,
-        'max_minutes': max_minutes
+        'minutes': minutes,
+        'min_minutes': min(minutes.values()),
+        'max_minutes': max(minutes.values())
     }
 
 # Common image resolutions
@@ -38,19 +86,34 @@ resolutions = [
     (7680, 4320),   # 8K
 ]
 
-print("=" * 70)
-print("AUDIO STORAGE CAPACITY WITH COMPRESSION")
-print("=" * 70)
-print()
+if __name__ == '__main__':
+    audio_path = sys.argv[1] if len(sys.argv) > 1 else None
+    bits_per_channel = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    if audio_path:
+        with open(audio_path, 'rb') as f:
+            audio_estimate, _ = estimate_compressed_size(f.read(), codec='auto')
 
-for width, height in resolutions:
-    result = calculate_capacity(width, height)
-    print(f"Resolution: {result['resolution']}")
-    print(f"  Storage: {result['total_mb']:.2f} MB ({result['total_bytes']:,} bytes)")
-    print(f"  Audio Duration: {result['min_minutes']:.1f} - {result['max_minutes']:.1f} minutes")
+    print("=" * 70)
+    print("AUDIO STORAGE CAPACITY WITH COMPRESSION")
+    print(f"({bits_per_channel} bit{'s' if bits_per_channel > 1 else ''} per color channel)")
+    print("=" * 70)
+    print()
+    print("Compressed size of each format (measured on synthetic samples):")
+    for name, _, ratio in AUDIO_FORMATS:
+        print(f"  {name}: {ratio:.0%}")
     print()
 
-print("=" * 70)
-print("Note: Actual duration depends on audio quality and compression ratio")
-print("=" * 70)
+    for width, height in resolutions:
+        result = calculate_capacity(width, height, bits_per_channel=bits_per_channel)
+        print(f"Resolution: {result['resolution']}")
+        print(f"  Storage: {result['total_mb']:.2f} MB ({result['total_bytes']:,} bytes)")
+        for name, minutes in result['minutes'].items():
+            print(f"  {name}: {minutes:.1f} minutes")
+        if audio_path:
+            verdict = 'fits' if audio_estimate <= result['total_bytes'] else 'does not fit'
+            print(f"  {os.path.basename(audio_path)} (~{audio_estimate:,} bytes compressed): {verdict}")
+        print()
 
+    print("=" * 70)
+    print("Note: Actual duration depends on the recording; pass a file to check it")
+    print("=" * 70)
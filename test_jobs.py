@@ -0,0 +1,47 @@
+"""
+Job state is shared by every worker through the job database
+
+    python -m pytest test_jobs.py
+"""
+import threading
+import time
+
+from jobs import JobManager, CANCELLED, DONE, QUEUED
+
+
+def wait_for(manager, job_id, states, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job.state in states:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'job stayed {job.state}')
+
+
+def test_other_worker_sees_state_and_result(tmp_path):
+    # Two managers on one database stand in for two gunicorn workers
+    path = str(tmp_path / 'jobs.sqlite3')
+    worker, other = JobManager(path), JobManager(path)
+    job = worker.submit(lambda x, progress: {'path': x}, 'out.png')
+
+    done = wait_for(other, job.id, (DONE,))
+    assert done.result == {'path': 'out.png'}
+    assert done.progress == 1.0
+    assert other.get('unknown') is None
+
+
+def test_other_worker_cancels_queued_job(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    worker, other = JobManager(path, max_workers=1), JobManager(path)
+    gate, closed = threading.Event(), []
+    first = worker.submit(lambda progress: gate.wait())
+    queued = worker.submit(lambda progress: None, cleanup=lambda: closed.append(True))
+
+    assert other.get(queued.id).state == QUEUED
+    assert other.cancel(queued.id)
+    gate.set()
+    assert wait_for(other, queued.id, (CANCELLED,)).state == CANCELLED
+    assert closed == [True]
+    assert wait_for(other, first.id, (DONE,)).state == DONE
+    assert not other.cancel(first.id)
@@ -0,0 +1,55 @@
+"""
+Round trips through the engine's output profiles
+
+    python -m pytest test_steganography.py
+"""
+import contextvars
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from steganography import decode, decode_audio, encode, encode_audio, encode_batch, set_timing_hook
+
+
+def rgba_carrier(size=(120, 80)):
+    pixels = np.random.default_rng(0).integers(0, 256, size[::-1] + (4,), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, 'RGBA').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def test_rgba_carrier_with_bmp_profile_is_saved_as_rgb():
+    output = encode(rgba_carrier(), 'hidden in a bmp', output_profile='bmp')
+    with Image.open(output) as img:
+        assert (img.format, img.mode) == ('BMP', 'RGB')
+    assert decode(output.getvalue()) == 'hidden in a bmp'
+
+
+def test_rgba_audio_with_bmp_profile_round_trips():
+    audio = bytes(range(256)) * 8
+    output = encode_audio(rgba_carrier(), audio, output_profile='bmp', bits_per_channel=2)
+    assert decode_audio(output.getvalue()) == audio
+
+
+@pytest.mark.parametrize('profile', ['png', 'tiff', 'webp'])
+def test_rgba_carrier_keeps_alpha(profile):
+    output = encode(rgba_carrier(), 'hidden', output_profile=profile)
+    with Image.open(output) as img:
+        assert img.mode == 'RGBA'
+    assert decode(output.getvalue()) == 'hidden'
+
+
+def test_batch_stages_run_in_caller_context():
+    label = contextvars.ContextVar('label', default='pool thread')
+    seen = []
+    set_timing_hook(lambda stage, seconds: seen.append(label.get()))
+    token = label.set('caller')
+    try:
+        results = list(encode_batch([(rgba_carrier(), 'one'), (rgba_carrier(), 'two')], concurrency=2))
+    finally:
+        label.reset(token)
+        set_timing_hook(None)
+    assert all(result.error is None for result in results)
+    assert seen and set(seen) == {'caller'}